@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0103,e0401
+"""Contended writes against the Sojobo datastore.
+
+Run on a sojobo-api unit: python3.6 datastore_contention.py [threads] [writes]
+
+Every thread adds its own models to one shared controller and grants one shared
+user access to them, while another thread keeps revoking and restoring that
+user's access. Afterwards every model must be present in the controller, in the
+user's access list and in the model -> users index; any missing entry is a lost
+update.
+
+Then every thread increments one counter in one hash, the read-modify-write
+that WATCH/MULTI exists for: first with a plain read and write, which loses
+updates, then through datastore.transaction(), after which the counter must
+equal the number of increments that did not end in a ConflictError. The
+retries and conflicts of that phase are printed. All keys used live under a
+random bench-* controller, user and counter and are removed at the end."""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+import time
+sys.path.append('/opt')
+from sojobo_api.api import w_datastore as datastore  #pylint: disable=C0413
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def writer(c_name, user, thread, writes):
+    latencies = []
+    for i in range(writes):
+        m_name = 'm-{}-{}'.format(thread, i)
+        start = time.time()
+        datastore.add_model_to_controller(c_name, m_name)
+        datastore.set_model_state(c_name, m_name, 'ready', 'uuid-{}'.format(m_name))
+        datastore.set_model_access(c_name, m_name, user, 'admin')
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def flapper(c_name, user, stop_after):
+    latencies = []
+    while time.time() < stop_after:
+        start = time.time()
+        datastore.set_controller_access(c_name, user, 'login')
+        datastore.set_controller_access(c_name, user, 'superuser')
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def increment_plain(key, increments):
+    con = datastore.connect_to_users()
+    for _ in range(increments):
+        value = int(con.hget(key, 'value') or 0)
+        con.hset(key, 'value', value + 1)
+    return increments
+
+
+def increment_watched(key, increments):
+    con = datastore.connect_to_users()
+
+    def increment(pipe):
+        value = int(pipe.hget(key, 'value') or 0)
+        pipe.multi()
+        pipe.hset(key, 'value', value + 1)
+    done = 0
+    for _ in range(increments):
+        try:
+            datastore.transaction(con, increment, key)
+            done += 1
+        except datastore.ConflictError:
+            pass
+    return done
+
+
+def run_counter(func, key, threads, increments):
+    """The increments that succeeded, the final counter and the seconds it took."""
+    datastore.connect_to_users().delete(key)
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        done = sum(r.result() for r in [pool.submit(func, key, increments) for _ in range(threads)])
+    duration = time.time() - start
+    return done, int(datastore.connect_to_users().hget(key, 'value') or 0), duration
+
+
+def contend_one_key(key, threads, increments):
+    """1 when the transaction lost an increment."""
+    done, value, duration = run_counter(increment_plain, key, threads, increments)
+    print('plain read-modify-write on one key: {} increments, counter {}, {} lost in {:.2f}s'.format(
+        done, value, done - value, duration))
+    before = datastore.get_transaction_stats()
+    done, value, duration = run_counter(increment_watched, key, threads, increments)
+    after = datastore.get_transaction_stats()
+    print('transaction on one key: {} increments, counter {}, {} lost in {:.2f}s'.format(
+        done, value, done - value, duration))
+    print('transaction retries {} conflicts {}'.format(after['retries'] - before['retries'],
+                                                        after['conflicts'] - before['conflicts']))
+    return 1 if value != done else 0
+
+
+def main(threads, writes):
+    suffix = os.urandom(4).hex()
+    c_name, user = 'bench-c-{}'.format(suffix), 'bench-u-{}'.format(suffix)
+    datastore.create_controller(c_name, 'bench', 'none')
+    datastore.create_user(user)
+    datastore.add_user_to_controller(c_name, user, 'superuser')
+    try:
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=threads + 1) as pool:
+            flap = pool.submit(flapper, c_name, user, start + 5)
+            results = [pool.submit(writer, c_name, user, t, writes) for t in range(threads)]
+            latencies = [l for r in results for l in r.result()]
+            flap_latencies = flap.result()
+        duration = time.time() - start
+        expected = {'m-{}-{}'.format(t, i) for t in range(threads) for i in range(writes)}
+        models = {m['name'] for m in datastore.get_all_models(c_name)}
+        ready = {m['name'] for m in datastore.get_all_models(c_name) if m['status'] == 'ready'}
+        access = {m['name'] for m in datastore.get_models_access(c_name, user)}
+        indexed = {m for m in expected if user in datastore.get_users_model(c_name, m)}
+        print('{} writers x {} writes in {:.2f}s ({:.0f} writes/s)'.format(
+            threads, writes, duration, 3 * len(expected) / duration))
+        print('write latency p50 {:.2f}ms p99 {:.2f}ms max {:.2f}ms'.format(
+            1000 * percentile(latencies, 50), 1000 * percentile(latencies, 99), 1000 * max(latencies)))
+        if flap_latencies:
+            print('access flip latency p99 {:.2f}ms'.format(1000 * percentile(flap_latencies, 99)))
+        print('transactions: {}'.format(datastore.get_transaction_stats()))
+        lost = {'models': len(expected - models), 'states': len(expected - ready),
+                'access': len(expected - access), 'index': len(expected - indexed)}
+        print('lost updates: {}'.format(lost))
+        counter_lost = contend_one_key('bench-counter-{}'.format(suffix), threads, writes)
+        return 1 if any(lost.values()) or counter_lost else 0
+    finally:
+        datastore.connect_to_users().delete('bench-counter-{}'.format(suffix))
+        datastore.destroy_controller(c_name)
+        datastore.disable_user(user)
+        con = datastore.connect_to_users()
+        con.srem('users', user)
+        con.delete(datastore.user_key(user))
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 16,
+                  int(sys.argv[2]) if len(sys.argv) > 2 else 200))
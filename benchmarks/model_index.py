@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0103,e0401
+"""Application view of a synthetic model: nested loops against ModelIndex.
+
+Run on a sojobo-api unit: python3.6 model_index.py [applications ...]
+or from the charm source: PYTHONPATH=files python3 benchmarks/model_index.py
+
+For every size a model is generated with that many applications, three units
+and two relations per application and an lxd container on every other machine.
+The per application relation and unit loops get_applications_info used before
+are timed against building the index and reading the same view from it. Both
+views are compared, except for the units of applications whose name is a
+prefix of another one, which the old startswith match got wrong."""
+import sys
+import time
+sys.path.append('/opt')
+from sojobo_api.api.w_index import ModelIndex  #pylint: disable=C0413
+
+
+def synthetic_state(apps):
+    state = {'application': {}, 'unit': {}, 'machine': {}, 'relation': {}}
+    machine = 0
+    for a in range(apps):
+        # app-1 is a prefix of app-10 .. app-19, like mysql and mysql-router
+        name = 'app-{}'.format(a)
+        state['application'][name] = {'name': name, 'charm-url': 'cs:{}-1'.format(name), 'exposed': False,
+                                      'status': {'current': 'active'}}
+        for u in range(3):
+            unit = '{}/{}'.format(name, u)
+            state['unit'][unit] = {'name': unit, 'application': name, 'machine-id': str(machine),
+                                   'public-address': '10.0.0.1', 'private-address': '10.0.0.1',
+                                   'series': 'xenial', 'ports': []}
+            state['machine'][str(machine)] = {'id': str(machine), 'instance-id': 'i-{}'.format(machine),
+                                              'series': 'xenial', 'addresses': None, 'hardware-characteristics': {},
+                                              'agent-status': {'current': 'started'}}
+            if machine % 2 == 0:
+                state['machine']['{}/lxd/0'.format(machine)] = dict(state['machine'][str(machine)])
+            machine += 1
+        other = 'app-{}'.format((a + 1) % apps)
+        state['relation'][str(2 * a)] = {'key': '{}:db {}:db'.format(other, name)}
+        state['relation'][str(2 * a + 1)] = {'key': '{}:cluster'.format(name)}
+    return state
+
+
+def nested_loops(state):
+    result = []
+    for data in state['application'].values():
+        res = {'name': data['name'], 'relations': []}
+        for rels in state['relation'].values():
+            keys = rels['key'].split(" ")
+            if len(keys) == 1 and data['name'] == keys[0].split(":")[0]:
+                res['relations'].extend([{'interface': keys[0].split(":")[1], 'with': keys[0].split(":")[0]}])
+            elif len(keys) == 2 and data['name'] == keys[0].split(":")[0]:
+                res['relations'].extend([{'interface': keys[1].split(":")[1], 'with': keys[1].split(":")[0]}])
+            elif len(keys) == 2 and data['name'] == keys[1].split(":")[0]:
+                res['relations'].extend([{'interface': keys[0].split(":")[1], 'with': keys[0].split(":")[0]}])
+        res['units'] = [u['name'] for n, u in state['unit'].items() if n.startswith(data['name'])]
+        result.append(res)
+    return result
+
+
+def indexed(state):
+    index = ModelIndex(state)
+    return [{'name': name, 'relations': index.relations[name], 'units': [u['name'] for u in index.app_units[name]]}
+            for name in index.applications]
+
+
+def best_of(function, state, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(state)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main(sizes):
+    print('{:>6} {:>12} {:>12} {:>8}'.format('apps', 'loops (ms)', 'index (ms)', 'speedup'))
+    for apps in sizes:
+        state = synthetic_state(apps)
+        repeat = max(3, 2000 // apps)
+        old_time, old = best_of(nested_loops, state, repeat)
+        new_time, new = best_of(indexed, state, repeat)
+        for before, after in zip(old, new):
+            assert before['relations'] == after['relations'], before['name']
+            assert set(after['units']) <= set(before['units']), before['name']
+            assert all(u.split('/')[0] == after['name'] for u in after['units']), after['name']
+        print('{:>6} {:>12.2f} {:>12.2f} {:>7.0f}x'.format(apps, 1000 * old_time, 1000 * new_time, old_time / new_time))
+
+
+if __name__ == '__main__':
+    main([int(a) for a in sys.argv[1:]] or [10, 50, 200, 500])
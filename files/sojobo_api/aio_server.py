@@ -0,0 +1,120 @@
+# !/usr/bin/env python3
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0325,c0103,e0401
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import sys
+from aiohttp import web
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+sys.path.append('/opt')
+from sojobo_api import settings  #pylint: disable=C0413
+from sojobo_api.api import w_errors as errors, w_juju, w_mirror  #pylint: disable=C0413
+from sojobo_api.sojobo_api import APP  #pylint: disable=C0413
+########################################################################################################################
+# THREADS SERVER
+########################################################################################################################
+# The server of server-mode threads. The blueprints stay plain Flask views,
+# this is a bridge and not a native async server. Each request runs its view,
+# and iterates its response, on a thread of EXECUTOR, so server-threads bounds
+# the number of requests handled at the same time. What it does share is the
+# single event loop of this process, all Juju and websocket I/O of every
+# request is multiplexed on it over one connection pool. Only the watch
+# stream, which can stay open for a long time, is an awaited aiohttp handler.
+EXECUTOR = ThreadPoolExecutor(max_workers=int(settings.SERVER_THREADS))
+HOP_BY_HOP = ['connection', 'keep-alive', 'transfer-encoding', 'upgrade']
+
+
+def build_environ(request, body):
+    environ = EnvironBuilder(path=request.path, method=request.method, query_string=request.query_string,
+                             headers=list(request.headers.items()), data=body).get_environ()
+    environ['REMOTE_ADDR'] = request.remote
+    return environ
+
+
+async def dispatch(request):
+    loop = asyncio.get_event_loop()
+    body = await request.read()
+    app_iter, status, headers = await loop.run_in_executor(
+        EXECUTOR, run_wsgi_app, APP, build_environ(request, body))
+    response = web.StreamResponse(status=int(status.split(' ', 1)[0]))
+    for key, value in headers.items():
+        if key.lower() not in HOP_BY_HOP:
+            response.headers.add(key, value)
+    await response.prepare(request)
+    chunks = iter(app_iter)
+    try:
+        while True:
+            chunk = await loop.run_in_executor(EXECUTOR, next, chunks, None)
+            if chunk is None:
+                break
+            await response.write(chunk)
+    finally:
+        if hasattr(app_iter, 'close'):
+            await loop.run_in_executor(EXECUTOR, app_iter.close)
+    await response.write_eof()
+    return response
+
+
+async def watch_model(request):
+    """Native version of the /watch route, so a stream holds no request
+    thread while it waits for deltas."""
+    try:
+        token = await w_juju.authenticate(request.headers['api-key'], w_juju.get_auth(request))
+        _, mod = await w_juju.authorize(token, w_juju.check_input(request.match_info['controller']),
+                                        w_juju.check_input(request.match_info['model']))
+    except HTTPException as e:
+        return web.json_response(e.description, status=e.code)
+    except KeyError:
+        code, response = errors.invalid_data()
+        return web.json_response(response, status=code)
+    mirror, queue = await w_juju.watch_model(mod)
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+    try:
+        await response.prepare(request)
+        while True:
+            message = await w_mirror.next_message(mirror, queue)
+            if message is None:
+                break
+            await response.write(message.encode('utf-8'))
+    finally:
+        await mirror.unsubscribe(queue)
+    return response
+
+
+async def on_startup(app):  #pylint: disable=W0613
+    w_juju.use_event_loop(asyncio.get_event_loop())
+
+
+async def on_shutdown(app):  #pylint: disable=W0613
+    await w_mirror.close_mirrors()
+    await w_juju.POOL.close_all()
+
+
+def create_app():
+    app = web.Application()
+    app.router.add_get('/tengu/controllers/{controller}/models/{model}/watch', watch_model)
+    app.router.add_route('*', '/{tail:.*}', dispatch)
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    return app
+########################################################################################################################
+# START THREADS SERVER
+########################################################################################################################
+if __name__ == '__main__':
+    logging.basicConfig(filename='{}/log/sojobo_api.log'.format(settings.SOJOBO_API_DIR), level=logging.INFO)
+    web.run_app(create_app(), host='127.0.0.1', port=int(settings.SERVER_PORT))
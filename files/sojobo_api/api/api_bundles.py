@@ -2,10 +2,9 @@
 #!/usr/bin/env python3.6
 from functools import wraps
 import requests
-import json
-import yaml
 from flask import request, Blueprint, abort
-from sojobo_api.api.w_juju import create_response
+from sojobo_api.api import w_catalog
+from sojobo_api.api.w_juju import create_response, get_page, page_headers
 from sojobo_api import settings
 
 
@@ -32,44 +31,21 @@ def authenticate(func):
 @BUNDLES.route('', methods=['GET'])
 @authenticate
 def get_bundles():
-    i = 1
-    res = requests.get('https://api.github.com/orgs/{}/repos'.format(REPO))
-    data = []
-    while res.json() != [] and res.status_code == 200:
-        for b in res.json():
-            if 'bundle' in b['name']:
-                data.append({
-                    'name': b['name'],
-                    'description': b['description'],
-                    'json': get_json(b['name']),
-                    'logo': None
-                })
-        i += 1
-        res = requests.get('https://api.github.com/orgs/{}/repos?page={}'.format(REPO, i))
-    return create_response(200, data)
+    cursor, limit = get_page(request.args)
+    try:
+        data, next_cursor = w_catalog.get_bundles(cursor, limit)
+    except (w_catalog.CatalogError, requests.RequestException) as e:
+        abort(503, 'The bundle catalog is not available: {}'.format(e))
+    return create_response(200, data, headers=page_headers(next_cursor))
 
 
 @BUNDLES.route('/<bundle>', methods=['GET'])
 @authenticate
 def get_bundle(bundle):
-    res = requests.get('https://api.github.com/repos/{}/{}'.format(REPO, bundle))
-    if res.status_code == 200:
-        data = {
-            'name': res.json()['name'],
-            'description': res.json()['description'],
-            'json': get_json(res.json()['name']),
-            'logo': None
-        }
-        return create_response(200, data)
-    else:
-        abort(404, 'The bundle {}:{} could not be found'.format(REPO, bundle))
-
-
-def get_json(bundle):
-    res = requests.get('https://raw.githubusercontent.com/{}/{}/master/bundle.yaml'.format(REPO, bundle))
-    if res.status_code == 200:
-        res_dict = yaml.load(res.text)
-        json_file = json.dumps(res_dict)
-        return json_file
-    else:
+    try:
+        data = w_catalog.get_bundle(bundle)
+    except (w_catalog.CatalogError, requests.RequestException) as e:
+        abort(503, 'The bundle catalog is not available: {}'.format(e))
+    if data is None:
         abort(404, 'The bundle {}:{} could not be found'.format(REPO, bundle))
+    return create_response(200, data)
@@ -18,7 +18,9 @@ import shutil
 import tempfile
 import zipfile
 from flask import send_file, request, Blueprint
-from sojobo_api.api import w_errors as errors, w_juju as juju
+from juju.errors import JujuError
+from sojobo_api.api import w_batch, w_cache, w_errors as errors, w_juju as juju
+from sojobo_api.api.w_cache import cached
 from sojobo_api.api.w_juju import execute_task
 
 
@@ -32,17 +34,97 @@ def get():
 @TENGU.route('/login', methods=['POST'])
 def login():
     try:
-        execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
+        code, response = 200, execute_task(juju.create_session, token)
+    except KeyError:
+        code, response = errors.invalid_data()
+    return juju.create_response(code, response)
+
+
+@TENGU.route('/login', methods=['DELETE'])
+def logout():
+    try:
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
+        execute_task(juju.remove_session, token)
         code, response = 200, 'Success'
     except KeyError:
         code, response = errors.invalid_data()
     return juju.create_response(code, response)
 
 
+@TENGU.route('/stats', methods=['GET'])
+def get_stats():
+    try:
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
+        if token.is_admin:
+            response = execute_task(juju.get_stats)
+            response['response-cache'] = w_cache.stats()
+            code = 200
+        else:
+            code, response = errors.no_permission()
+    except KeyError:
+        code, response = errors.invalid_data()
+    return juju.create_response(code, response)
+
+
+@TENGU.route('/jobs', methods=['GET'])
+def get_jobs():
+    try:
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
+        code, response = 200, execute_task(juju.get_jobs, token)
+    except KeyError:
+        code, response = errors.invalid_data()
+    return juju.create_response(code, response)
+
+
+@TENGU.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
+        job = execute_task(juju.get_job, token, job_id)
+        if job is None:
+            code, response = errors.does_not_exist('job')
+        else:
+            code, response = 200, job
+    except KeyError:
+        code, response = errors.invalid_data()
+    return juju.create_response(code, response)
+
+
+@TENGU.route('/jobs/<job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    job = None
+    try:
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
+        job = execute_task(juju.retry_job, token, job_id)
+        code, response = 202, 'Process being handeled'
+    except KeyError:
+        code, response = errors.invalid_data()
+    return juju.create_response(code, response, headers=juju.job_headers(job))
+
+
+@TENGU.route('/batch', methods=['POST'])
+def run_batch():
+    data = request.json
+    try:
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
+        con, mod = execute_task(juju.authorize, token, juju.check_input(data['controller']), juju.check_input(data['model']))
+        if mod.m_access == 'write' or mod.m_access == 'admin':
+            operations = w_batch.parse_operations(data['operations'])
+            response = execute_task(w_batch.run_batch, token, mod, operations)
+            code = 200 if all(r['state'] == 'done' for r in response) else 207
+        else:
+            code, response = errors.no_permission()
+    except KeyError:
+        code, response = errors.invalid_data()
+    return juju.create_response(code, response)
+
+
 @TENGU.route('/controllers', methods=['GET'])
+@cached
 def get_all_controllers():
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         if token.is_admin:
             code, response = 200, execute_task(juju.get_all_controllers)
         else:
@@ -54,31 +136,33 @@ def get_all_controllers():
 
 @TENGU.route('/controllers', methods=['POST'])
 def create_controller():
+    job = None
     if request.json is None:
         data = request.form
     else:
         data = request.json
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         if token.is_admin:
             controller = juju.check_input(data['controller'])
             c_type = execute_task(juju.check_c_type, data['type'])
             if execute_task(juju.controller_exists, controller):
                 code, response = errors.already_exists('controller')
             else:
-                code, response = execute_task(juju.create_controller, c_type,
-                                              controller, data['region'], data['credentials'])
+                code, response, job = execute_task(juju.create_controller, c_type,
+                                                   controller, data['region'], data['credentials'])
         else:
             code, response = errors.no_permission()
     except KeyError:
         code, response = errors.invalid_data()
-    return juju.create_response(code, response)
+    return juju.create_response(code, response, headers=juju.job_headers(job))
 
 
 @TENGU.route('/controllers/<controller>', methods=['GET'])
+@cached
 def get_controller_info(controller):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         con = execute_task(juju.authorize, token, juju.check_input(controller))
         code, response = 200, execute_task(juju.get_controller_info, token, con)
     except KeyError:
@@ -89,7 +173,7 @@ def get_controller_info(controller):
 @TENGU.route('/controllers/<controller>', methods=['DELETE'])
 def delete_controller(controller):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con = execute_task(juju.authorize, token, juju.check_input(controller))
         if con.c_access == 'superuser':
             execute_task(juju.delete_controller, con)
@@ -103,38 +187,47 @@ def delete_controller(controller):
 
 @TENGU.route('/controllers/<controller>/models', methods=['POST'])
 def create_model(controller):
+    job = None
     data = request.json
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con = execute_task(juju.authorize, token, juju.check_input(controller))
         model = juju.check_input(data['model'])
         credentials = juju.check_input(data['credential'])
         if con.c_access == 'add-model' or con.c_access == 'superuser':
-            code, response = execute_task(juju.create_model, token, con.c_name, model, credentials)
+            code, response, job = execute_task(juju.create_model, token, con.c_name, model, credentials)
         else:
             code, response = errors.no_permission()
     except KeyError:
         code, response = errors.invalid_data()
-    return juju.create_response(code, response)
+    return juju.create_response(code, response, headers=juju.job_headers(job))
 
 
 @TENGU.route('/controllers/<controller>/models', methods=['GET'])
+@cached
 def get_models_info(controller):
+    headers = None
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         con = execute_task(juju.authorize, token, juju.check_input(controller))
-        code, response = 200, execute_task(juju.get_models_info, token, con)
+        cursor, limit = juju.get_page(request.args)
+        fields = juju.check_fields(request.args.get('fields'), juju.MODEL_LIST_FIELDS)
+        models, next_cursor = execute_task(juju.get_models_page, con, cursor, limit,
+                                           request.args.get('status'), request.args.get('owner'))
+        code, response = 200, juju.project(models, fields)
+        headers = juju.page_headers(next_cursor)
     except KeyError:
         code, response = errors.invalid_data()
-    return juju.create_response(code, response)
+    return juju.create_response(code, response, headers=headers)
 
 
 @TENGU.route('/controllers/<controller>/models/<model>', methods=['GET'])
 def get_model_info(controller, model):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
-        code, response = 200, execute_task(juju.get_model_info, token, con, mod)
+        fields = juju.check_fields(request.args.get('fields'), juju.MODEL_FIELDS)
+        code, response = 200, execute_task(juju.get_model_info, token, con, mod, fields)
     except KeyError:
         code, response = errors.invalid_data()
     return juju.create_response(code, response)
@@ -142,24 +235,37 @@ def get_model_info(controller, model):
 
 @TENGU.route('/controllers/<controller>/models/<model>', methods=['POST'])
 def add_bundle(controller, model):
+    job = None
     try:
         data = request.json
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         if mod.m_access == 'admin' or mod.m_access == 'write':
-            execute_task(juju.add_bundle, token, con.c_name, mod.m_name, data['bundle'])
+            job = execute_task(juju.add_bundle, token, con.c_name, mod.m_name, data['bundle'])
             code, response = 202, "Bundle is being deployed"
         else:
             code, response = errors.no_permission()
     except KeyError:
         code, response = errors.invalid_data()
+    return juju.create_response(code, response, headers=juju.job_headers(job))
+
+
+@TENGU.route('/controllers/<controller>/models/<model>/watch', methods=['GET'])
+def watch_model(controller, model):
+    try:
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
+        _, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
+        mirror, queue = execute_task(juju.watch_model, mod)
+        return juju.create_stream(juju.stream_model(mirror, queue))
+    except KeyError:
+        code, response = errors.invalid_data()
     return juju.create_response(code, response)
 
 
 @TENGU.route('/controllers/<controller>/models/<model>', methods=['DELETE'])
 def delete_model(controller, model):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         if mod.m_access == 'admin':
             code, response = 200, execute_task(juju.delete_model, token, con, mod)
@@ -171,21 +277,29 @@ def delete_model(controller, model):
 
 
 @TENGU.route('/controllers/<controller>/models/<model>/applications', methods=['GET'])
+@cached
 def get_applications_info(controller, model):
+    headers = None
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
-        code, response = 200, execute_task(juju.get_applications_info, token, mod)
+        cursor, limit = juju.get_page(request.args)
+        fields = juju.check_fields(request.args.get('fields'), juju.APPLICATION_FIELDS)
+        applications = execute_task(juju.get_applications_info, token, mod,
+                                    request.args.get('status'), request.args.get('series'))
+        applications, next_cursor = juju.paginate(applications, cursor, limit)
+        code, response = 200, juju.project(applications, fields)
+        headers = juju.page_headers(next_cursor, juju.state_headers(mod))
     except KeyError:
         code, response = errors.invalid_data()
-    return juju.create_response(code, response)
+    return juju.create_response(code, response, headers=headers)
 
 
 @TENGU.route('/controllers/<controller>/models/<model>/applications', methods=['POST'])
 def add_application(controller, model):
     data = request.json
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         if execute_task(juju.app_exists, token, con, mod, data['application']):
             code, response = errors.already_exists('application')
@@ -198,21 +312,24 @@ def add_application(controller, model):
                 units = juju.check_input(data.get('units', "1"))
                 app = juju.check_input(data['application'])
                 execute_task(juju.deploy_app, token, mod, app, name=app_name, ser=series, tar=machine, con=config, num_of_units=int(units))
-                code, response = 200, execute_task(juju.get_application_info, token, mod, app)
+                code, response = 200, execute_task(juju.get_deployed_application, token, mod, app_name or app)
             else:
                 code, response = errors.no_permission()
     except KeyError:
         code, response = errors.invalid_data()
+    except JujuError as e:
+        code, response = errors.juju_error(e)
     return juju.create_response(code, response)
 
 
 @TENGU.route('/controllers/<controller>/models/<model>/applications/<application>', methods=['GET'])
+@cached
 def get_application_info(controller, model, application):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         app = juju.check_input(application)
-        if execute_task(juju.app_exists, token, con, mod, app):
+        if execute_task(juju.app_exists, token, con, mod, app, live=False):
             code, response = 200, execute_task(juju.get_application_info, token, mod, app)
         else:
             code, response = errors.does_not_exist('application')
@@ -225,18 +342,20 @@ def get_application_info(controller, model, application):
 def expose_application(controller, model, application):
     data = request.json
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         app = juju.check_input(application)
         exposed = True if data['expose'] == "True" else False
-        if execute_task(juju.check_if_exposed, token, mod, app) == exposed:
-            code, response = 200, execute_task(juju.get_application_info, token, mod, app)
+        if not execute_task(juju.app_exists, token, con, mod, app):
+            code, response = errors.does_not_exist('application')
+        elif execute_task(juju.check_if_exposed, token, mod, app) == exposed:
+            code, response = 200, execute_task(juju.get_exposed_application, token, mod, app, exposed)
         else:
             if exposed:
                 execute_task(juju.expose_app, token, mod, app)
             else:
                 execute_task(juju.unexpose_app, token, mod, app)
-            code, response = 200, execute_task(juju.get_application_info, token, mod, app)
+            code, response = 200, execute_task(juju.get_exposed_application, token, mod, app, exposed)
     except KeyError:
         code, response = errors.invalid_data()
     return juju.create_response(code, response)
@@ -245,7 +364,7 @@ def expose_application(controller, model, application):
 @TENGU.route('/controllers/<controller>/models/<model>/applications/<application>', methods=['DELETE'])
 def remove_app(controller, model, application):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         app = juju.check_input(application)
         if mod.m_access == 'write' or mod.m_access == 'admin':
@@ -264,7 +383,7 @@ def remove_app(controller, model, application):
 @TENGU.route('/controllers/<controller>/models/<model>/applications/<application>/config', methods=['GET'])
 def get_application_config(controller, model, application):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         app = juju.check_input(application)
         code, response = 200, execute_task(juju.get_application_config, token, mod, app)
@@ -277,7 +396,7 @@ def get_application_config(controller, model, application):
 def set_application_config(controller, model, application):
     data = request.json
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         if mod.m_access == 'write' or mod.m_access == 'admin':
             app = juju.check_input(application)
@@ -291,36 +410,46 @@ def set_application_config(controller, model, application):
 
 
 @TENGU.route('/controllers/<controller>/models/<model>/machines/', methods=['GET'])
+@cached
 def get_machines_info(controller, model):
+    headers = None
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
-        code, response = 200, execute_task(juju.get_machines_info, token, mod)
+        cursor, limit = juju.get_page(request.args)
+        fields = juju.check_fields(request.args.get('fields'), juju.MACHINE_FIELDS)
+        machines = execute_task(juju.get_machines_info, token, mod, request.args.get('status'), request.args.get('series'))
+        machines, next_cursor = juju.paginate(machines, cursor, limit)
+        code, response = 200, juju.project(machines, fields)
+        headers = juju.page_headers(next_cursor, juju.state_headers(mod))
     except KeyError:
         code, response = errors.invalid_data()
-    return juju.create_response(code, response)
+    return juju.create_response(code, response, headers=headers)
 
 
 @TENGU.route('/controllers/<controller>/models/<model>/machines/<machine>', methods=['GET'])
+@cached
 def get_machine_info(controller, model, machine):
+    headers = None
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         mach = juju.check_input(machine)
-        if execute_task(juju.machine_exists, token, mod, mach):
+        if execute_task(juju.machine_exists, token, mod, mach, live=False):
             code, response = 200, execute_task(juju.get_machine_info, token, mod, mach)
+            headers = juju.state_headers(mod)
         else:
             code, response = errors.does_not_exist('machine')
     except KeyError:
         code, response = errors.invalid_data()
-    return juju.create_response(code, response)
+    return juju.create_response(code, response, headers=headers)
 
 
 @TENGU.route('/controllers/<controller>/models/<model>/machines', methods=['POST'])
 def add_machine(controller, model):
     data = request.json
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         if mod.m_access == 'write' or mod.m_access == 'admin':
             series = juju.check_input(data.get('series', None), True)
@@ -339,13 +468,14 @@ def add_machine(controller, model):
 
 @TENGU.route('/controllers/<controller>/models/<model>/machines/<machine>', methods=['DELETE'])
 def remove_machine(controller, model, machine):
+    job = None
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         mach = juju.check_input(machine)
         if execute_task(juju.machine_exists, token, mod, mach):
             if mod.m_access == 'write' or mod.m_access == 'admin':
-                execute_task(juju.remove_machine, token, con, mod, mach)
+                job = execute_task(juju.remove_machine, token, con, mod, mach)
                 code, response = 202, 'Machine being removed'
             else:
                 code, response = errors.no_permission()
@@ -353,34 +483,38 @@ def remove_machine(controller, model, machine):
             code, response = errors.does_not_exist('machine')
     except KeyError:
         code, response = errors.invalid_data()
-    return juju.create_response(code, response)
+    return juju.create_response(code, response, headers=juju.job_headers(job))
 
 
 @TENGU.route('/controllers/<controller>/models/<model>/applications/<application>/units', methods=['GET'])
+@cached
 def get_units_info(controller, model, application):
+    headers = None
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         app = juju.check_input(application)
-        if execute_task(juju.app_exists, token, con, mod, app):
+        if execute_task(juju.app_exists, token, con, mod, app, live=False):
             code, response = 200, execute_task(juju.get_units_info, token, mod, app)
+            headers = juju.state_headers(mod)
         else:
             code, response = errors.does_not_exist('application')
     except KeyError:
         code, response = errors.invalid_data()
-    return juju.create_response(code, response)
+    return juju.create_response(code, response, headers=headers)
 
 
 @TENGU.route('/controllers/<controller>/models/<model>/applications/<application>/units', methods=['POST'])
 def add_unit(controller, model, application):
+    job = None
     data = request.json
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         app = juju.check_input(application)
         if execute_task(juju.app_exists, token, con, mod, app):
             if mod.m_access == 'write' or mod.m_access == 'admin':
-                execute_task(juju.add_unit, token, con, mod, application, data.get('amount', 1), data.get('target', 'None'))
+                job = execute_task(juju.add_unit, token, con, mod, application, data.get('amount', 1), data.get('target', 'None'))
                 code, response = 202, "Units being created"
             else:
                 code, response = errors.no_permission()
@@ -388,13 +522,13 @@ def add_unit(controller, model, application):
             code, response = errors.does_not_exist('application')
     except KeyError:
         code, response = errors.invalid_data()
-    return juju.create_response(code, response)
+    return juju.create_response(code, response, headers=juju.job_headers(job))
 
 
 @TENGU.route('/controllers/<controller>/models/<model>/applications/<application>/units/<unitnumber>', methods=['DELETE'])
 def remove_unit(controller, model, application, unitnumber):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         app = juju.check_input(application)
         unum = juju.check_input(unitnumber)
@@ -412,9 +546,10 @@ def remove_unit(controller, model, application, unitnumber):
 
 
 @TENGU.route('/controllers/<controller>/models/<model>/applications/<application>/units/<unitnumber>', methods=['GET'])
+@cached
 def get_unit_info(controller, model, application, unitnumber):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         app = juju.check_input(application)
         unum = juju.check_input(unitnumber)
@@ -429,9 +564,10 @@ def get_unit_info(controller, model, application, unitnumber):
 
 
 @TENGU.route('/controllers/<controller>/models/<model>/relations', methods=['GET'])
+@cached
 def get_relations_info(controller, model):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         code, response = 200, execute_task(juju.get_relations_info, token, mod)
     except KeyError:
@@ -443,13 +579,13 @@ def get_relations_info(controller, model):
 def add_relation(controller, model):
     data = request.json
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         app1, app2 = juju.check_input(data['app1']), juju.check_input(data['app2'])
         if execute_task(juju.app_exists, token, con, mod, app1) and execute_task(juju.app_exists, token, con, mod, app2):
             if mod.m_access == 'write' or mod.m_access == 'admin':
                 execute_task(juju.add_relation, token, mod, app1, app2)
-                code, response = 200, execute_task(juju.get_relations_info, token, mod)
+                code, response = 200, execute_task(juju.get_added_relation, token, mod, app1, app2)
             else:
                 code, response = errors.no_permission()
         else:
@@ -460,12 +596,13 @@ def add_relation(controller, model):
 
 
 @TENGU.route('/controllers/<controller>/models/<model>/relations/<application>', methods=['GET'])
+@cached
 def get_relations(controller, model, application):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         app = juju.check_input(application)
-        if execute_task(juju.app_exists, token, con, mod, app):
+        if execute_task(juju.app_exists, token, con, mod, app, live=False):
             code, response = 200, execute_task(juju.get_application_info, token, mod, app)['relations']
         else:
             code, response = errors.does_not_exist('application')
@@ -477,7 +614,7 @@ def get_relations(controller, model, application):
 @TENGU.route('/controllers/<controller>/models/<model>/relations/<app1>/<app2>', methods=['DELETE'])
 def remove_relation(controller, model, app1, app2):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         appl1, appl2 = juju.check_input(app1), juju.check_input(app2)
         if execute_task(juju.app_exists, token, con, mod, appl1) and execute_task(juju.app_exists, token, con, mod, appl2):
@@ -498,7 +635,7 @@ def remove_relation(controller, model, app1, app2):
 @TENGU.route('/backup', methods=['GET'])
 def backup_controllers():
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         if token.is_admin:
             apidir = juju.get_api_dir()
             homedir = '/home/{}/.local/share/juju'.format(juju.get_api_user())
@@ -525,7 +662,7 @@ def backup_controllers():
 @TENGU.route('/restore', methods=['POST'])
 def restore_controllers():
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         if token.is_admin:
             homedir = '/home/{}/.local/share/juju'.format(juju.get_api_user())
             if 'backup' in request.files:
@@ -19,6 +19,7 @@
 from flask import request, Blueprint
 
 from sojobo_api.api import w_errors as errors, w_juju as juju
+from sojobo_api.api.w_cache import cached
 from sojobo_api.api.w_juju import execute_task
 
 
@@ -30,25 +31,34 @@ def get():
 
 
 @USERS.route('/', methods=['GET'])
+@cached
 def get_users_info():
+    headers = None
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
-        code, response = 200, execute_task(juju.get_users_info, token)
+        token = juju.request_token(request)
+        cursor, limit = juju.get_page(request.args)
+        fields = juju.check_fields(request.args.get('fields'), juju.USER_FIELDS)
+        status = request.args.get('status', 'active')
+        if status in ['active', 'disabled']:
+            response, next_cursor = execute_task(juju.get_users_info, token, cursor, limit, status == 'active', fields)
+            code, headers = 200, juju.page_headers(next_cursor)
+        else:
+            code, response = errors.invalid_option(status)
     except KeyError:
         code, response = errors.invalid_data()
-    return juju.create_response(code, response)
+    return juju.create_response(code, response, headers=headers)
 
 
 @USERS.route('/', methods=['PUT'])
 def reactivate_user():
     data = request.json
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         user = juju.check_input(data['username'])
         if token.is_admin:
             if execute_task(juju.user_exists, user):
-                execute_task(juju.enable_user, token, user)
-                code, response = 200, 'User {} succesfully activated'.format(user)
+                results = execute_task(juju.enable_user, token, user)
+                code, response = juju.fan_out_response(results, 'User {} succesfully activated'.format(user))
         else:
             code, response = errors.unauthorized()
     except KeyError:
@@ -60,14 +70,16 @@ def reactivate_user():
 def create_user():
     data = request.json
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         user = juju.check_input(data['username'])
         if token.is_admin:
-            if execute_task(juju.user_exists, user):
+            # Sending the create of a user again finishes it on the controllers it failed on.
+            missing = execute_task(juju.get_missing_controllers, user) if execute_task(juju.user_exists, user) else None
+            if missing == []:
                 code, response = errors.already_exists('user')
             elif data['password']:
-                execute_task(juju.create_user, token, user, data['password'])
-                code, response = 200, 'User {} succesfully created'.format(user)
+                results = execute_task(juju.create_user, token, user, data['password'], missing)
+                code, response = juju.fan_out_response(results, 'User {} succesfully created'.format(user))
             else:
                 code, response = errors.empty()
         else:
@@ -78,9 +90,10 @@ def create_user():
 
 
 @USERS.route('/<user>', methods=['GET'])
+@cached
 def get_user_info(user):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         user = juju.check_input(user)
         if execute_task(juju.user_exists, user):
             if user == token.username or token.is_admin:
@@ -97,12 +110,12 @@ def get_user_info(user):
 @USERS.route('/<user>', methods=['PUT'])
 def change_user_password(user):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         usr = juju.check_input(user)
         if execute_task(juju.user_exists, usr):
             if usr == token.username or token.is_admin:
-                execute_task(juju.change_user_password, token, usr, request.json['password'])
-                code, response = 200, 'succesfully changed password for user {}'.format(usr)
+                results = execute_task(juju.change_user_password, token, usr, request.json['password'])
+                code, response = juju.fan_out_response(results, 'succesfully changed password for user {}'.format(usr))
             else:
                 code, response = errors.unauthorized()
         else:
@@ -115,13 +128,13 @@ def change_user_password(user):
 @USERS.route('/<user>', methods=['DELETE'])
 def delete_user(user):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         usr = juju.check_input(user)
         if token.is_admin:
             if execute_task(juju.user_exists, usr):
                 if usr != 'admin':
-                    execute_task(juju.delete_user, token, usr)
-                    code, response = 200, 'User {} succesfully removed'.format(usr)
+                    results = execute_task(juju.delete_user, token, usr)
+                    code, response = juju.fan_out_response(results, 'User {} succesfully removed'.format(usr))
                 else:
                     code, response = 403, 'This would remove the admin from the system!'
             else:
@@ -134,9 +147,10 @@ def delete_user(user):
 
 
 @USERS.route('/<user>/ssh', methods=['GET'])
+@cached
 def get_ssh_keys(user):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         if token.is_admin or token.username == user:
             code, response = 200, execute_task(juju.get_ssh_keys_user, user)
         else:
@@ -148,40 +162,43 @@ def get_ssh_keys(user):
 
 @USERS.route('/<user>/ssh', methods=['POST'])
 def add_ssh_key(user):
+    job = None
     data = request.json
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         user = juju.check_input(user)
         if token.is_admin or token.username == user:
-            execute_task(juju.add_ssh_key_user, user, data['ssh-key'])
+            job = execute_task(juju.add_ssh_key_user, user, data['ssh-key'])
             code, response = 202, 'Process being handeled'
         else:
             code, response = errors.unauthorized()
     except KeyError:
         code, response = errors.invalid_data()
-    return juju.create_response(code, response)
+    return juju.create_response(code, response, headers=juju.job_headers(job))
 
 
 @USERS.route('/<user>/ssh', methods=['DELETE'])
 def delete_ssh_key(user):
+    job = None
     data = request.json
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         user = juju.check_input(user)
         if token.is_admin or token.username == user:
-            execute_task(juju.remove_ssh_key_user, user, data['ssh-key'])
+            job = execute_task(juju.remove_ssh_key_user, user, data['ssh-key'])
             code, response = 202, 'Process being handeled'
         else:
             code, response = errors.unauthorized()
     except KeyError:
         code, response = errors.invalid_data()
-    return juju.create_response(code, response)
+    return juju.create_response(code, response, headers=juju.job_headers(job))
 
 
 @USERS.route('/<user>/credentials', methods=['GET'])
+@cached
 def get_credentials(user):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         usr = juju.check_input(user)
         if token.is_admin or token.username == usr:
             code, response = 200, juju.execute_task(juju.get_credentials, token, usr)
@@ -194,40 +211,43 @@ def get_credentials(user):
 
 @USERS.route('/<user>/credentials', methods=['POST'])
 def add_credential(user):
+    job = None
     data = request.json
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         usr = juju.check_input(user)
         if token.is_admin or token.username == usr:
-            execute_task(juju.add_credential, usr, data['c_type'], data['name'], data['credentials'])
+            job = execute_task(juju.add_credential, usr, data['c_type'], data['name'], data['credentials'])
             code, response = 202, 'Process being handeled'
         else:
             code, response = errors.unauthorized()
     except KeyError:
         code, response = errors.invalid_data()
-    return juju.create_response(code, response)
+    return juju.create_response(code, response, headers=juju.job_headers(job))
 
 
 @USERS.route('/<user>/credentials', methods=['DELETE'])
 def remove_credential(user):
+    job = None
     data = request.json
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         usr = juju.check_input(user)
         if token.is_admin or token.username == usr:
-            execute_task(juju.remove_credential, usr, data['name'])
+            job = execute_task(juju.remove_credential, usr, data['name'])
             code, response = 202, 'Process being handeled'
         else:
             code, response = errors.unauthorized()
     except KeyError:
         code, response = errors.invalid_data()
-    return juju.create_response(code, response)
+    return juju.create_response(code, response, headers=juju.job_headers(job))
 
 
 @USERS.route('/<user>/controllers', methods=['GET'])
+@cached
 def get_controllers_access(user):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         usr = juju.check_input(user)
         if execute_task(juju.user_exists, usr):
             if token.is_admin or token.username == usr:
@@ -242,9 +262,10 @@ def get_controllers_access(user):
 
 
 @USERS.route('/<user>/controllers/<controller>', methods=['GET'])
+@cached
 def get_ucontroller_access(user, controller):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         con = execute_task(juju.authorize, token, juju.check_input(controller))
         usr = juju.check_input(user)
         if execute_task(juju.user_exists, usr):
@@ -261,14 +282,15 @@ def get_ucontroller_access(user, controller):
 
 @USERS.route('/<user>/controllers/<controller>', methods=['PUT'])
 def grant_to_controller(user, controller):
+    job = None
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con = execute_task(juju.authorize, token, juju.check_input(controller))
         usr = juju.check_input(user)
         if (token.is_admin or con.c_access == 'superuser') and usr != 'admin':
             access = juju.check_access(request.json['access'])
             if execute_task(juju.user_exists, usr):
-                execute_task(juju.add_user_to_controller, token, con, usr, access)
+                job = execute_task(juju.add_user_to_controller, token, con, usr, access)
                 code, response = 202, 'Process being handeled'
             else:
                 code, response = errors.does_not_exist('user')
@@ -276,13 +298,13 @@ def grant_to_controller(user, controller):
             code, response = errors.unauthorized()
     except KeyError:
         code, response = errors.invalid_data()
-    return juju.create_response(code, response)
+    return juju.create_response(code, response, headers=juju.job_headers(job))
 
 
 @USERS.route('/<user>/controllers/<controller>', methods=['DELETE'])
 def revoke_from_controller(user, controller):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con = execute_task(juju.authorize, token, juju.check_input(controller))
         usr = juju.check_input(user)
         if (token.is_admin or con.c_access == 'superuser' or token.username == usr) and usr != 'admin':
@@ -301,9 +323,10 @@ def revoke_from_controller(user, controller):
 
 
 @USERS.route('/<user>/controllers/<controller>/models', methods=['GET'])
+@cached
 def get_models_access(user, controller):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         con = execute_task(juju.authorize, token, juju.check_input(controller))
         usr = juju.check_input(user)
         if execute_task(juju.user_exists, usr):
@@ -321,9 +344,10 @@ def get_models_access(user, controller):
 
 
 @USERS.route('/<user>/controllers/<controller>/models/<model>', methods=['GET'])
+@cached
 def get_model_access(user, controller, model):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = juju.request_token(request)
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         usr = juju.check_input(user)
         if execute_task(juju.user_exists, usr):
@@ -341,14 +365,15 @@ def get_model_access(user, controller, model):
 
 @USERS.route('/<user>/controllers/<controller>/models/<model>', methods=['PUT'])
 def grant_to_model(user, controller, model):
+    job = None
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         usr = juju.check_input(user)
         if (token.is_admin or mod.m_access == 'admin' or con.c_access == 'superuser') and user != 'admin':
             access = juju.check_access(request.json['access'])
             if execute_task(juju.user_exists, user):
-                execute_task(juju.add_user_to_model, token, con, mod, usr, access)
+                job = execute_task(juju.add_user_to_model, token, con, mod, usr, access)
                 code, response = 202, 'Process being handeled'
             else:
                 code, response = errors.does_not_exist('user')
@@ -356,13 +381,13 @@ def grant_to_model(user, controller, model):
             code, response =  errors.unauthorized()
     except KeyError:
         code, response = errors.invalid_data()
-    return juju.create_response(code, response)
+    return juju.create_response(code, response, headers=juju.job_headers(job))
 
 
 @USERS.route('/<user>/controllers/<controller>/models/<model>', methods=['DELETE'])
 def revoke_from_model(user, controller, model):
     try:
-        token = execute_task(juju.authenticate, request.headers['api-key'], request.authorization)
+        token = execute_task(juju.authenticate, request.headers['api-key'], juju.get_auth(request))
         con, mod = execute_task(juju.authorize, token, juju.check_input(controller), juju.check_input(model))
         usr = juju.check_input(user)
         if execute_task(juju.user_exists, usr):
@@ -0,0 +1,149 @@
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from hashlib import sha256
+import hmac
+import json
+import os
+import threading
+import time
+from cryptography.fernet import Fernet, InvalidToken
+from sojobo_api import settings
+################################################################################
+# AUTHENTICATION CACHE
+################################################################################
+# Credentials that logged in to a controller recently, so a user does not open
+# a controller connection on every request. Only a salted hash of the user and
+# password is kept. An entry is valid for auth-cache-ttl seconds and only while
+# the auth epoch of the user in the datastore, raised by a password change or
+# removal in any process, is the one it was verified with.
+SALT = os.urandom(16)
+MAX_ENTRIES = 1000
+CACHE = OrderedDict()
+# The last auth epoch this process has seen per user.
+EPOCHS = {}
+LOCK = threading.Lock()
+STATS = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def credential_key(username, password):
+    return sha256(SALT + '{}\0{}'.format(username, password).encode('utf-8')).hexdigest()
+
+
+def is_verified(username, password, epoch):
+    key = credential_key(username, password)
+    with LOCK:
+        entry = CACHE.get(key)
+        if entry is not None and entry[1] == epoch and entry[2] > time.time():
+            CACHE.move_to_end(key)
+            STATS['hits'] += 1
+            return True
+        if entry is not None:
+            del CACHE[key]
+        STATS['misses'] += 1
+        return False
+
+
+def epoch_changed(username, epoch):
+    """True when the password of the user changed since this process last
+    checked it, pooled connections opened with the old one must go."""
+    with LOCK:
+        changed = username in EPOCHS and EPOCHS[username] != epoch
+        EPOCHS[username] = epoch
+    if changed:
+        invalidate(username)
+    return changed
+
+
+def verified(username, password, epoch):
+    with LOCK:
+        CACHE[credential_key(username, password)] = (username, epoch, time.time() + int(settings.AUTH_CACHE_TTL))
+        while len(CACHE) > MAX_ENTRIES:
+            CACHE.popitem(last=False)
+
+
+def invalidate(username):
+    with LOCK:
+        for key, entry in list(CACHE.items()):
+            if entry[0] == username:
+                del CACHE[key]
+        STATS['invalidations'] += 1
+
+
+def stats():
+    return {'size': len(CACHE),
+            'hits': STATS['hits'],
+            'misses': STATS['misses'],
+            'invalidations': STATS['invalidations']}
+################################################################################
+# BEARER TOKENS
+################################################################################
+# /tengu/login hands out '<payload>.<signature>', the payload holds the user,
+# the session id and the expiry time and is signed with HMAC-SHA256 using the
+# token secret of the application. Forged and expired tokens are rejected
+# without leaving the process. Juju still needs the password for every call
+# made as the user, it stays in the session in Redis encrypted with a key
+# derived from the token secret, so reading Redis does not reveal it.
+# Removing the session revokes the token. The arguments of queued jobs, which
+# hold passwords as well, are encrypted with the same key.
+def encode(data):
+    return urlsafe_b64encode(data).decode('utf-8').rstrip('=')
+
+
+def decode(data):
+    return urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def sign(payload):
+    return encode(hmac.new(settings.TOKEN_SECRET.encode('utf-8'), payload.encode('utf-8'), sha256).digest())
+
+
+def create_token(username, session, expires):
+    payload = encode(json.dumps({'user': username, 'session': session, 'expires': expires}).encode('utf-8'))
+    return '{}.{}'.format(payload, sign(payload))
+
+
+def verify_token(token):
+    """The payload of a token with a valid signature that has not expired,
+    None otherwise."""
+    try:
+        payload, signature = token.split('.')
+        if not hmac.compare_digest(signature, sign(payload)):
+            return None
+        data = json.loads(decode(payload).decode('utf-8'))
+    except (ValueError, TypeError):
+        return None
+    if data['expires'] < time.time():
+        return None
+    return data
+
+
+def cipher():
+    return Fernet(urlsafe_b64encode(sha256('session:{}'.format(settings.TOKEN_SECRET).encode('utf-8')).digest()))
+
+
+def encrypt(text):
+    return cipher().encrypt(text.encode('utf-8')).decode('utf-8')
+
+
+def decrypt(data):
+    """The text of data, None when it was not encrypted with the current
+    token secret."""
+    try:
+        return cipher().decrypt(data.encode('utf-8')).decode('utf-8')
+    except InvalidToken:
+        return None
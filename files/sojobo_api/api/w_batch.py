@@ -0,0 +1,170 @@
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,r0903,e0401
+import asyncio
+import re
+from flask import abort
+from werkzeug.exceptions import HTTPException
+from sojobo_api.api import w_errors as errors, w_juju as juju
+################################################################################
+# BATCH OPERATIONS
+################################################################################
+# A batch runs many changes to one model over one model connection. An
+# operation waits for the operations before it that touch the same
+# application, all other operations run at the same time.
+CONCURRENCY = 10
+MAX_OPERATIONS = 200
+
+
+class Operation(object):
+    def __init__(self, index, data):
+        self.index = index
+        self.action = data['action']
+        if self.action not in ACTIONS:
+            error = errors.invalid_option(self.action)
+            abort(error[0], error[1])
+        self.args = ACTIONS[self.action][0](data)
+        self.applications = self.args['applications']
+        self.result = {'index': index, 'action': self.action, 'state': 'pending'}
+
+    def finish(self, state, error=None):
+        self.result['state'] = state
+        if error is not None:
+            self.result['error'] = error
+        return state == 'done'
+
+
+def application_name(charm):
+    """The default application name of a charm url, e.g. mysql for
+    local:xenial/mysql-5."""
+    return re.sub(r'-\d+$', '', charm.split(':')[-1].split('/')[-1])
+
+
+def parse_deploy(data):
+    charm = juju.check_input(data['application'])
+    name = juju.check_input(data.get('app_name', None), True) or application_name(charm)
+    return {'applications': [name], 'charm': charm, 'name': name,
+            'series': juju.check_input(data.get('series', None), True),
+            'target': juju.check_input(data.get('target', None), True),
+            'config': data.get('config', None), 'units': int(data.get('units', 1))}
+
+
+def parse_application(data):
+    return {'applications': [juju.check_input(data['application'])],
+            'config': data.get('config', None), 'expose': data.get('expose', 'True') == 'True'}
+
+
+def parse_relation(data):
+    return {'applications': [juju.check_input(data['app1']), juju.check_input(data['app2'])]}
+
+
+async def get_application(token, model, name):
+    app = await juju.get_application_entity(token, model, name)
+    if app is None:
+        error = errors.does_not_exist('application')
+        abort(error[0], error[1])
+    return app
+
+
+async def deploy(token, model, args):
+    # The batch connection is the one deploy waits on, unlike the model
+    # mirror it already knows applications deployed earlier in the batch.
+    if await juju.get_application_entity(token, model, args['name']) is not None:
+        error = errors.already_exists('application')
+        abort(error[0], error[1])
+    await juju.deploy_app(token, model, args['charm'], name=args['name'], ser=args['series'],
+                          tar=args['target'], con=args['config'], num_of_units=args['units'])
+
+
+async def configure(token, model, args):
+    app = await get_application(token, model, args['applications'][0])
+    await app.set_config(args['config'])
+
+
+async def expose(token, model, args):
+    app = await get_application(token, model, args['applications'][0])
+    if args['expose']:
+        await app.expose()
+    else:
+        await app.unexpose()
+
+
+async def remove(token, model, args):
+    app = await get_application(token, model, args['applications'][0])
+    await app.remove()
+
+
+async def relate(token, model, args):
+    for name in args['applications']:
+        await get_application(token, model, name)
+    await juju.add_relation(token, model, *args['applications'])
+
+
+async def unrelate(token, model, args):
+    await get_application(token, model, args['applications'][0])
+    await juju.remove_relation(token, model, *args['applications'])
+
+
+ACTIONS = {
+    'deploy': (parse_deploy, deploy),
+    'config': (parse_application, configure),
+    'expose': (parse_application, expose),
+    'remove': (parse_application, remove),
+    'relate': (parse_relation, relate),
+    'unrelate': (parse_relation, unrelate)
+}
+
+
+def parse_operations(data):
+    """Checks every operation before any of them runs. Missing keys raise a
+    KeyError, like the input of the other calls."""
+    if not isinstance(data, list) or not data or len(data) > MAX_OPERATIONS:
+        error = errors.invalid_data()
+        abort(error[0], error[1])
+    try:
+        return [Operation(index, operation) for index, operation in enumerate(data)]
+    except (AttributeError, TypeError, ValueError):
+        error = errors.invalid_data()
+        abort(error[0], error[1])
+
+
+async def run_operation(token, model, operation, depends, slots):
+    if depends:
+        await asyncio.wait(depends)
+        if not all(task.result() for task in depends):
+            return operation.finish('skipped', 'An earlier operation on the same application failed')
+    async with slots:
+        try:
+            await ACTIONS[operation.action][1](token, model, operation.args)
+            return operation.finish('done')
+        except HTTPException as e:
+            return operation.finish('failed', e.description)
+        except Exception as e:  #pylint: disable=W0703
+            return operation.finish('failed', str(e) or type(e).__name__)
+
+
+async def run_batch(token, model, operations):
+    slots = asyncio.Semaphore(CONCURRENCY)
+    last = {}
+    tasks = []
+    async with model.connect(token):
+        for operation in operations:
+            depends = {last[name] for name in operation.applications if name in last}
+            task = asyncio.ensure_future(run_operation(token, model, operation, depends, slots))
+            for name in operation.applications:
+                last[name] = task
+            tasks.append(task)
+        await asyncio.wait(tasks)
+    return [operation.result for operation in operations]
@@ -0,0 +1,259 @@
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,r0903,r0913,e0401
+import asyncio
+import yaml
+from juju.constraints import parse as parse_constraints
+from juju.errors import JujuAPIError
+################################################################################
+# BUNDLE ENGINE
+################################################################################
+# A bundle is checked once and turned into a plan of steps: add the machines,
+# deploy every application without units, add the units where the bundle
+# places them, then add the relations and expose applications. Every step
+# names the steps it needs, the plan runs all steps whose needs are done at
+# the same time over one model connection.
+CONCURRENCY = 10
+CONTAINERS = ['lxd', 'lxc', 'kvm']
+
+
+class BundleError(Exception):
+    pass
+
+
+class Step(object):
+    def __init__(self, name, action, args, needs=()):
+        self.name = name
+        self.action = action
+        self.args = args
+        self.needs = set(needs)
+        self.state = 'pending'
+        self.error = None
+
+    def to_dict(self):
+        result = {'step': self.name, 'state': self.state}
+        if self.error is not None:
+            result['error'] = self.error
+        return result
+
+
+def load(bundle):
+    """The bundle as a dict, from a dict or a yaml or json string."""
+    if isinstance(bundle, str):
+        try:
+            bundle = yaml.safe_load(bundle)
+        except yaml.YAMLError as e:
+            raise BundleError('Not valid yaml: {}'.format(e))
+    if not isinstance(bundle, dict):
+        raise BundleError('It must be a mapping')
+    return bundle
+
+
+def relation_app(endpoint):
+    return endpoint.split(':')[0]
+
+
+def parse_placement(directive, applications, machines):
+    """(container type or None, machine id in the bundle or None, unit 'app/n'
+    or None) of a 'to' directive."""
+    directive = str(directive)
+    container = None
+    if ':' in directive:
+        container, directive = directive.split(':', 1)
+        if container not in CONTAINERS:
+            raise BundleError('Unknown container type {}'.format(container))
+    if directive == 'new':
+        return container, None, None
+    if '/' in directive:
+        app, number = directive.split('/', 1)
+        if app not in applications or not number.isdigit() or int(number) >= int(applications[app].get('num_units', 0)):
+            raise BundleError('Placement on unknown unit {}'.format(directive))
+        return container, None, directive
+    if directive not in machines:
+        raise BundleError('Placement on unknown machine {}'.format(directive))
+    return container, directive, None
+
+
+def plan(bundle):
+    """Checks the bundle and returns the steps to deploy it."""
+    bundle = load(bundle)
+    try:
+        steps = build_steps(bundle)
+    except (AttributeError, TypeError, ValueError) as e:
+        raise BundleError(str(e))
+    check_order(steps)
+    return steps
+
+
+def build_steps(bundle):
+    applications = bundle.get('applications', bundle.get('services'))
+    if not isinstance(applications, dict) or not applications:
+        raise BundleError('It has no applications')
+    machines = {str(k): v or {} for k, v in (bundle.get('machines') or {}).items()}
+    series = bundle.get('series')
+    for name, spec in applications.items():
+        if not isinstance(spec, dict) or 'charm' not in spec:
+            raise BundleError('Application {} has no charm'.format(name))
+    placements = {name: [parse_placement(d, applications, machines) for d in spec.get('to') or []]
+                  for name, spec in applications.items()}
+    # Units that others are placed on, their machine has to be known.
+    referenced = {p[2] for directives in placements.values() for p in directives if p[2] is not None}
+    steps = []
+    for machine, spec in machines.items():
+        steps.append(Step('machine {}'.format(machine), add_machine,
+                          {'machine': machine, 'series': spec.get('series', series),
+                           'constraints': spec.get('constraints')}))
+    for name, spec in applications.items():
+        steps.append(Step('deploy {}'.format(name), deploy,
+                          {'application': name, 'charm': spec['charm'], 'series': spec.get('series', series),
+                           'config': spec.get('options'), 'constraints': spec.get('constraints')}))
+        needs = {'deploy {}'.format(name)}
+        for _, machine, unit in placements[name]:
+            if machine is not None:
+                needs.add('machine {}'.format(machine))
+            if unit is not None and unit.split('/')[0] != name:
+                needs.add('units {}'.format(unit.split('/')[0]))
+        units = int(spec.get('num_units', 0))
+        if units:
+            steps.append(Step('units {}'.format(name), add_units,
+                              {'application': name, 'units': units, 'placements': placements[name],
+                               'referenced': {u for u in referenced if u.split('/')[0] == name}}, needs))
+        if spec.get('expose'):
+            steps.append(Step('expose {}'.format(name), expose, {'application': name}, ['deploy {}'.format(name)]))
+    relations = set()
+    for relation in bundle.get('relations') or []:
+        if not isinstance(relation, list) or len(relation) != 2 or any(relation_app(e) not in applications for e in relation):
+            raise BundleError('Relation {} is not between two applications of the bundle'.format(relation))
+        name = 'relate {} {}'.format(*sorted(relation))
+        if name not in relations:
+            relations.add(name)
+            steps.append(Step(name, relate, {'endpoints': list(relation)},
+                              ['deploy {}'.format(relation_app(e)) for e in relation]))
+    return steps
+
+
+def check_order(steps):
+    """Rejects placements on units that would wait for each other."""
+    names = {step.name: step for step in steps}
+    done = set()
+    while len(done) < len(steps):
+        ready = [s.name for s in steps if s.name not in done and all(n in done or n not in names for n in s.needs)]
+        if not ready:
+            raise BundleError('The placements of {} depend on each other'.format(
+                ', '.join(s.name for s in steps if s.name not in done)))
+        done.update(ready)
+################################################################################
+# STEPS
+################################################################################
+class Deployment(object):
+    """Runs a plan on a connected libjuju Model. progress(steps) is called
+    every time a step changes state."""
+    def __init__(self, model, steps, progress=None):
+        self.model = model
+        self.steps = steps
+        self.progress = progress
+        self.machines = {}
+        self.units = {}
+
+    async def run(self):
+        slots = asyncio.Semaphore(CONCURRENCY)
+        names = {step.name for step in self.steps}
+        tasks = {}
+        for step in self.steps:
+            tasks[step.name] = asyncio.ensure_future(self.run_step(step, tasks, names, slots))
+        await asyncio.wait(list(tasks.values()))
+        failed = [s for s in self.steps if s.state == 'failed']
+        if failed:
+            raise Exception('{} of {} steps failed, first: {}: {}'.format(
+                len(failed), len(self.steps), failed[0].name, failed[0].error))
+
+    async def run_step(self, step, tasks, names, slots):
+        # All tasks are created before the first one runs.
+        needed = [tasks[n] for n in step.needs if n in names]
+        if needed:
+            await asyncio.wait(needed)
+        if any(s.state != 'done' for s in self.steps if s.name in step.needs):
+            return self.update(step, 'skipped', 'A step it needs did not succeed')
+        async with slots:
+            self.update(step, 'running')
+            try:
+                await step.action(self, **step.args)
+                self.update(step, 'done')
+            except JujuAPIError as e:
+                self.update(step, 'failed', e.message)
+            except Exception as e:  #pylint: disable=W0703
+                self.update(step, 'failed', str(e) or type(e).__name__)
+
+    def update(self, step, state, error=None):
+        step.state = state
+        step.error = error
+        if self.progress is not None:
+            self.progress([s.to_dict() for s in self.steps])
+
+    def placement(self, container, machine, unit):
+        if unit is not None:
+            target = self.units[unit]
+        elif machine is not None:
+            target = self.machines[machine]
+        else:
+            target = None
+        if container is None:
+            return target
+        return '{}:{}'.format(container, target) if target is not None else container
+
+
+async def add_machine(deployment, machine, series, constraints):
+    new = await deployment.model.add_machine(series=series, constraints=parse_constraints(constraints))
+    deployment.machines[machine] = new.entity_id
+
+
+async def deploy(deployment, application, charm, series, config, constraints):
+    if application in deployment.model.applications:
+        # Deployed before, e.g. by an earlier run of the same bundle.
+        return
+    await deployment.model.deploy(charm, application_name=application, series=series, config=config,
+                                  constraints=parse_constraints(constraints), num_units=0)
+
+
+async def add_units(deployment, application, units, placements, referenced):
+    app = deployment.model.applications[application]
+    existing = app.units
+    for number, unit in enumerate(existing):
+        deployment.units['{}/{}'.format(application, number)] = unit.machine_id
+    for number in range(len(existing), units):
+        to = deployment.placement(*placements[number]) if number < len(placements) else None
+        new = await app.add_unit(count=1, to=to)
+        name = '{}/{}'.format(application, number)
+        if name in referenced:
+            deployment.units[name] = await machine_of(deployment.model, new[0])
+
+
+async def machine_of(model, unit):
+    """The machine a unit was assigned to, placement on a unit is placement
+    on its machine."""
+    await model.block_until(lambda: unit.machine_id, timeout=600)
+    return unit.machine_id
+
+
+async def relate(deployment, endpoints):
+    try:
+        await deployment.model.add_relation(*endpoints)
+    except JujuAPIError as e:
+        if 'already exists' not in e.message:
+            raise
+
+
+async def expose(deployment, application):
+    await deployment.model.applications[application].expose()
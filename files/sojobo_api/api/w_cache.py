@@ -0,0 +1,98 @@
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,e0401
+from collections import OrderedDict
+from functools import wraps
+from hashlib import sha1
+import threading
+from flask import request, Response
+from sojobo_api import settings
+from sojobo_api.api import w_datastore as datastore, w_juju as juju, w_mirror
+################################################################################
+# RESPONSE CACHE
+################################################################################
+# Successful responses of read endpoints, per user and url. An entry is only
+# served while its validator, the datastore generation and the version of the
+# mirrored model, is unchanged. The ETag is a hash of the body, so every
+# process hands out the same ETag for the same data.
+CACHE = OrderedDict()
+LOCK = threading.Lock()
+STATS = {'hits': 0, 'misses': 0, 'not-modified': 0}
+
+
+def validator(kwargs):
+    generation = datastore.get_generation()
+    if 'controller' in kwargs and 'model' in kwargs:
+        model = datastore.get_model(kwargs['controller'], kwargs['model'])
+        if model is not None:
+            return generation, w_mirror.get_version(model['uuid'])
+    return generation, None
+
+
+def lookup(key, valid):
+    with LOCK:
+        entry = CACHE.get(key)
+        if entry is None or entry[0] != valid:
+            STATS['misses'] += 1
+            return None
+        CACHE.move_to_end(key)
+        STATS['hits'] += 1
+        return entry
+
+
+def store(key, entry):
+    with LOCK:
+        CACHE[key] = entry
+        CACHE.move_to_end(key)
+        while len(CACHE) > int(settings.RESPONSE_CACHE_SIZE):
+            CACHE.popitem(last=False)
+
+
+def cached(view):
+    """Serves a GET view from the cache, with an ETag, and answers 304 when
+    the client already has the current version."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            token = juju.request_token(request)
+        except KeyError:
+            return view(*args, **kwargs)
+        key = (token.username, request.full_path)
+        valid = validator(kwargs)
+        entry = lookup(key, valid)
+        if entry is None:
+            response = view(*args, **kwargs)
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            headers = [(k, v) for k, v in response.headers if k != 'Content-Length']
+            entry = (valid, sha1(body).hexdigest(), body, headers)
+            store(key, entry)
+        etag = entry[1]
+        if request.if_none_match.contains(etag):
+            STATS['not-modified'] += 1
+            response = Response(status=304)
+        else:
+            response = Response(entry[2], status=200, headers=entry[3])
+        response.set_etag(etag)
+        return response
+    return wrapper
+
+
+def stats():
+    return {'size': len(CACHE),
+            'hits': STATS['hits'],
+            'misses': STATS['misses'],
+            'not-modified': STATS['not-modified']}
@@ -0,0 +1,198 @@
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+from threading import Lock
+import time
+import requests
+import requests.adapters
+import yaml
+from sojobo_api import settings
+from sojobo_api.api import w_datastore as datastore
+################################################################################
+# BUNDLE CATALOG
+################################################################################
+# The bundles of the GitHub organisation are kept in Redis and /bundles is
+# served from there. The worker refreshes the catalog every
+# bundle-refresh-interval seconds. Every GitHub response is stored with its
+# ETag and asked for again with If-None-Match, an unchanged page or bundle
+# answers 304 and does not count against the rate limit. With bundle-dir set
+# the catalog is read from that directory and GitHub is never contacted. The
+# numbers of the last refresh are in the catalog, /tengu/stats shows them.
+REPOS_URL = 'https://api.github.com/orgs/{}/repos?per_page={}&page={}'
+BUNDLE_URL = 'https://raw.githubusercontent.com/{}/{}/master/bundle.yaml'
+PER_PAGE = 100
+TIMEOUT = 30
+# Pages and bundle files are fetched by this many threads at the same time,
+# over one pool of kept-alive connections.
+FETCH_CONCURRENCY = 10
+# Connection errors and these answers are retried after 1, 2 and 4 seconds.
+RETRIES = 3
+BACKOFF = 1
+RETRY_STATUS = [429, 500, 502, 503, 504]
+SESSION = requests.Session()
+SESSION.mount('https://', requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=FETCH_CONCURRENCY))
+
+
+class CatalogError(Exception):
+    pass
+
+
+class Fetcher(object):
+    """Conditional GETs with retries, shared by the threads of one refresh,
+    counting what they did."""
+    def __init__(self):
+        self.lock = Lock()
+        self.stats = {'requests': 0, 'not-modified': 0, 'retries': 0}
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def get(self, url, headers):
+        error = None
+        for attempt in range(RETRIES + 1):
+            if attempt:
+                self.count('retries')
+                time.sleep(BACKOFF * 2 ** (attempt - 1))
+            self.count('requests')
+            try:
+                res = SESSION.get(url, headers=headers, timeout=TIMEOUT)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+                continue
+            if res.status_code not in RETRY_STATUS:
+                return res
+            error = CatalogError('GitHub answered {} for {}'.format(res.status_code, url))
+        raise error
+
+    def fetch(self, url):
+        """The body of url, None when it does not exist."""
+        cached = datastore.get_http_cache(url)
+        headers = {}
+        if cached is not None and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        res = self.get(url, headers)
+        if res.status_code == 304:
+            self.count('not-modified')
+            return cached['body']
+        if res.status_code == 404:
+            return None
+        if res.status_code != 200:
+            raise CatalogError('GitHub answered {} for {}'.format(res.status_code, url))
+        datastore.set_http_cache(url, res.headers.get('ETag'), res.text)
+        return res.text
+
+
+def bundle_entry(name, description, body):
+    """The catalog entry of a bundle, None when its bundle.yaml is missing or
+    not valid."""
+    if body is None:
+        return None
+    try:
+        bundle = yaml.safe_load(body)
+    except yaml.YAMLError:
+        return None
+    if not isinstance(bundle, dict):
+        return None
+    if description is None:
+        description = bundle.get('description')
+    return {'name': name, 'description': description, 'json': json.dumps(bundle), 'logo': None}
+
+
+def read_repos(fetcher, executor, urls):
+    """The bundle repositories of the organisation. The first page tells
+    whether there are more, those are fetched FETCH_CONCURRENCY at a time
+    until one is not full."""
+    repos = []
+    pages = [1]
+    while pages:
+        wave = [REPOS_URL.format(settings.REPO_NAME, PER_PAGE, p) for p in pages]
+        urls.update(wave)
+        full = True
+        for body in executor.map(fetcher.fetch, wave):
+            data = json.loads(body) if body is not None else []
+            repos.extend(r for r in data if 'bundle' in r['name'])
+            full = full and len(data) == PER_PAGE
+        pages = list(range(pages[-1] + 1, pages[-1] + 1 + FETCH_CONCURRENCY)) if full else []
+    return repos
+
+
+def read_github(stats):
+    fetcher = Fetcher()
+    urls = set()
+    with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as executor:
+        start = time.time()
+        repos = read_repos(fetcher, executor, urls)
+        stats['pages-seconds'] = round(time.time() - start, 3)
+        start = time.time()
+        bundle_urls = [BUNDLE_URL.format(settings.REPO_NAME, r['name']) for r in repos]
+        urls.update(bundle_urls)
+        bodies = executor.map(fetcher.fetch, bundle_urls)
+        bundles = [bundle_entry(r['name'], r['description'], b) for r, b in zip(repos, bodies)]
+        stats['bundles-seconds'] = round(time.time() - start, 3)
+    stats.update(fetcher.stats)
+    # Responses of bundles and pages that are gone are not needed anymore.
+    datastore.remove_http_cache([u for u in datastore.get_http_urls() if u not in urls])
+    return bundles
+
+
+def read_directory(directory):
+    bundles = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name, 'bundle.yaml')
+        if os.path.isfile(path):
+            with open(path) as b_file:
+                bundles.append(bundle_entry(name, None, b_file.read()))
+    return bundles
+
+
+def refresh():
+    """Rebuilds the catalog, on an error the previous one stays in place."""
+    start = time.time()
+    stats = {}
+    if settings.BUNDLE_DIR:
+        source, bundles = settings.BUNDLE_DIR, read_directory(settings.BUNDLE_DIR)
+    else:
+        source, bundles = 'github.com/{}'.format(settings.REPO_NAME), read_github(stats)
+    found = [b for b in bundles if b is not None]
+    stats.update({'bundles': len(found), 'invalid': len(bundles) - len(found),
+                  'seconds': round(time.time() - start, 3)})
+    datastore.set_bundles(found, source, stats)
+    return dict(stats, source=source)
+
+
+def ensure():
+    """Requests only read the catalog, until the worker built it for the
+    first time there is none."""
+    if datastore.get_bundle_catalog() is None:
+        raise CatalogError('The worker has not built it yet')
+
+
+def get_bundles(cursor=None, limit=None):
+    """A page of the catalog, sorted by name, and the cursor of the next page."""
+    ensure()
+    names = datastore.get_bundle_names()
+    if limit is None:
+        return datastore.get_bundles(names), 0
+    end = cursor + limit
+    return datastore.get_bundles(names[cursor:end]), end if end < len(names) else 0
+
+
+def get_bundle(bundle):
+    ensure()
+    return datastore.get_bundle(bundle)
@@ -1,362 +1,785 @@
 # pylint: disable=c0111,c0301, E0611, E0401
 #!/usr/bin/env python3.6
+import asyncio
+from functools import wraps
 import json
+import random
+from threading import Lock
+import time
+from uuid import uuid4
 import redis
 from sojobo_api import settings
+from sojobo_api.api import w_auth
 ################################################################################
 # Database Fucntions
 ################################################################################
+# Controllers (db 10)
+#   controllers                  set of controller names
+#   controller:<c>               hash name, state, type, endpoints, uuid, ca-cert, region
+#   controller:<c>:users         hash user -> controller access
+#   controller:<c>:models        set of model names
+#   model:<c>:<m>                hash name, status, uuid, owner (empty for models migrated from documents)
+#   datastore                    hash generation (counter raised by every write to db 10 or 11)
+# Users (db 11)
+#   users                        set of user names
+#   user:<u>                     hash name, active, auth (epoch raised by a password change)
+#   user:<u>:ssh-keys            set of ssh keys
+#   user:<u>:credentials         hash credential name -> json credential
+#   user:<u>:controllers         hash controller -> controller access
+#   user:<u>:models:<c>          hash model -> model access
+#   model:<c>:<m>:users          hash user -> model access, reverse index of the above
+#   session:<id>                 hash user, encrypted password of a bearer token, expires with it
+#   user:<u>:sessions            set of session ids of a user
+# Jobs (db 12)
+#   jobs                         list of queued json jobs {id, task, args (encrypted json list)}
+#   job:<id>                     hash id, task, owner, state, controller, model, created, started, finished, error,
+#                                progress (json list of the steps of a bundle deployment or access change),
+#                                user, access and retry_of of an access change, worker (host that runs it)
+#   job-index                    sorted set job id -> creation time
+#   job-index:<u>                sorted set job id -> creation time of the jobs of a user
+# Bundles (db 13)
+#   bundles                      hash bundle name -> json {name, description, json, logo}
+#   bundle-catalog               hash source, refreshed (time of the last refresh), stats (json timings and counts)
+#   bundle-http                  hash url -> json {etag, body} of the last GitHub response
+POOLS = {}
+POOLS_LOCK = Lock()
+
+
+def get_pool(db):
+    with POOLS_LOCK:
+        if db not in POOLS:
+            POOLS[db] = redis.BlockingConnectionPool(
+                host=settings.REDIS_HOST,
+                port=int(settings.REDIS_PORT),
+                db=db,
+                encoding="utf-8",
+                decode_responses=True,
+                max_connections=int(settings.REDIS_MAX_CONNECTIONS),
+                timeout=float(settings.REDIS_SOCKET_TIMEOUT),
+                socket_timeout=float(settings.REDIS_SOCKET_TIMEOUT),
+                socket_connect_timeout=float(settings.REDIS_SOCKET_TIMEOUT),
+                socket_keepalive=True
+            )
+        return POOLS[db]
+
+
+def get_pool_stats():
+    result = {}
+    for db, pool in POOLS.items():
+        idle = len([c for c in list(pool.pool.queue) if c is not None])
+        result[db] = {'created': len(pool._connections),  #pylint: disable=W0212
+                      'idle': idle,
+                      'in-use': len(pool._connections) - idle,  #pylint: disable=W0212
+                      'max-connections': pool.max_connections}
+    return result
+
+
+class ConflictError(Exception):
+    pass
+
+
+TRANSACTION_STATS = {'transactions': 0, 'retries': 0, 'conflicts': 0}
+
+
+def on_event_loop():
+    """Whether this runs inside a coroutine, where sleeping would stall every
+    other coroutine on the loop."""
+    try:
+        return asyncio.get_event_loop().is_running()
+    except RuntimeError:
+        return False
+
+
+def transaction(con, func, *watches):
+    """Runs func(pipe) as a WATCH/MULTI transaction. func reads through the
+    pipe, calls pipe.watch() for any extra keys it depends on, and then
+    pipe.multi() before queueing its writes. When a watched key changes before
+    EXEC the whole function is retried with a short randomized backoff, on an
+    event loop it is retried right away."""
+    TRANSACTION_STATS['transactions'] += 1
+    backoff = not on_event_loop()
+    for attempt in range(int(settings.REDIS_MAX_RETRIES)):
+        with con.pipeline() as pipe:
+            try:
+                if watches:
+                    pipe.watch(*watches)
+                result = func(pipe)
+                pipe.execute()
+                return result
+            except redis.WatchError:
+                TRANSACTION_STATS['retries'] += 1
+                if backoff:
+                    time.sleep(random.uniform(0, 0.001 * 2 ** min(attempt, 6)))
+    TRANSACTION_STATS['conflicts'] += 1
+    raise ConflictError('Too many concurrent updates of {}'.format(', '.join(watches)))
+
+
+def get_transaction_stats():
+    return dict(TRANSACTION_STATS)
+
+
+# Conditional updates that only need a check on one key run server side.
+HSET_IF_MEMBER = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    for i = 2, #ARGV, 2 do
+        redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+    end
+    return 1
+end
+return 0
+"""
+HSET_IF_FIELD = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+
+SCRIPTS = {}
+
+
+def run_script(con, script, keys, args):
+    if script not in SCRIPTS:
+        SCRIPTS[script] = con.register_script(script)
+    return SCRIPTS[script](keys=keys, args=args, client=con)
+
+
+def writes(func):
+    """Raises the datastore generation after func, so cached responses built
+    from the old data are no longer served."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        result = func(*args, **kwargs)
+        connect_to_controllers().hincrby('datastore', 'generation')
+        return result
+    return wrapper
+
+
+def get_generation():
+    return connect_to_controllers().hget('datastore', 'generation')
+
+
 def connect_to_controllers():
-    return redis.StrictRedis(
-        host=settings.REDIS_HOST,
-        port=settings.REDIS_PORT,
-        charset="utf-8",
-        decode_responses=True,
-        db=10
-    )
+    return redis.StrictRedis(connection_pool=get_pool(10))
 
 
 def connect_to_users():
-    return redis.StrictRedis(
-        host=settings.REDIS_HOST,
-        port=settings.REDIS_PORT,
-        charset="utf-8",
-        decode_responses=True,
-        db=11
-    )
+    return redis.StrictRedis(connection_pool=get_pool(11))
+
+
+def connect_to_jobs():
+    return redis.StrictRedis(connection_pool=get_pool(12))
+
+
+def connect_to_bundles():
+    return redis.StrictRedis(connection_pool=get_pool(13))
+
+
+def controller_key(c_name, field=None):
+    if field:
+        return 'controller:{}:{}'.format(c_name, field)
+    return 'controller:{}'.format(c_name)
+
+
+def model_key(c_name, m_name):
+    return 'model:{}:{}'.format(c_name, m_name)
+
+
+def user_key(user, field=None):
+    if field:
+        return 'user:{}:{}'.format(user, field)
+    return 'user:{}'.format(user)
+
+
+def session_key(session):
+    return 'session:{}'.format(session)
+
+
+def user_models_key(user, c_name):
+    return 'user:{}:models:{}'.format(user, c_name)
+
+
+def model_users_key(c_name, m_name):
+    return 'model:{}:{}:users'.format(c_name, m_name)
 ################################################################################
 # USER FUNCTIONS
 ################################################################################
+@writes
 def create_user(user_name):
-    if not user_name in get_all_users():
-        user = {'name' : user_name,
-                'controllers': [],
-                'ssh-keys': [],
-                'credentials': [],
-                'active': True}
-        con = connect_to_users()
-        con.set(user_name, json.dumps(user))
+    def create(pipe):
+        if not pipe.sismember('users', user_name):
+            pipe.multi()
+            pipe.sadd('users', user_name)
+            pipe.hmset(user_key(user_name), {'name': user_name, 'active': 1})
+    transaction(connect_to_users(), create, 'users')
 
 
+@writes
 def disable_user(user):
+    def disable(pipe):
+        controllers = pipe.hkeys(user_key(user, 'controllers'))
+        models = watch_models_access(pipe, controllers, user)
+        pipe.multi()
+        for c_name in controllers:
+            drop_models_access(pipe, c_name, user, models[c_name])
+        pipe.hset(user_key(user), 'active', 0)
+        pipe.delete(user_key(user, 'controllers'))
+    transaction(connect_to_users(), disable, user_key(user, 'controllers'))
+
+
+@writes
+def enable_user(user):
     con = connect_to_users()
-    data = json.loads(con.get(user))
-    data['active'] = False
-    data['controllers'] = []
-    con.set(user, json.dumps(data))
+    con.hset(user_key(user), 'active', 1)
 
 
-def enable_user(user):
-    con = connect_to_users()
-    data = json.loads(con.get(user))
-    data['active'] = True
-    con.set(user, json.dumps(data))
+def get_auth_epoch(user):
+    """Changes when the password of the user changes, None for a user that
+    is unknown or disabled."""
+    active, epoch = connect_to_users().hmget(user_key(user), 'active', 'auth')
+    if active != '1':
+        return None
+    return epoch or '0'
 
 
-def get_user(user):
+def invalidate_auth(user):
+    """Raises the auth epoch and revokes all bearer tokens of the user."""
     con = connect_to_users()
-    return json.loads(con.get(user))
+    sessions = con.smembers(user_key(user, 'sessions'))
+    pipe = con.pipeline()
+    pipe.hincrby(user_key(user), 'auth', 1)
+    for session in sessions:
+        pipe.delete(session_key(session))
+    pipe.delete(user_key(user, 'sessions'))
+    pipe.execute()
 
 
+def create_session(user, password, ttl):
+    con = connect_to_users()
+    known = list(con.smembers(user_key(user, 'sessions')))
+    pipe = con.pipeline()
+    for old in known:
+        pipe.exists(session_key(old))
+    expired = [old for old, exists in zip(known, pipe.execute()) if not exists]
+    session = uuid4().hex
+    pipe.hmset(session_key(session), {'user': user, 'password': password})
+    pipe.expire(session_key(session), ttl)
+    pipe.sadd(user_key(user, 'sessions'), session)
+    if expired:
+        pipe.srem(user_key(user, 'sessions'), *expired)
+    pipe.execute()
+    return session
+
+
+def get_session(session):
+    return connect_to_users().hgetall(session_key(session)) or None
+
+
+def remove_session(user, session):
+    pipe = connect_to_users().pipeline()
+    pipe.delete(session_key(session))
+    pipe.srem(user_key(user, 'sessions'), session)
+    pipe.execute()
+
+
+def get_user(user, fields=None):
+    """The user document, the access of the user to controllers and models is
+    only looked up when fields is None or asks for controllers."""
+    con = connect_to_users()
+    pipe = con.pipeline()
+    pipe.hgetall(user_key(user))
+    pipe.smembers(user_key(user, 'ssh-keys'))
+    pipe.hvals(user_key(user, 'credentials'))
+    pipe.hgetall(user_key(user, 'controllers'))
+    data, keys, creds, controllers = pipe.execute()
+    if not data:
+        return None
+    if fields is not None and 'controllers' not in fields:
+        controllers = {}
+    pipe = con.pipeline()
+    for c_name in controllers:
+        pipe.hgetall(user_models_key(user, c_name))
+    models = pipe.execute()
+    pipe = connect_to_controllers().pipeline()
+    for c_name in controllers:
+        pipe.hget(controller_key(c_name), 'type')
+    types = pipe.execute()
+    return {'name': data['name'],
+            'controllers': [{'name': c_name,
+                             'access': access,
+                             'type': c_type,
+                             'models': [{'name': m, 'access': a} for m, a in mods.items()]}
+                            for (c_name, access), mods, c_type in zip(controllers.items(), models, types)],
+            'ssh-keys': list(keys),
+            'credentials': [json.loads(c) for c in creds],
+            'active': data['active'] == '1'}
+
+
+@writes
 def add_ssh_key(user, ssh_key):
     con = connect_to_users()
-    data = json.loads(con.get(user))
-    if ssh_key not in data['ssh-keys']:
-        data['ssh-keys'].append(ssh_key)
-    con.set(user, json.dumps(data))
+    return con.sadd(user_key(user, 'ssh-keys'), ssh_key) == 1
 
 
+@writes
 def remove_ssh_key(user, ssh_key):
     con = connect_to_users()
-    data = json.loads(con.get(user))
-    if ssh_key in data['ssh-keys']:
-        data['ssh-keys'].remove(ssh_key)
-    con.set(user, json.dumps(data))
+    return con.srem(user_key(user, 'ssh-keys'), ssh_key) == 1
 
 
 def get_ssh_keys(user):
     con = connect_to_users()
-    return json.loads(con.get(user))['ssh-keys']
+    return list(con.smembers(user_key(user, 'ssh-keys')))
 
 
+@writes
 def add_credential(user, cred):
     con = connect_to_users()
-    data = json.loads(con.get(user))
-    if cred not in data['credentials']:
-        data['credentials'].append(cred)
-    con.set(user, json.dumps(data))
+    con.hset(user_key(user, 'credentials'), cred['name'], json.dumps(cred))
 
 
-def remove_credential(user, cred):
+@writes
+def remove_credential(user, cred_name):
     con = connect_to_users()
-    data = json.loads(con.get(user))
-    if cred in data['credentials']:
-        data['credentials'].remove(cred)
-    con.set(user, json.dumps(data))
+    con.hdel(user_key(user, 'credentials'), cred_name)
 
 
 def get_credentials(user):
     con = connect_to_users()
-    return json.loads(con.get(user))['credentials']
+    return [json.loads(c) for c in con.hvals(user_key(user, 'credentials'))]
+
+
+def get_credential(user, cred_name):
+    con = connect_to_users()
+    cred = con.hget(user_key(user, 'credentials'), cred_name)
+    return json.loads(cred) if cred else None
 
 
 def get_credential_keys(user):
-    return [c['name'] for c in get_credentials(user)]
+    con = connect_to_users()
+    return con.hkeys(user_key(user, 'credentials'))
+
+
+def scan_users(cursor, count):
+    """About count user names from cursor on and the cursor of the next
+    page, which is 0 after the last page."""
+    return connect_to_users().sscan('users', cursor, count=count)
 
 
 def get_all_users():
     con = connect_to_users()
-    return con.keys()
+    return list(con.smembers('users'))
+
+
+def user_exists(user):
+    con = connect_to_users()
+    return con.sismember('users', user)
 ################################################################################
 # CONTROLLER FUNCTIONS
 ################################################################################
+@writes
 def create_controller(controller_name, c_type, region):
-    con = connect_to_controllers()
-    if controller_name in con.keys():
-        return False
-    else:
-        controller = {
+    def create(pipe):
+        if pipe.sismember('controllers', controller_name):
+            return False
+        pipe.multi()
+        pipe.sadd('controllers', controller_name)
+        pipe.hmset(controller_key(controller_name), {
             'name' : controller_name,
             'state': 'accepted',
-            'users': [],
             'type' : c_type,
-            'models' : [],
-            'endpoints': [],
+            'endpoints': json.dumps([]),
             'uuid': '',
             'ca-cert': '',
             'region': region
-        }
-        con.set(controller_name, json.dumps(controller))
+        })
         return True
+    return transaction(connect_to_controllers(), create, 'controllers')
 
 
+@writes
 def set_controller_state(controller, state, endpoints=None, uuid=None, ca_cert=None):
     con = connect_to_controllers()
-    data = json.loads(con.get(controller))
-    data['state'] = state
+    data = {'state': state}
     if endpoints:
-        data['endpoints'] = endpoints
+        data['endpoints'] = json.dumps(endpoints)
     if uuid:
         data['uuid'] = uuid
     if ca_cert:
         data['ca-cert'] = ca_cert
-    con.set(controller, json.dumps(data))
+    run_script(con, HSET_IF_MEMBER, ['controllers', controller_key(controller)],
+               [controller] + [x for item in data.items() for x in item])
 
 
+@writes
 def destroy_controller(c_name):
-    con = connect_to_controllers()
-    con.delete(c_name)
-    for user in get_all_users():
+    def destroy(pipe):
+        models = pipe.smembers(controller_key(c_name, 'models'))
+        users = pipe.hkeys(controller_key(c_name, 'users'))
+        pipe.multi()
+        for m_name in models:
+            pipe.delete(model_key(c_name, m_name))
+        pipe.delete(controller_key(c_name), controller_key(c_name, 'users'), controller_key(c_name, 'models'))
+        pipe.srem('controllers', c_name)
+        return models, users
+    models, users = transaction(connect_to_controllers(), destroy,
+                                controller_key(c_name, 'models'), controller_key(c_name, 'users'))
+    users = set(users)
+    for m_name in models:
+        users.update(get_users_model(c_name, m_name))
+    for user in users:
         remove_controller(c_name, user)
 
 
+@writes
 def remove_controller(c_name, user):
-    con = connect_to_users()
-    data = json.loads(con.get(user))
-    for controller in data['controllers']:
-        if controller['name'] == c_name:
-            data['controllers'].remove(controller)
-            break
-    con.set(user, json.dumps(data))
+    def remove(pipe):
+        models = watch_models_access(pipe, [c_name], user)
+        pipe.multi()
+        pipe.hdel(user_key(user, 'controllers'), c_name)
+        drop_models_access(pipe, c_name, user, models[c_name])
+    transaction(connect_to_users(), remove)
 
 
 def get_controller(c_name):
     con = connect_to_controllers()
-    return json.loads(con.get(c_name))
-
-
-def add_model_to_controller(c_name, m_name):
-    con = connect_to_controllers()
-    data = json.loads(con.get(c_name))
-    exists = False
-    for model in data['models']:
-        if model['name'] == m_name:
-            exists = True
-            break
-    if not exists:
-        data['models'].append({'name': m_name, 'status': 'Model is being deployed', 'uuid': ''})
-    con.set(c_name, json.dumps(data))
-
-
+    pipe = con.pipeline()
+    pipe.hgetall(controller_key(c_name))
+    pipe.hgetall(controller_key(c_name, 'users'))
+    data, users = pipe.execute()
+    if not data:
+        return None
+    data['endpoints'] = json.loads(data['endpoints'])
+    data['users'] = [{'name': u, 'access': a} for u, a in users.items()]
+    data['models'] = get_all_models(c_name)
+    return data
+
+
+@writes
+def add_model_to_controller(c_name, m_name, owner=''):
+    def add(pipe):
+        if not pipe.sismember(controller_key(c_name, 'models'), m_name):
+            pipe.multi()
+            pipe.sadd(controller_key(c_name, 'models'), m_name)
+            pipe.hmset(model_key(c_name, m_name), {'name': m_name, 'status': 'Model is being deployed', 'uuid': '',
+                                                   'owner': owner})
+    transaction(connect_to_controllers(), add, controller_key(c_name, 'models'))
+
+
+@writes
 def set_model_state(c_name, m_name, status, uuid=None):
-    con = connect_to_controllers()
-    data = json.loads(con.get(c_name))
-    for model in data['models']:
-        if model['name'] == m_name:
-            model['status'] = status
-            if uuid:
-                model['uuid'] = uuid
-            break
-    con.set(c_name, json.dumps(data))
+    args = [m_name, 'status', status]
+    if uuid:
+        args.extend(['uuid', uuid])
+    run_script(connect_to_controllers(), HSET_IF_MEMBER,
+               [controller_key(c_name, 'models'), model_key(c_name, m_name)], args)
 
 
 def check_model_state(c_name, m_name):
-    con = get_controller(c_name)
-    for mod in con['models']:
-        if mod['name'] == m_name:
-            return mod['status']
-    return 'error'
+    con = connect_to_controllers()
+    return con.hget(model_key(c_name, m_name), 'status') or 'error'
 
 
 def get_controller_access(c_name, user):
-    for controller in get_user(user)['controllers']:
-        if controller['name'] == c_name:
-            return controller['access']
+    con = connect_to_users()
+    return con.hget(user_key(user, 'controllers'), c_name)
 
 
+@writes
 def set_controller_access(c_name, user, access):
-    con = connect_to_users()
-    data = json.loads(con.get(user))
-    for controller in data['controllers']:
-        if controller['name'] == c_name:
-            controller['access'] = access
-            break
-    con.set(user, json.dumps(data))
-    con = connect_to_controllers()
-    data = json.loads(con.get(c_name))
-    for usr in data['users']:
-        if usr['name'] == user:
-            usr['access'] = access
-            break
-    con.set(c_name, json.dumps(data))
+    run_script(connect_to_users(), HSET_IF_FIELD, [user_key(user, 'controllers')], [c_name, access])
+    run_script(connect_to_controllers(), HSET_IF_FIELD, [controller_key(c_name, 'users')], [user, access])
 
 
+@writes
 def add_user_to_controller(c_name, user, access):
     con = connect_to_controllers()
-    data = json.loads(con.get(c_name))
-    c_type = data['type']
-    exists = False
-    for usr in data['users']:
-        if usr['name'] == user:
-            exists = True
-            usr['name']['access'] = access
-            break
-    if not exists:
-        data['users'].append({'name': user, 'access': access})
-    con.set(c_name, json.dumps(data))
+    con.hset(controller_key(c_name, 'users'), user, access)
     con = connect_to_users()
-    data = json.loads(con.get(user))
-    for controller in data['controllers']:
-        if controller['name'] == c_name:
-            controller['access'] = access
-            exists = True
-            break
-    if not exists:
-        data['controllers'].append({
-            'access' : access,
-            'name': c_name,
-            'models' : [],
-            'type': c_type
-        })
-    con.set(user, json.dumps(data))
+    con.hset(user_key(user, 'controllers'), c_name, access)
 
 
+@writes
 def remove_user_from_controller(c_name, user):
     con = connect_to_controllers()
-    data = json.loads(con.get(c_name))
-    if user in data['users']:
-        data['users'].remove(user)
-    con.set(c_name, json.dumps(data))
-    con = connect_to_users()
-    data = json.loads(con.get(user))
-    for controller in data['controllers']:
-        if controller['name'] == c_name:
-            data['controllers'].remove(controller)
-            break
-    con.set(user, json.dumps(data))
+    con.hdel(controller_key(c_name, 'users'), user)
+    remove_controller(c_name, user)
 
 
 def get_controller_users(c_name):
     con = connect_to_controllers()
-    data = json.loads(con.get(c_name))
-    return [get_user(u) for u in data['users']]
+    return [get_user(u) for u in con.hkeys(controller_key(c_name, 'users'))]
 
 
 def get_all_controllers():
     con = connect_to_controllers()
-    return con.keys()
+    return list(con.smembers('controllers'))
+
+
+def controller_exists(c_name):
+    con = connect_to_controllers()
+    return con.sismember('controllers', c_name)
 
 
 def get_all_models(controller):
     con = connect_to_controllers()
-    data = json.loads(con.get(controller))
-    return data['models']
+    pipe = con.pipeline()
+    for m_name in con.smembers(controller_key(controller, 'models')):
+        pipe.hgetall(model_key(controller, m_name))
+    return [m for m in pipe.execute() if m]
+
+
+def scan_models(controller, cursor, count):
+    con = connect_to_controllers()
+    cursor, names = con.sscan(controller_key(controller, 'models'), cursor, count=count)
+    pipe = con.pipeline()
+    for m_name in names:
+        pipe.hgetall(model_key(controller, m_name))
+    return cursor, [m for m in pipe.execute() if m]
 ################################################################################
 # MODEL FUNCTIONS
 ################################################################################
+@writes
 def delete_model(controller, model):
-    con = connect_to_controllers()
-    data = json.loads(con.get(controller))
-    for mod in data['models']:
-        if mod['name'] == model:
-            data['models'].remove(mod)
-            break
-    con.set(controller, json.dumps(data))
-    for user in get_all_users():
-        remove_model(controller, model, user)
-
-
+    pipe = connect_to_controllers().pipeline()
+    pipe.srem(controller_key(controller, 'models'), model)
+    pipe.delete(model_key(controller, model))
+    pipe.execute()
+    def remove(pipe):
+        users = pipe.hkeys(model_users_key(controller, model))
+        pipe.multi()
+        for user in users:
+            pipe.hdel(user_models_key(user, controller), model)
+        pipe.delete(model_users_key(controller, model))
+    transaction(connect_to_users(), remove, model_users_key(controller, model))
+
+
+@writes
 def remove_model(controller, model, user):
-    con = connect_to_users()
-    data = json.loads(con.get(user))
-    for contr in data['controllers']:
-        if contr['name'] == controller:
-            for mod in contr['models']:
-                if mod['name'] == model:
-                    contr['models'].remove(mod)
-                    break
-            break
-    con.set(user, json.dumps(data))
+    pipe = connect_to_users().pipeline()
+    pipe.hdel(user_models_key(user, controller), model)
+    pipe.hdel(model_users_key(controller, model), user)
+    pipe.execute()
 
 
 def get_model_access(controller, model, user):
-    data = get_user(user)
-    for con in data['controllers']:
-        if con['name'] == controller:
-            for mod in con['models']:
-                if mod['name'] == model:
-                    return mod['access']
+    con = connect_to_users()
+    return con.hget(user_models_key(user, controller), model)
 
 
+@writes
 def set_model_access(controller, model, user, access):
-    con = connect_to_users()
-    data = json.loads(con.get(user))
-    for contr in data['controllers']:
-        if contr['name'] == controller:
-            if model not in contr['models']:
-                contr['models'].append({'name': model, 'access': access})
-            else:
-                for mod in contr['models']:
-                    if mod['name'] == model:
-                        mod['access'] = access
-                    break
-            break
-    con.set(user, json.dumps(data))
+    pipe = connect_to_users().pipeline()
+    pipe.hset(user_models_key(user, controller), model, access)
+    pipe.hset(model_users_key(controller, model), user, access)
+    pipe.execute()
 
 
 def get_models_access(controller, user):
-    data = get_user(user)
-    for con in data['controllers']:
-        if con['name'] == controller:
-            return con['models']
+    con = connect_to_users()
+    if not con.hexists(user_key(user, 'controllers'), controller):
+        return None
+    return [{'name': m, 'access': a} for m, a in con.hgetall(user_models_key(user, controller)).items()]
 
 
+@writes
 def remove_models_access(controller, user):
-    con = connect_to_users()
-    data = json.loads(con.get(user))
-    for con in data['controllers']:
-        if con['name'] == controller:
-            con['models'] = []
-            break
-    con.set(user, json.dumps(data))
+    def remove(pipe):
+        models = watch_models_access(pipe, [controller], user)
+        pipe.multi()
+        drop_models_access(pipe, controller, user, models[controller])
+    transaction(connect_to_users(), remove)
+
+
+def watch_models_access(pipe, controllers, user):
+    keys = [user_models_key(user, c_name) for c_name in controllers]
+    if keys:
+        pipe.watch(*keys)
+    return {c_name: pipe.hkeys(key) for c_name, key in zip(controllers, keys)}
+
+
+def drop_models_access(pipe, controller, user, models):
+    for model in models:
+        pipe.hdel(model_users_key(controller, model), user)
+    pipe.delete(user_models_key(user, controller))
 
 
 def get_model(controller, model):
-    data = get_controller(controller)
-    for mod in data['models']:
-        if mod['name'] == model:
-            return mod
+    con = connect_to_controllers()
+    return con.hgetall(model_key(controller, model)) or None
 
 
 def get_users_model(controller, model):
-    return [u for u in get_all_users() if get_model_access(controller, model, u) is not None]
+    con = connect_to_users()
+    return con.hkeys(model_users_key(controller, model))
+
+
+def get_model_ssh_keys(controller, model):
+    """The ssh keys of the users that can write to the model."""
+    con = connect_to_users()
+    users = [u for u, a in con.hgetall(model_users_key(controller, model)).items() if a in ['write', 'admin']]
+    pipe = con.pipeline()
+    for user in users:
+        pipe.smembers(user_key(user, 'ssh-keys'))
+    return set().union(*pipe.execute())
+################################################################################
+# JOB FUNCTIONS
+################################################################################
+JOB_TIMES = ['created', 'started', 'finished']
+
+
+def job_key(job_id):
+    return 'job:{}'.format(job_id)
+
+
+def enqueue_job(owner, task, *args, **info):
+    """Queues task(*args) for the worker. The job record only holds the
+    owner and the optional controller and model it works on, never the
+    arguments, as those can contain passwords and credentials. In the queue
+    the arguments are encrypted."""
+    job_id = uuid4().hex
+    created = time.time()
+    job = {'id': job_id, 'task': task, 'owner': owner, 'state': 'queued', 'created': created}
+    job.update({k: v for k, v in info.items() if v is not None})
+    pipe = connect_to_jobs().pipeline()
+    pipe.hmset(job_key(job_id), job)
+    pipe.expire(job_key(job_id), int(settings.JOB_TTL))
+    pipe.zadd('job-index', {job_id: created})
+    pipe.zadd('job-index:{}'.format(owner), {job_id: created})
+    pipe.lpush('jobs', json.dumps({'id': job_id, 'task': task, 'args': w_auth.encrypt(json.dumps(args))}))
+    pipe.execute()
+    return job_id
+
+
+def dequeue_job(timeout):
+    con = connect_to_jobs()
+    item = con.brpop('jobs', timeout=timeout)
+    if item is None:
+        return None
+    job = json.loads(item[1])
+    # None when the token secret changed since the job was queued.
+    args = w_auth.decrypt(job['args'])
+    job['args'] = json.loads(args) if args is not None else None
+    return job
+
+
+def get_queue_length():
+    con = connect_to_jobs()
+    return con.llen('jobs')
+
+
+def start_job(job_id, worker):
+    pipe = connect_to_jobs().pipeline()
+    pipe.hmset(job_key(job_id), {'state': 'running', 'started': time.time(), 'worker': worker})
+    pipe.expire(job_key(job_id), int(settings.JOB_TTL))
+    pipe.execute()
+
+
+def finish_job(job_id, error=None):
+    job = {'state': 'done', 'finished': time.time()}
+    if error is not None:
+        job.update({'state': 'failed', 'error': error})
+    pipe = connect_to_jobs().pipeline()
+    pipe.hmset(job_key(job_id), job)
+    pipe.expire(job_key(job_id), int(settings.JOB_TTL))
+    pipe.execute()
+
+
+def fail_orphaned_jobs(worker, error):
+    """Fails the jobs a worker that stopped left running. Runs when the worker
+    of the host starts, so none of its jobs can still be running."""
+    con = connect_to_jobs()
+    job_ids = con.zrange('job-index', 0, -1)
+    pipe = con.pipeline()
+    for job_id in job_ids:
+        pipe.hmget(job_key(job_id), 'state', 'worker')
+    orphaned = [j for j, (state, name) in zip(job_ids, pipe.execute()) if state == 'running' and name == worker]
+    for job_id in orphaned:
+        finish_job(job_id, error)
+    return orphaned
+
+
+def set_job_progress(job_id, progress):
+    connect_to_jobs().hset(job_key(job_id), 'progress', json.dumps(progress))
+
+
+def parse_job(job):
+    if not job:
+        return None
+    for field in JOB_TIMES:
+        job[field] = float(job[field]) if field in job else None
+    job.setdefault('error', None)
+    if 'progress' in job:
+        job['progress'] = json.loads(job['progress'])
+    return job
+
+
+def get_job(job_id):
+    con = connect_to_jobs()
+    return parse_job(con.hgetall(job_key(job_id)))
+
+
+def get_jobs(owner=None):
+    index = 'job-index' if owner is None else 'job-index:{}'.format(owner)
+    con = connect_to_jobs()
+    con.zremrangebyscore(index, '-inf', time.time() - int(settings.JOB_TTL))
+    pipe = con.pipeline()
+    for job_id in con.zrevrange(index, 0, -1):
+        pipe.hgetall(job_key(job_id))
+    return [parse_job(j) for j in pipe.execute() if j]
+################################################################################
+# BUNDLE FUNCTIONS
+################################################################################
+def set_bundles(bundles, source, stats):
+    """Replaces the whole catalog at once, readers see the old or the new one."""
+    pipe = connect_to_bundles().pipeline()
+    pipe.delete('bundles')
+    if bundles:
+        pipe.hmset('bundles', {b['name']: json.dumps(b) for b in bundles})
+    pipe.hmset('bundle-catalog', {'source': source, 'refreshed': time.time(), 'stats': json.dumps(stats)})
+    pipe.execute()
+
+
+def get_bundle(bundle):
+    data = connect_to_bundles().hget('bundles', bundle)
+    return json.loads(data) if data is not None else None
+
+
+def get_bundle_names():
+    return sorted(connect_to_bundles().hkeys('bundles'))
+
+
+def get_bundles(names):
+    if not names:
+        return []
+    return [json.loads(b) for b in connect_to_bundles().hmget('bundles', names) if b is not None]
+
+
+def get_bundle_catalog():
+    """Source and time of the last refresh, None before the first one."""
+    catalog = connect_to_bundles().hgetall('bundle-catalog')
+    if not catalog:
+        return None
+    catalog['refreshed'] = float(catalog['refreshed'])
+    catalog['stats'] = json.loads(catalog.get('stats', '{}'))
+    return catalog
+
+
+def get_http_cache(url):
+    data = connect_to_bundles().hget('bundle-http', url)
+    return json.loads(data) if data is not None else None
+
+
+def set_http_cache(url, etag, body):
+    connect_to_bundles().hset('bundle-http', url, json.dumps({'etag': etag, 'body': body}))
+
+
+def get_http_urls():
+    return connect_to_bundles().hkeys('bundle-http')
+
+
+def remove_http_cache(urls):
+    if urls:
+        connect_to_bundles().hdel('bundle-http', *urls)
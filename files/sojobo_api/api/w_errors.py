@@ -68,5 +68,17 @@ def already_exists(item):
     return 409, 'The {} already exists!'.format(item)
 
 
+def invalid_bundle(message):
+    return 400, 'The bundle is not valid: {}'.format(message)
+
+
+def cannot_retry(tasks):
+    return 409, 'Only a failed job of these tasks can be retried: {}'.format(tasks)
+
+
+def juju_error(error):
+    return 400, 'Juju refused the operation: {}'.format(getattr(error, 'message', None) or str(error))
+
+
 def cmd_error(message):
     return 500, message
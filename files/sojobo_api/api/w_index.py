@@ -0,0 +1,51 @@
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,r0903
+################################################################################
+# MODEL INDEX
+################################################################################
+class ModelIndex(object):
+    """Lookups over the state of a model, built in one pass over it.
+    state maps every entity type to {id: latest data}, as returned by
+    ModelMirror.state().
+        relations   application -> [{'interface', 'with'}]
+        units       application -> [unit data]
+        containers  machine -> [container ids], nested containers included"""
+    def __init__(self, state):
+        self.applications = state.get('application', {})
+        self.units = state.get('unit', {})
+        self.machines = state.get('machine', {})
+        self.relations = {name: [] for name in self.applications}
+        self.app_units = {name: [] for name in self.applications}
+        self.containers = {}
+        for relation in state.get('relation', {}).values():
+            self.add_relation(relation['key'].split(' '))
+        for name, unit in self.units.items():
+            self.app_units.setdefault(unit.get('application') or name.split('/')[0], []).append(unit)
+        for machine in self.machines:
+            if '/' in machine:
+                self.containers.setdefault(machine.split('/')[0], []).append(machine)
+
+    def add_relation(self, keys):
+        ends = [key.split(':') for key in keys]
+        if len(ends) == 1:
+            self.relations.setdefault(ends[0][0], []).append({'interface': ends[0][1], 'with': ends[0][0]})
+        else:
+            self.relations.setdefault(ends[0][0], []).append({'interface': ends[1][1], 'with': ends[1][0]})
+            if ends[1][0] != ends[0][0]:
+                self.relations.setdefault(ends[1][0], []).append({'interface': ends[0][1], 'with': ends[0][0]})
+
+    def top_machines(self):
+        return {name: data for name, data in self.machines.items() if '/' not in name}
@@ -15,27 +15,47 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # pylint: disable=c0111,c0301,c0325,c0103,r0204,r0913,r0902,e0401,C0302
 import asyncio
-from importlib import import_module
 import os
 # import tempfile
 # import shutil
-from subprocess import check_output, check_call, Popen
+from subprocess import check_output, check_call
+from threading import Lock, Thread
 import json
+import time
 from asyncio_extras import async_contextmanager
-from flask import abort, Response
+from flask import abort, g, Response
+from werkzeug.http import parse_authorization_header
 from juju import tag
 from juju.controller import Controller
 from juju.errors import JujuAPIError, JujuError
 from juju.model import Model
-from sojobo_api.api import w_errors as errors, w_datastore as datastore
+from sojobo_api.api import w_auth, w_bundle, w_errors as errors, w_datastore as datastore, w_keys, w_mirror, w_registry
+from sojobo_api.api.w_pool import POOL
 from sojobo_api import settings
 ################################################################################
+# EVENT LOOP
+################################################################################
+# Every worker process runs one event loop in a background thread. Request
+# threads hand their coroutines to it, so pooled connections and other state
+# bound to the loop survive between requests.
+LOOP = None
+LOOP_PID = None
+LOOP_LOCK = Lock()
+################################################################################
 # TENGU FUNCTIONS
 ################################################################################
+class Bearer_Auth(object):  #pylint: disable=R0903
+    def __init__(self, username, password, session):
+        self.username = username
+        self.password = password
+        self.session = session
+
+
 class JuJu_Token(object):  #pylint: disable=R0903
     def __init__(self, auth):
         self.username = auth.username
         self.password = auth.password
+        self.session = getattr(auth, 'session', None)
         self.is_admin = self.set_admin()
 
     def set_admin(self):
@@ -55,9 +75,8 @@ class Controller_Connection(object):
         else:
             self.endpoint = None
             self.c_cacert = None
-        self.c_token = getattr(get_controller_types()[self.c_type], 'Token')(self.endpoint, token.username, token.password)
+        self.c_token = w_registry.require(self.c_type).token(self.endpoint, token.username, token.password)
     async def set_controller(self, token, c_name):
-        await self.c_connection.disconnect()
         self.c_name = c_name
         self.c_access = datastore.get_controller_access(token.username, c_name)
         self.c_connection = Controller()
@@ -65,19 +84,17 @@ class Controller_Connection(object):
         self.c_type = con['type']
         self.endpoint = con['endpoints'][0]
         self.c_cacert = con['ca-cert']
-        self.c_token = getattr(get_controller_types()[self.c_type],
-                               'Token')(self.endpoint, token.username, token.password)
+        self.c_token = w_registry.require(self.c_type).token(self.endpoint, token.username, token.password)
 
     @async_contextmanager
     async def connect(self, token):
-        nested = False
-        if self.c_connection.connection is None or not self.c_connection.connection.is_open:
-            await self.c_connection.connect(self.endpoint, token.username, token.password, self.c_cacert)
-        else:
-            nested = True
-        yield self.c_connection  #pylint: disable=E1700
-        if not nested:
-            await self.c_connection.disconnect()
+        connection = await POOL.acquire_controller(self.endpoint, token.username,
+                                                   token.password, self.c_cacert)
+        self.c_connection = connection
+        try:
+            yield connection  #pylint: disable=E1700
+        finally:
+            await POOL.release(connection)
 
 
 class Model_Connection(object):
@@ -89,9 +106,9 @@ class Model_Connection(object):
         self.m_access = datastore.get_model_access(controller, self.m_name, token.username)
         self.m_uuid = datastore.get_model(controller, self.m_name)['uuid']
         self.m_connection = Model()
+        self.state_updated = None
 
     async def set_model(self, token, controller, modelname):
-        await self.m_connection.disconnect()
         self.m_name = modelname
         self.m_uuid = datastore.get_model(controller, self.m_name)['uuid']
         self.m_connection = Model()
@@ -99,43 +116,132 @@ class Model_Connection(object):
 
     @async_contextmanager
     async def connect(self, token):
-        nested = False
-        if self.m_connection.connection is None or not self.m_connection.connection.is_open:
-            await self.m_connection.connect(self.c_endpoint, self.m_uuid,
-                                            token.username, token.password, self.c_cacert)
-        else:
-            nested = True
-        yield self.m_connection  #pylint: disable=E1700
-        if not nested:
-            await self.m_connection.disconnect()
+        connection = await POOL.acquire_model(self.c_endpoint, self.m_uuid, token.username,
+                                              token.password, self.c_cacert)
+        self.m_connection = connection
+        try:
+            yield connection  #pylint: disable=E1700
+        finally:
+            await POOL.release(connection)
 
 
-def get_controller_types():
-    c_list = {}
-    for f_path in os.listdir('{}/controllers'.format(settings.SOJOBO_API_DIR)):
-        if 'controller_' in f_path and '.pyc' not in f_path:
-            name = f_path.split('.')[0]
-            c_list[name.split('_')[1]] = import_module('sojobo_api.controllers.{}'.format(name))
-    return c_list
+def get_event_loop():
+    global LOOP, LOOP_PID  #pylint: disable=W0603
+    with LOOP_LOCK:
+        if LOOP is None or LOOP_PID != os.getpid():
+            LOOP = asyncio.new_event_loop()
+            LOOP.set_debug(False)
+            LOOP_PID = os.getpid()
+            Thread(target=run_event_loop, args=(LOOP,), name='sojobo-event-loop', daemon=True).start()
+    return LOOP
+
+
+def use_event_loop(loop):
+    """Used by servers that already run an event loop in the main thread, so
+    handlers can submit their coroutines to that loop instead."""
+    global LOOP, LOOP_PID  #pylint: disable=W0603
+    with LOOP_LOCK:
+        LOOP = loop
+        LOOP_PID = os.getpid()
+
+
+def run_event_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
 
 
 def execute_task(command, *args, **kwargs):
-    loop = asyncio.get_event_loop()
-    loop.set_debug(False)
-    result = loop.run_until_complete(command(*args, **kwargs))
-    return result
+    future = asyncio.run_coroutine_threadsafe(command(*args, **kwargs), get_event_loop())
+    return future.result()
+
+
+async def get_stats():
+    return {'juju-connections': POOL.stats(),
+            'redis': datastore.get_pool_stats(),
+            'redis-transactions': datastore.get_transaction_stats(),
+            'queued-jobs': datastore.get_queue_length(),
+            'model-mirrors': w_mirror.stats(),
+            'auth-cache': w_auth.stats(),
+            'bundle-catalog': datastore.get_bundle_catalog()}
+
+
+async def get_jobs(token):
+    if token.is_admin:
+        return datastore.get_jobs()
+    return datastore.get_jobs(token.username)
+
+
+async def get_job(token, job_id):
+    job = datastore.get_job(job_id)
+    if job is not None and (token.is_admin or job['owner'] == token.username):
+        return job
+    return None
+
+
+def get_auth(request):
+    """The credentials of a Flask or aiohttp request, from basic auth or from a
+    bearer token issued by /tengu/login. None when there are none or the token
+    is invalid, expired or revoked."""
+    header = request.headers.get('Authorization')
+    if header is None or not header.startswith('Bearer '):
+        return parse_authorization_header(header)
+    data = w_auth.verify_token(header[len('Bearer '):].strip())
+    if data is None:
+        return None
+    session = datastore.get_session(data['session'])
+    if session is None or session['user'] != data['user']:
+        return None
+    password = w_auth.decrypt(session['password'])
+    if password is None:
+        return None
+    return Bearer_Auth(session['user'], password, data['session'])
 
 
-def create_response(http_code, return_object, is_json=False):
+def request_token(request):
+    """The token of the Flask request being handled, authenticated only once
+    per request, also when a decorator like w_cache.cached needed it first."""
+    token = getattr(g, 'token', None)
+    if token is None:
+        token = execute_task(authenticate, request.headers['api-key'], get_auth(request))
+        g.token = token
+    return token
+
+
+async def create_session(token):
+    ttl = int(settings.TOKEN_TTL)
+    expires = int(time.time()) + ttl
+    session = datastore.create_session(token.username, w_auth.encrypt(token.password), ttl)
+    return {'token': w_auth.create_token(token.username, session, expires), 'expires': expires}
+
+
+async def remove_session(token):
+    if token.session is not None:
+        datastore.remove_session(token.username, token.session)
+
+
+def create_response(http_code, return_object, is_json=False, headers=None):
     if not is_json:
         return_object = json.dumps(return_object)
     return Response(
         return_object,
         status=http_code,
         mimetype='application/json',
+        headers=headers
     )
 
 
+def job_headers(job_id):
+    if job_id is None:
+        return None
+    return {'Location': '/tengu/jobs/{}'.format(job_id)}
+
+
+def state_headers(model):
+    if model.state_updated is None:
+        return None
+    return {'X-State-Updated': '{:.3f}'.format(model.state_updated)}
+
+
 def check_input(data, optional=False):
     if not data:
         if optional:
@@ -162,14 +268,21 @@ async def authenticate(api_key, auth):
         if auth is None:
             abort(error[0], error[1])
         token = JuJu_Token(auth)
-        if token.is_admin:
+        if token.is_admin or token.session is not None:
             return token
         else:
+            epoch = datastore.get_auth_epoch(token.username)
+            if epoch is not None and w_auth.is_verified(token.username, token.password, epoch):
+                return token
+            if w_auth.epoch_changed(token.username, epoch):
+                await POOL.discard(username=token.username)
             try:
                 cont_name = list(await get_all_controllers())[0]
                 controller = Controller_Connection(token, cont_name)
                 async with controller.connect(token):  #pylint: disable=E1701
                     pass
+                if epoch is not None:
+                    w_auth.verified(token.username, token.password, epoch)
                 return token
             except JujuAPIError:
                 abort(error[0], error[1])
@@ -203,11 +316,11 @@ async def cloud_supports_series(controller_connection, series):
     if series is None:
         return True
     else:
-        return series in get_controller_types()[controller_connection.c_token.type].get_supported_series()
+        return series in w_registry.require(controller_connection.c_token.type).supported_series
 
 
 async def check_c_type(c_type):
-    if check_input(c_type) in get_controller_types().keys():
+    if w_registry.get_type(check_input(c_type)) is not None:
         return c_type.lower()
     else:
         error = errors.invalid_controller(c_type)
@@ -217,14 +330,14 @@ async def check_c_type(c_type):
 async def create_controller(c_type, name, region, credentials):
     for controller in await get_all_controllers():
         if datastore.get_controller(controller)['state'] == 'PENDING':
-            return 503, 'An environment is already being created'
-    Popen(["python3.6", "{}/scripts/add_controller.py".format(settings.SOJOBO_API_DIR),
-           c_type, name, region, json.dumps(credentials)])
-    return 202, 'Environment {} is being created in region {}'.format(name, region)
+            return 503, 'An environment is already being created', None
+    job = datastore.enqueue_job(settings.JUJU_ADMIN_USER, 'add_controller', c_type, name, region, credentials,
+                                controller=name)
+    return 202, 'Environment {} is being created in region {}'.format(name, region), job
 
 
 async def generate_cred_file(c_type, name, credentials):
-    return get_controller_types()[c_type].generate_cred_file(name, credentials)
+    return w_registry.require(c_type).generate_cred_file(name, credentials)
 
 
 async def delete_controller(con):
@@ -233,6 +346,8 @@ async def delete_controller(con):
     check_output(['juju', 'login', con.c_name, '-u', settings.JUJU_ADMIN_USER], input=bytes('{}\n'.format(settings.JUJU_ADMIN_PASSWORD), 'utf-8'))
     check_call(['juju', 'destroy-controller', '-y', con.c_name, '--destroy-all-models'])
     check_call(['juju', 'remove-credential', con.c_type, con.c_name])
+    await w_mirror.close_mirrors(endpoint=con.endpoint)
+    await POOL.discard(endpoint=con.endpoint)
     datastore.destroy_controller(con.c_name)
 
 
@@ -241,8 +356,7 @@ async def get_all_controllers():
 
 
 async def controller_exists(c_name):
-    controllers = await get_all_controllers()
-    return c_name in controllers
+    return datastore.controller_exists(c_name)
 
 
 async def get_controller_access(con, username):
@@ -307,19 +421,99 @@ async def get_models_info(token, controller):
     return await get_all_models(token, controller)
 
 
-async def get_model_info(token, controller, model):
+MODEL_LIST_FIELDS = ['status', 'uuid', 'owner']
+
+
+async def get_models_page(controller, cursor=None, limit=None, status=None, owner=None):
+    """The models of a controller, a page of them is read with SSCAN."""
+    if limit is None:
+        models, next_cursor = datastore.get_all_models(controller.c_name), 0
+    else:
+        next_cursor, models = datastore.scan_models(controller.c_name, cursor, limit)
+    return [m for m in models if (status is None or m['status'] == status)
+            and (owner is None or m.get('owner') == owner)], next_cursor
+
+
+def check_fields(fields, known):
+    """The fields of a comma separated ?fields= parameter, all known fields
+    when it is not given."""
+    if fields is None:
+        return known
+    selected = [f.strip() for f in fields.split(',') if f.strip()]
+    for field in selected:
+        if field not in known:
+            error = errors.invalid_option(field)
+            abort(error[0], error[1])
+    return [f for f in known if f in selected]
+
+
+# Pagination of list calls. A list is only paged when the request has a cursor
+# or limit, the cursor of the next page is sent in the X-Next-Cursor header.
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def get_page(args):
+    """The cursor and limit of a list request, (None, None) when it asks for
+    the whole list."""
+    if 'cursor' not in args and 'limit' not in args:
+        return None, None
+    try:
+        cursor = int(args.get('cursor', 0))
+        limit = int(args.get('limit', PAGE_SIZE))
+    except ValueError:
+        cursor, limit = -1, -1
+    if cursor < 0 or not 0 < limit <= MAX_PAGE_SIZE:
+        error = errors.invalid_data()
+        abort(error[0], error[1])
+    return cursor, limit
+
+
+def paginate(items, cursor, limit):
+    """A page of a list that is in memory and the cursor of the next page,
+    0 after the last one."""
+    if limit is None:
+        return items, 0
+    end = cursor + limit
+    return items[cursor:end], end if end < len(items) else 0
+
+
+def project(items, fields):
+    return [{key: value for key, value in item.items() if key == 'name' or key in fields} for item in items]
+
+
+def page_headers(next_cursor, headers=None):
+    if next_cursor:
+        headers = dict(headers or {})
+        headers['X-Next-Cursor'] = str(next_cursor)
+    return headers
+
+
+MODEL_FIELDS = ['users', 'ssh-keys', 'applications', 'machines', 'juju-gui-url', 'credentials']
+CONNECTED_FIELDS = ['ssh-keys', 'credentials']
+
+
+async def get_model_info(token, controller, model, fields=None):
     state = datastore.check_model_state(controller.c_name, model.m_name)
     if state == 'ready':
-        async with model.connect(token):
-            users = await get_users_model(token, controller, model)
-            ssh = await get_ssh_keys(token, model)
-            applications = await get_applications_info(token, model)
-            machines = await get_machines_info(token, model)
-            gui = await get_gui_url(controller, model)
-            credentials = await get_model_creds(token, model)
-        return {'name': model.m_name, 'users': users, 'ssh-keys': ssh,
-                'applications': applications, 'machines': machines, 'juju-gui-url' : gui,
-                'status': datastore.check_model_state(controller.c_name, model.m_name), 'credentials' : credentials}
+        fields = MODEL_FIELDS if fields is None else fields
+        parts = {'users': lambda: get_users_model(token, controller, model),
+                 'ssh-keys': lambda: get_ssh_keys(token, model),
+                 'applications': lambda: get_applications_info(token, model),
+                 'machines': lambda: get_machines_info(token, model),
+                 'juju-gui-url': lambda: get_gui_url(controller, model),
+                 'credentials': lambda: get_model_creds(token, model)}
+        # The parts do not depend on each other, the RPCs among them share the
+        # pooled connection that is held here. Only the ssh keys and the
+        # credentials are read from the model, the other parts need none.
+        if any(field in CONNECTED_FIELDS for field in fields):
+            async with model.connect(token):
+                values = await asyncio.gather(*[parts[field]() for field in fields])
+        else:
+            values = await asyncio.gather(*[parts[field]() for field in fields])
+        result = {'name': model.m_name, 'status': datastore.check_model_state(controller.c_name, model.m_name)}
+        result.update(zip(fields, values))
+        return result
     elif state == 'accepted' or state == 'error':
         return {'name': model.m_name, 'status': state, 'users' : {"user" : token.username, "access" : "admin"}}
     else:
@@ -356,45 +550,51 @@ async def get_ssh_keys_user(user):
     return datastore.get_ssh_keys(user)
 
 
-async def get_applications_info(token, model):
-    result = []
-    async with model.connect(token) as juju:
-        for data in juju.state.state.get('application', {}).values():
-            res = {'name': data[0]['name'], 'relations': [], 'charm': data[0]['charm-url'], 'exposed': data[0]['exposed'],
-                   'status': data[0]['status']}
-            for rels in juju.state.state['relation'].values():
-                keys = rels[0]['key'].split(" ")
-                if len(keys) == 1 and data[0]['name'] == keys[0].split(":")[0]:
-                    res['relations'].extend([{'interface': keys[0].split(":")[1], 'with': keys[0].split(":")[0]}])
-                elif len(keys) == 2 and data[0]['name'] == keys[0].split(":")[0]:
-                    res['relations'].extend([{'interface': keys[1].split(":")[1], 'with': keys[1].split(":")[0]}])
-                elif len(keys) == 2 and data[0]['name'] == keys[1].split(":")[0]:
-                    res['relations'].extend([{'interface': keys[0].split(":")[1], 'with': keys[0].split(":")[0]}])
-            res['units'] = await get_units_info(token, model, data[0]['name'])
-            result.append(res)
-    return result
+async def get_model_index(model):
+    """The indexed current state of the model from its mirror, without
+    connecting to the model for every request."""
+    mirror = await w_mirror.get_mirror(model.c_endpoint, model.m_uuid, model.c_cacert)
+    model.state_updated = mirror.updated
+    return mirror.index()
 
 
-async def get_units_info(token, model, application):
-    try:
-        async with model.connect(token) as juju:
-            data = juju.state.state['unit']
-        units = []
-        result = []
-        for unit in data.keys():
-            if unit.startswith(application):
-                units.append(data[unit][0])
-        for u in units:
-            ports = await get_unit_ports(u)
-            result.append({'name': u['name'],
-                           'machine': u['machine-id'],
-                           'public-ip': u['public-address'],
-                           'private-ip': u['private-address'],
-                           'series': u['series'],
-                           'ports': ports})
-        return result
-    except KeyError:
-        return []
+async def wait_for_mirror(model, check):
+    """A write reaches the mirror some time after it returned, the answer to
+    the write is read after check(index) shows it."""
+    mirror = await w_mirror.get_mirror(model.c_endpoint, model.m_uuid, model.c_cacert)
+    await mirror.wait_for(check, w_mirror.WRITE_WAIT)
+
+
+APPLICATION_FIELDS = ['charm', 'exposed', 'status', 'relations', 'units']
+
+
+def charm_series(charm_url):
+    """xenial for cs:xenial/mysql-5, None when the url has no series."""
+    path = charm_url.split(':')[-1]
+    return path.split('/')[-2] if '/' in path else None
+
+
+async def get_applications_info(token, model, status=None, series=None):  #pylint: disable=W0613
+    index = await get_model_index(model)
+    return [{'name': data['name'], 'charm': data['charm-url'], 'exposed': data['exposed'], 'status': data['status'],
+             'relations': index.relations[name], 'units': [await get_unit_info_data(u) for u in index.app_units[name]]}
+            for name, data in sorted(index.applications.items())
+            if (status is None or data['status'].get('current') == status)
+            and (series is None or charm_series(data['charm-url']) == series)]
+
+
+async def get_units_info(token, model, application):  #pylint: disable=W0613
+    index = await get_model_index(model)
+    return [await get_unit_info_data(u) for u in index.app_units.get(application, [])]
+
+
+async def get_unit_info_data(unit):
+    return {'name': unit['name'],
+            'machine': unit['machine-id'],
+            'public-ip': unit['public-address'],
+            'private-ip': unit['private-address'],
+            'series': unit['series'],
+            'ports': await get_unit_ports(unit)}
 
 
 async def get_public_ip_controller(token, controller):
@@ -414,89 +614,82 @@ async def get_gui_url(controller, model):
 
 async def create_model(token, controller, model, credentials):
     state = datastore.check_model_state(controller, model)
+    job = None
     if state != "error":
         code, response = errors.already_exists('model')
     elif credentials in datastore.get_credential_keys(token.username):
-        datastore.add_model_to_controller(controller, model)
+        datastore.add_model_to_controller(controller, model, token.username)
         datastore.set_model_state(controller, model, 'accepted')
         datastore.set_model_access(controller, model, token.username, 'admin')
-        Popen(["python3.6", "{}/scripts/add_model.py".format(settings.SOJOBO_API_DIR), token.username,
-               token.password, settings.SOJOBO_API_DIR, settings.REDIS_HOST, settings.REDIS_PORT,
-               controller, model, credentials])
+        job = datastore.enqueue_job(token.username, 'add_model', controller, model, token.username, token.password,
+                                    credentials, controller=controller, model=model)
         code, response = 202, "Model is being deployed"
     else:
         code, response = 404, "Credentials {} not found!".format(credentials)
-    return code, response
+    return code, response, job
 
 
 async def delete_model(token, controller, model):
     if datastore.check_model_state(controller.c_name, model.m_name) != 'error':
         async with controller.connect(token) as juju:
             await juju.destroy_models(model.m_uuid)
+        await w_mirror.close_mirrors(uuid=model.m_uuid)
+        await POOL.discard(uuid=model.m_uuid)
         datastore.delete_model(controller.c_name, model.m_name)
         return "Model {} is being deleted".format(model.m_name)
     else:
         return "Model {} is in errorstate".format(model.m_name)
+
+
+async def watch_model(model):
+    return await w_mirror.subscribe(model.c_endpoint, model.m_uuid, model.c_cacert)
+
+
+def stream_model(mirror, queue):
+    try:
+        while True:
+            message = execute_task(w_mirror.next_message, mirror, queue)
+            if message is None:
+                break
+            yield message
+    finally:
+        execute_task(mirror.unsubscribe, queue)
+
+
+def create_stream(stream):
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 #####################################################################################
 # Machines FUNCTIONS
 #####################################################################################
-async def get_machines_info(token, model):
-    result = {}
-    async with model.connect(token) as juju:
-        for machine, data in juju.state.state.get('machine', {}).items():
-            try:
-                if data[0]['agent-status']['current'] == 'error' and data[0]['addresses'] is None:
-                    result[machine] = {'name': machine, 'Error': data[0]['agent-status']['message']}
-                if data[0] is None:
-                    result[machine] = {'name': machine, 'instance-id': 'Unknown', 'ip': 'Unknown',
-                                       'series': 'Unknown', 'containers': 'Unknown',
-                                       'hardware-characteristics' : 'Unknown'}
-                if 'lxd' in machine:
-                    result[machine.split('/')[0]].get('containers', []).append({
-                        'name': machine, 'instance-id': data[0]['instance-id'],
-                        'ip': await get_machine_ip(data[0]), 'series': data[0]['series']
-                    })
-                else:
-                    result[machine] = {
-                        'name': machine,
-                        'instance-id': data[0]['instance-id'],
-                        'ip': await get_machine_ip(data[0]),
-                        'series': data[0]['series'],
-                        'hardware-characteristics': data[0]['hardware-characteristics']
-                    }
-            except KeyError:
-                result[machine] = {'name': machine, 'instance-id': 'Unknown', 'ip': 'Unknown', 'series': 'Unknown',
-                                   'containers': 'Unknown', 'hardware-characteristics' : 'Unknown'}
-    return [info for info in result.values()]
-
-
-async def get_machine_info(token, model, machine):
+MACHINE_FIELDS = ['instance-id', 'ip', 'series', 'hardware-characteristics', 'containers', 'Error']
+
+
+async def get_machines_info(token, model, status=None, series=None):  #pylint: disable=W0613
+    index = await get_model_index(model)
+    return [await get_machine_info_data(index, machine) for machine, data in sorted(index.top_machines().items())
+            if (status is None or data.get('agent-status', {}).get('current') == status)
+            and (series is None or data.get('series') == series)]
+
+
+async def get_machine_info(token, model, machine):  #pylint: disable=W0613
+    index = await get_model_index(model)
+    return await get_machine_info_data(index, machine)
+
+
+async def get_machine_info_data(index, machine):
     try:
-        async with model.connect(token) as juju:
-            data = juju.state.state['machine']
-        machine_data = data[machine][0]
+        machine_data = index.machines[machine]
         if machine_data['agent-status']['current'] == 'error' and machine_data['addresses'] is None:
-            result = {'name': machine, 'Error': machine_data['agent-status']['message']}
-            return result
-        if machine_data is None:
-            result = {'name': machine, 'instance-id': 'Unknown', 'ip': 'Unknown', 'series': 'Unknown', 'containers': 'Unknown', 'hardware-characteristics' : 'unknown'}
-            return result
-        containers = []
-        if not 'lxd' in machine:
-            lxd = []
-            for key in data.keys():
-                if key.startswith('{}/lxd'.format(machine)):
-                    lxd.append(key)
-            if lxd != []:
-                for cont in lxd:
-                    cont_data = data[cont][0]
-                    ip = await get_machine_ip(cont_data)
-                    containers.append({'name': cont, 'instance-id': cont_data['instance-id'], 'ip': ip, 'series': cont_data['series']})
-            mach_ip = await get_machine_ip(machine_data)
-            result = {'name': machine, 'instance-id': machine_data['instance-id'], 'ip': mach_ip, 'series': machine_data['series'], 'hardware-characteristics' : machine_data['hardware-characteristics'], 'containers': containers}
-        else:
-            mach_ip = await get_machine_ip(machine_data)
-            result = {'name': machine, 'instance-id': machine_data['instance-id'], 'ip': mach_ip, 'series': machine_data['series'], 'hardware-characteristics' : machine_data['hardware-characteristics']}
+            return {'name': machine, 'Error': machine_data['agent-status']['message']}
+        result = {'name': machine, 'instance-id': machine_data['instance-id'], 'ip': await get_machine_ip(machine_data),
+                  'series': machine_data['series'], 'hardware-characteristics': machine_data['hardware-characteristics']}
+        if '/' not in machine:
+            result['containers'] = []
+            for cont in index.containers.get(machine, []):
+                cont_data = index.machines[cont]
+                result['containers'].append({'name': cont, 'instance-id': cont_data['instance-id'],
+                                             'ip': await get_machine_ip(cont_data), 'series': cont_data['series']})
     except KeyError:
         result = {'name': machine, 'instance-id': 'Unknown', 'ip': 'Unknown', 'series': 'Unknown', 'containers': 'Unknown', 'hardware-characteristics' : 'unknown'}
     return result
@@ -519,30 +712,38 @@ async def add_machine(token, model, ser=None, cont=None):
         await juju.add_machine(series=ser, constraints=cont)
 
 
-async def machine_exists(token, model, machine):
+async def machine_exists(token, model, machine, live=True):
+    """Checks that guard a write look at the state of the connection the write
+    is made over, reads look at the mirror they are served from."""
+    if not live:
+        return machine in (await get_model_index(model)).machines
     async with model.connect(token) as juju:
-        return machine in juju.state.state.get('machine', {}).keys()
+        return machine in juju.state.machines
 
 
 async def remove_machine(token, controller, model, machine):
-    Popen(["python3.6", "{}/scripts/remove_machine.py".format(settings.SOJOBO_API_DIR), token.username,
-           token.password, settings.SOJOBO_API_DIR, settings.REDIS_HOST, settings.REDIS_PORT,
-           controller.c_name, model.m_name, machine])
+    return datastore.enqueue_job(token.username, 'remove_machine', controller.c_name, model.m_name, token.username,
+                                 token.password, machine, controller=controller.c_name, model=model.m_name)
 #####################################################################################
 # APPLICATION FUNCTIONS
 #####################################################################################
-async def app_exists(token, controller, model, app_name):
-    model_info = await get_model_info(token, controller, model)
-    for app in model_info['applications']:
-        if app['name'] == app_name:
-            return True
-    return False
+async def app_exists(token, controller, model, app_name, live=True):  #pylint: disable=W0613
+    if not live:
+        return app_name in (await get_model_index(model)).applications
+    async with model.connect(token) as juju:
+        return app_name in juju.state.applications
 
 
 async def add_bundle(token, controller, model, bundle):
-    Popen(["python3.6", "{}/scripts/bundle_deployment.py".format(settings.SOJOBO_API_DIR),
-           token.username, token.password, settings.SOJOBO_API_DIR, controller, model,
-           str(bundle), settings.REDIS_HOST, settings.REDIS_PORT])
+    """Checks the bundle before it is queued, a bundle that is not valid is
+    refused here instead of failing in the worker."""
+    try:
+        w_bundle.plan(bundle)
+    except w_bundle.BundleError as e:
+        error = errors.invalid_bundle(e)
+        abort(error[0], error[1])
+    return datastore.enqueue_job(token.username, 'bundle_deployment', token.username, token.password, controller, model,
+                                 bundle, controller=controller, model=model)
 
 
 async def deploy_app(token, model, app_name, name=None, ser=None, tar=None, con=None, num_of_units=1):
@@ -550,13 +751,15 @@ async def deploy_app(token, model, app_name, name=None, ser=None, tar=None, con=
         try:
             await juju.deploy(app_name, application_name=name, series=ser, to=tar, config=con, num_units=num_of_units)
         except JujuError as e:
-            if e == 'subordinate application must be deployed without units':
-                await juju.deploy(app_name, application_name=name, series=ser, to=tar, config=con, num_units=0)
+            if 'subordinate application must be deployed without units' not in getattr(e, 'message', str(e)):
+                raise
+            await juju.deploy(app_name, application_name=name, series=ser, to=tar, config=con, num_units=0)
 
 
 async def check_if_exposed(token, model, app_name):
-    app_info = await get_application_info(token, model, app_name)
-    return app_info['exposed']
+    async with model.connect(token):
+        app = await get_application_entity(token, model, app_name)
+        return app.safe_data['exposed']
 
 
 async def expose_app(token, model, app_name):
@@ -591,6 +794,16 @@ async def get_application_info(token, model, applic):
             return app
 
 
+async def get_deployed_application(token, model, app_name):
+    await wait_for_mirror(model, lambda index: app_name in index.applications)
+    return await get_application_info(token, model, app_name)
+
+
+async def get_exposed_application(token, model, app_name, exposed):
+    await wait_for_mirror(model, lambda index: index.applications.get(app_name, {}).get('exposed') == exposed)
+    return await get_application_info(token, model, app_name)
+
+
 async def get_unit_info(token, model, application, unitnumber):
     for u in await get_units_info(token, model, application):
         if u['name'] == '{}/{}'.format(application, unitnumber):
@@ -599,9 +812,9 @@ async def get_unit_info(token, model, application, unitnumber):
 
 
 async def add_unit(token, controller, model, app_name, amount, target):
-    Popen(["python3.6", "{}/scripts/add_unit.py".format(settings.SOJOBO_API_DIR), token.username,
-           token.password, settings.SOJOBO_API_DIR, settings.REDIS_HOST, settings.REDIS_PORT,
-           controller.c_name, model.m_name, app_name, str(amount), target])
+    return datastore.enqueue_job(token.username, 'add_unit', controller.c_name, model.m_name, token.username,
+                                 token.password, app_name, str(amount), target,
+                                 controller=controller.c_name, model=model.m_name)
 
 
 async def remove_unit(token, model, application, unit_number):
@@ -623,6 +836,11 @@ async def get_relations_info(token, model):
     return [{'name': a['name'], 'relations': a['relations']} for a in data]
 
 
+async def get_added_relation(token, model, app1, app2):
+    await wait_for_mirror(model, lambda index: any(r['with'] == app2 for r in index.relations.get(app1, [])))
+    return await get_relations_info(token, model)
+
+
 async def add_relation(token, model, app1, app2):
     async with model.connect(token) as juju:
         await juju.add_relation(app1, app2)
@@ -659,59 +877,125 @@ async def get_application_config(token, mod, app_name):
 ###############################################################################
 # USER FUNCTIONS
 ###############################################################################
-async def create_user(token, username, password):
+async def on_controller(token, c_name, action):
+    controller = Controller_Connection(token, c_name)
+    async with controller.connect(token) as juju:  #pylint: disable=E1701
+        await action(c_name, juju)
+
+
+async def on_all_controllers(token, action, controllers=None):
+    """Runs action(c_name, controller) on every controller, or on the given
+    ones, at the same time,
+    at most controller-concurrency at once and each within controller-timeout
+    seconds. A failing controller does not stop the others, the result has
+    the state of every controller."""
+    slots = asyncio.Semaphore(int(settings.CONTROLLER_CONCURRENCY))
+    timeout = int(settings.CONTROLLER_TIMEOUT)
+
+    async def run(c_name):
+        async with slots:
+            try:
+                await asyncio.wait_for(on_controller(token, c_name, action), timeout)
+                return c_name, {'state': 'done'}
+            except asyncio.TimeoutError:
+                return c_name, {'state': 'failed', 'error': 'No answer within {} seconds'.format(timeout)}
+            except JujuAPIError as e:
+                return c_name, {'state': 'failed', 'error': e.message}
+            except Exception as e:  #pylint: disable=W0703
+                return c_name, {'state': 'failed', 'error': str(e) or type(e).__name__}
+    if controllers is None:
+        controllers = await get_all_controllers()
+    if not controllers:
+        return {}
+    return dict(await asyncio.gather(*[run(c_name) for c_name in controllers]))
+
+
+def all_done(results):
+    return all(result['state'] == 'done' for result in results.values())
+
+
+def fan_out_response(results, message):
+    """200 with message when every controller succeeded, otherwise 207 with
+    the result per controller."""
+    if all_done(results):
+        return 200, message
+    return 207, results
+
+
+async def create_user(token, username, password, controllers=None):
+    """Creates the user on every controller, or on the given ones when a
+    create that did not reach all of them is sent again. A controller that
+    already has the user, or already granted it login, only gets the rest."""
     datastore.create_user(username)
-    for con in await get_all_controllers():
-        controller = Controller_Connection(token, con)
-        async with controller.connect(token) as juju:  #pylint: disable=E1701
+
+    async def add(c_name, juju):
+        try:
             await juju.add_user(username, password)
+        except JujuAPIError as e:
+            if 'already exists' not in e.message:
+                raise
+        try:
             await juju.grant(username)
-            datastore.add_user_to_controller(con, username, 'login')
+        except JujuAPIError as e:
+            if 'already has' not in e.message:
+                raise
+        datastore.add_user_to_controller(c_name, username, 'login')
+    return await on_all_controllers(token, add, controllers)
+
+
+async def get_missing_controllers(username):
+    """The controllers an active user is not on yet, those a create that
+    answered 207 failed on."""
+    user = datastore.get_user(username)
+    if user is None or not user['active']:
+        return []
+    known = {c['name'] for c in user['controllers']}
+    return [c for c in await get_all_controllers() if c not in known]
 
 
 async def delete_user(token, username):
-    for con in await get_all_controllers():
-        controller = Controller_Connection(token, con)
-        async with controller.connect(token) as juju:  #pylint: disable=E1701
-            await juju.disable_user(username)
-        datastore.remove_user_from_controller(con, username)
-    datastore.disable_user(username)
+    async def disable(c_name, juju):
+        await juju.disable_user(username)
+        datastore.remove_user_from_controller(c_name, username)
+    results = await on_all_controllers(token, disable)
+    # The user stays active while a controller still knows it, so the
+    # delete can be retried.
+    if all_done(results):
+        datastore.disable_user(username)
+    datastore.invalidate_auth(username)
+    w_auth.invalidate(username)
+    await POOL.discard(username=username)
+    return results
 
 
 async def enable_user(token, username):
-    for con in await get_all_controllers():
-        controller = Controller_Connection(token, con)
-        async with controller.connect(token) as juju:  #pylint: disable=E1701
-            await juju.enable_user(username)
-        datastore.add_user_to_controller(controller, username, 'login')
-    datastore.enable_user_con(controller, username)
+    async def enable(c_name, juju):
+        await juju.enable_user(username)
+        datastore.add_user_to_controller(c_name, username, 'login')
+    results = await on_all_controllers(token, enable)
+    if all_done(results):
+        datastore.enable_user(username)
+    return results
 
 
 async def change_user_password(token, username, password):
-    for con in await get_all_controllers():
-        controller = Controller_Connection(token, con)
-        async with controller.connect(token) as juju:  #pylint: disable=E1701
-            await juju.change_user_password(username, password)
+    async def change(c_name, juju):  #pylint: disable=W0613
+        await juju.change_user_password(username, password)
+    results = await on_all_controllers(token, change)
+    datastore.invalidate_auth(username)
+    w_auth.invalidate(username)
+    await POOL.discard(username=username)
+    return results
 
 
 async def add_ssh_key_user(user, ssh_key):
-    Popen([
-        "python3.6",
-        "{}/scripts/add_ssh_key.py".format(settings.SOJOBO_API_DIR),
-        settings.JUJU_ADMIN_USER,
-        settings.JUJU_ADMIN_PASSWORD,
-        settings.SOJOBO_API_DIR,
-        ssh_key, settings.REDIS_HOST, settings.REDIS_PORT, user])
+    return datastore.enqueue_job(user, 'add_ssh_key', settings.JUJU_ADMIN_USER, settings.JUJU_ADMIN_PASSWORD,
+                                 ssh_key, user)
 
 
 async def remove_ssh_key_user(user, ssh_key):
-    Popen([
-        "python3.6",
-        "{}/scripts/remove_ssh_key.py".format(settings.SOJOBO_API_DIR),
-        settings.JUJU_ADMIN_USER,
-        settings.JUJU_ADMIN_PASSWORD,
-        settings.SOJOBO_API_DIR,
-        ssh_key, settings.REDIS_HOST, settings.REDIS_PORT, user])
+    return datastore.enqueue_job(user, 'remove_ssh_key', settings.JUJU_ADMIN_USER, settings.JUJU_ADMIN_PASSWORD,
+                                 ssh_key, user)
 
 
 async def get_users_controller(controller):
@@ -735,25 +1019,54 @@ async def get_credentials(user):
 
 async def add_credential(user, c_type, cred_name, credential):
     result_cred = await generate_cred_file(c_type, cred_name, credential)
-    Popen(["python3.6", "{}/scripts/add_credential.py".format(settings.SOJOBO_API_DIR), user,
-           settings.SOJOBO_API_DIR, str(result_cred), settings.REDIS_HOST, settings.REDIS_PORT])
+    return datastore.enqueue_job(user, 'add_credential', user, str(result_cred))
 
 
 async def remove_credential(user, cred_name):
-    Popen(["python3.6", "{}/scripts/remove_credential.py".format(settings.SOJOBO_API_DIR), user,
-           settings.SOJOBO_API_DIR, cred_name, settings.REDIS_HOST, settings.REDIS_PORT])
+    return datastore.enqueue_job(user, 'remove_credential', user, cred_name)
+
+
+async def add_user_to_controller(token, controller, user, access, models=None, retry_of=None):
+    return datastore.enqueue_job(token.username, 'set_controller_access', controller.c_name, access, user,
+                                 token.username, token.password, models, controller=controller.c_name,
+                                 user=user, access=access, retry_of=retry_of)
+
+
+async def retry_controller_access(token, job):
+    """Runs a failed access change again for the models that failed, or
+    entirely when the controller itself failed."""
+    controller = await authorize(token, job['controller'])
+    if not (token.is_admin or controller.c_access == 'superuser'):
+        error = errors.unauthorized()
+        abort(error[0], error[1])
+    steps = job.get('progress') or []
+    models = None
+    if steps and steps[0]['state'] == 'done':
+        models = [s['step'].split(' ', 1)[1] for s in steps[1:] if s['state'] != 'done']
+    return await add_user_to_controller(token, controller, job['user'], job['access'], models, job['id'])
 
 
-async def add_user_to_controller(token, controller, user, access):
-    Popen(["python3.6", "{}/scripts/set_controller_access.py".format(settings.SOJOBO_API_DIR),
-           token.username, token.password, settings.SOJOBO_API_DIR,
-           settings.REDIS_HOST, settings.REDIS_PORT, user, access, controller.c_name])
+RETRIES = {'set_controller_access': retry_controller_access}
+
+
+async def retry_job(token, job_id):
+    job = await get_job(token, job_id)
+    if job is None:
+        error = errors.does_not_exist('job')
+        abort(error[0], error[1])
+    if job['task'] not in RETRIES or job['state'] != 'failed' or 'user' not in job:
+        error = errors.cannot_retry(', '.join(sorted(RETRIES)))
+        abort(error[0], error[1])
+    return await RETRIES[job['task']](token, job)
 
 
 async def remove_user_from_controller(token, con, user):
+    models = [(con.c_name, m['name']) for m in datastore.get_models_access(con.c_name, user) or []
+              if m['access'] in ['write', 'admin']]
     await controller_revoke(token, con, user)
     datastore.set_controller_access(con.c_name, user, 'login')
     datastore.remove_models_access(con.c_name, user)
+    await w_keys.KeySync(token.username, token.password, models, removed=datastore.get_ssh_keys(user)).run()
 
 
 async def controller_grant(token, controller, username, access):
@@ -767,9 +1080,8 @@ async def controller_revoke(token, controller, username):
 
 
 async def add_user_to_model(token, controller, model, user, access):
-    Popen(["python3.6", "{}/scripts/set_model_access.py".format(settings.SOJOBO_API_DIR), token.username,
-           token.password, settings.SOJOBO_API_DIR, settings.REDIS_HOST, settings.REDIS_PORT,
-           user, access, controller.c_name, model.m_name])
+    return datastore.enqueue_job(token.username, 'set_model_access', controller.c_name, model.m_name, access, user,
+                                 token.username, token.password, controller=controller.c_name, model=model.m_name)
 
 
 async def model_grant(token, model, username, access):
@@ -780,11 +1092,13 @@ async def model_grant(token, model, username, access):
 async def remove_user_from_model(token, controller, model, username):
     async with model.connect(token) as juju:
         await juju.revoke(username)
-    datastore.remove_model(controller.c_name, model.m_name, username)
+        datastore.remove_model(controller.c_name, model.m_name, username)
+        await w_keys.sync_model(juju.connection, token.username, datastore.get_model_ssh_keys(controller.c_name, model.m_name),
+                                removed=datastore.get_ssh_keys(username))
 
 
 async def user_exists(username):
-    return username in await get_all_users()
+    return datastore.user_exists(username)
 
 
 #libjuju: geen andere methode om users op te vragen atm
@@ -792,16 +1106,25 @@ async def get_all_users():
     return datastore.get_all_users()
 
 
-async def get_users_info(token):
-    if token.is_admin:
-        result = []
-        for user in await get_all_users():
-            u_info = await get_user_info(user)
-            if u_info['active']:
-                result.append(u_info)
-        return result
+USER_FIELDS = ['controllers', 'ssh-keys', 'credentials', 'active']
+
+
+async def get_users_info(token, cursor=None, limit=None, active=True, fields=None):
+    """The active or disabled users and the cursor of the next page, a page is
+    read with SSCAN. A user that is not the admin only gets itself."""
+    fields = USER_FIELDS if fields is None else fields
+    if not token.is_admin:
+        return project([datastore.get_user(token.username, fields)], fields)[0], 0
+    if limit is None:
+        names, next_cursor = await get_all_users(), 0
     else:
-        return datastore.get_user(token.username)
+        next_cursor, names = datastore.scan_users(cursor, limit)
+    result = []
+    for user in names:
+        u_info = datastore.get_user(user, fields)
+        if u_info is not None and u_info['active'] == active:
+            result.append(u_info)
+    return project(result, fields), next_cursor
 
 
 async def get_user_info(username):
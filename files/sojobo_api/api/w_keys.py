@@ -0,0 +1,153 @@
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,r0913,e0401
+import asyncio
+import base64
+from binascii import Error as DecodeError
+from hashlib import md5
+from juju.client import client
+from juju.client.connection import Connection
+from juju.errors import JujuAPIError
+from sojobo_api.api import w_datastore as datastore
+################################################################################
+# SSH KEY SYNC
+################################################################################
+# The ssh keys of a model are the keys of every user with write or admin
+# access to it. A sync lists the keys Juju has for the model, then adds the
+# missing ones and deletes the removed ones with one call each. Many models
+# are synced at the same time, each over a bare API connection, a libjuju
+# Model would start an AllWatcher and load the whole model for one call.
+# Keys are compared by fingerprint, so the same key with another comment is
+# not added twice. Only keys of the user a sync is about are deleted, those
+# removed from the user or all of them when the user can no longer write to
+# the model. Keys added outside of the API, like the one of the juju client
+# of the controller, stay.
+CONCURRENCY = 10
+
+
+def fingerprint(key):
+    """The md5 fingerprint Juju identifies a key by, None for a key that is
+    not valid."""
+    try:
+        data = base64.b64decode(key.strip().split()[1].encode('ascii'))
+    except (IndexError, DecodeError, UnicodeEncodeError):
+        return None
+    digest = md5(data).hexdigest()
+    return ':'.join(a + b for a, b in zip(digest[::2], digest[1::2]))
+
+
+def diff(desired, actual, removed):
+    """The keys to add and the fingerprints of the keys to delete, the keys
+    in removed that are not desired."""
+    desired = {fingerprint(k): k for k in desired}
+    actual = {fingerprint(k) for k in actual}
+    removed = {fingerprint(k) for k in removed}
+    add = [k for f, k in desired.items() if f is not None and f not in actual]
+    delete = [f for f in actual if f is not None and f in removed and f not in desired]
+    return add, delete
+
+
+def check_results(results):
+    failed = [r.error.message for r in results.results if r.error is not None]
+    if failed:
+        raise Exception('; '.join(failed))
+
+
+async def connect_model(con, mod, username, password):
+    """An API connection to the model, without the state of a libjuju Model."""
+    return await Connection.connect(con['endpoints'][0], mod['uuid'], username, password, con['ca-cert'])
+
+
+async def sync_model(connection, user, desired, removed=()):
+    """Brings the keys of a model in line with desired, over an API
+    connection to it as user."""
+    facade = client.KeyManagerFacade.from_connection(connection)
+    listed = await facade.ListKeys(client.Entities([{'tag': 'user-{}'.format(user)}]), True)
+    add, delete = diff(desired, listed.results[0].result or [], removed)
+    if add:
+        check_results(await facade.AddKeys(add, user))
+    if delete:
+        check_results(await facade.DeleteKeys(delete, user))
+    return add, delete
+
+
+def user_models(username):
+    """(controller, model) of every model the user can write to, the keys of
+    the other models do not depend on the user."""
+    user = datastore.get_user(username)
+    if user is None:
+        return []
+    return [(c['name'], m['name']) for c in user['controllers'] for m in c['models'] if m['access'] in ['write', 'admin']]
+
+
+class Progress(object):
+    """The state of the steps of a job that works on many models,
+    report(steps) is called every time a step changes state."""
+    def __init__(self, names, report=None):
+        self.steps = [{'step': name, 'state': 'pending'} for name in names]
+        self.report = report
+
+    def update(self, index, state, error=None):
+        self.steps[index] = {'step': self.steps[index]['step'], 'state': state}
+        if error is not None:
+            self.steps[index]['error'] = error
+        if self.report is not None:
+            self.report(self.steps)
+
+    def check(self):
+        """Fails the job when a step failed."""
+        failed = [s for s in self.steps if s['state'] == 'failed']
+        if failed:
+            raise Exception('{} of {} steps failed, first: {}: {}'.format(
+                len(failed), len(self.steps), failed[0]['step'], failed[0]['error']))
+
+
+class KeySync(object):
+    """Syncs the keys of many models, each over its own API connection.
+    progress(steps) is called every time a model changes state."""
+    def __init__(self, username, password, models, removed=(), progress=None):
+        self.username = username
+        self.password = password
+        self.models = models
+        self.removed = removed
+        self.progress = Progress(['model {}:{}'.format(c, m) for c, m in models], progress)
+
+    async def run(self):
+        slots = asyncio.Semaphore(CONCURRENCY)
+        controllers = {c: datastore.get_controller(c) for c in {c for c, _ in self.models}}
+        if self.models:
+            await asyncio.wait([self.run_model(index, controllers[c], m, slots)
+                                for index, (c, m) in enumerate(self.models)])
+        self.progress.check()
+
+    async def run_model(self, index, con, m_name, slots):
+        mod = datastore.get_model(con['name'], m_name) if con is not None else None
+        if mod is None or not mod['uuid']:
+            return self.progress.update(index, 'failed', 'The model is not ready')
+        async with slots:
+            self.progress.update(index, 'running')
+            connection = None
+            try:
+                connection = await connect_model(con, mod, self.username, self.password)
+                desired = datastore.get_model_ssh_keys(con['name'], m_name)
+                await sync_model(connection, self.username, desired, self.removed)
+                self.progress.update(index, 'done')
+            except JujuAPIError as e:
+                self.progress.update(index, 'failed', e.message)
+            except Exception as e:  #pylint: disable=W0703
+                self.progress.update(index, 'failed', str(e) or type(e).__name__)
+            finally:
+                if connection is not None:
+                    await connection.close()
@@ -0,0 +1,244 @@
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,e0401
+import asyncio
+from itertools import count
+import json
+import time
+from sojobo_api import settings
+from sojobo_api.api.w_index import ModelIndex
+from sojobo_api.api.w_pool import POOL
+################################################################################
+# MODEL MIRROR
+################################################################################
+# Entities of the AllWatcher that are passed on to clients.
+ENTITIES = ['application', 'unit', 'machine', 'relation']
+# Seconds between keepalive comments on an idle stream.
+KEEPALIVE = 15
+# Deltas buffered per subscriber. A client that falls this far behind is
+# disconnected and has to reconnect, which gives it a fresh snapshot.
+QUEUE_SIZE = 1000
+# Seconds a write waits for the mirror to show it before it is answered.
+WRITE_WAIT = 10
+MIRRORS = {}
+SERIALS = count()
+# Closes idle mirrors every mirror-idle-timeout seconds while there are any,
+# also when the process gets no reads anymore.
+SWEEPER = None
+
+
+STATS = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+class ModelMirror(object):
+    """Keeps the state of one model in memory, shared by all readers and
+    all clients watching it. libjuju runs the AllWatcher for every connected
+    Model, so the mirror pins one admin connection from the pool, reads its
+    state and copies each delta into the queue of every subscriber."""
+    def __init__(self, endpoint, uuid, cacert):
+        self.key = (endpoint, uuid)
+        self.cacert = cacert
+        self.model = None
+        self.subscribers = set()
+        self.updated = None
+        self.serial = next(SERIALS)
+        self.version = 0
+        self.indexed = None
+        self.changed = asyncio.Event()
+        self.last_used = time.time()
+        self.started = asyncio.ensure_future(self.start())
+
+    async def start(self):
+        self.model = await POOL.acquire_model(self.key[0], self.key[1], settings.JUJU_ADMIN_USER,
+                                              settings.JUJU_ADMIN_PASSWORD, self.cacert)
+        self.model.add_observer(self.on_delta)
+        self.updated = time.time()
+
+    def is_healthy(self):
+        conn = self.model.connection
+        return conn is not None and conn.is_open
+
+    def is_idle(self, timeout):
+        return not self.subscribers and time.time() - self.last_used > timeout
+
+    def state(self):
+        """The latest data of every entity that still exists, per entity type."""
+        result = {}
+        for entity, entries in self.model.state.state.items():
+            result[entity] = {key: history[-1] for key, history in entries.items()
+                              if history and history[-1] is not None}
+        return result
+
+    def index(self):
+        """A ModelIndex of the current state, rebuilt only after a delta."""
+        if self.indexed is None or self.indexed[0] != self.version:
+            self.indexed = (self.version, ModelIndex(self.state()))
+        return self.indexed[1]
+
+    async def wait_for(self, check, timeout):
+        """Waits until check(index) is true, a write made over another
+        connection reaches the mirror as a delta some time after it returned.
+        Returns whether it is true within timeout seconds."""
+        deadline = time.time() + timeout
+        while not check(self.index()):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            self.changed.clear()
+            try:
+                await asyncio.wait_for(self.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return check(self.index())
+        return True
+
+    def snapshot(self):
+        state = self.state()
+        return [{'entity': entity, 'type': 'change', 'data': data}
+                for entity in ENTITIES for data in state.get(entity, {}).values()]
+
+    def subscribe(self):
+        events = self.snapshot()
+        queue = asyncio.Queue(maxsize=len(events) + QUEUE_SIZE)
+        for event in events:
+            queue.put_nowait(event)
+        self.subscribers.add(queue)
+        return queue
+
+    async def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+        self.last_used = time.time()
+
+    async def on_delta(self, delta, old, new, model):  #pylint: disable=W0613
+        self.updated = time.time()
+        self.version += 1
+        self.changed.set()
+        if delta.entity not in ENTITIES:
+            return
+        event = {'entity': delta.entity, 'type': delta.type, 'data': delta.data}
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.drop(queue)
+
+    def drop(self, queue):
+        self.subscribers.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    async def close(self):
+        if MIRRORS.get(self.key) is self:
+            del MIRRORS[self.key]
+        for queue in list(self.subscribers):
+            self.drop(queue)
+        if self.model is not None:
+            # The pooled model outlives the mirror, libjuju 0.6 has no public
+            # way to remove an observer.
+            for observer, callback in list(self.model._observers.items()):  #pylint: disable=W0212
+                if callback == self.on_delta:
+                    del self.model._observers[observer]  #pylint: disable=W0212
+            await POOL.release(self.model)
+            self.model = None
+
+
+async def get_mirror(endpoint, uuid, cacert):
+    await evict_idle()
+    key = (endpoint, uuid)
+    if key in MIRRORS:
+        STATS['hits'] += 1
+    else:
+        STATS['misses'] += 1
+        MIRRORS[key] = ModelMirror(endpoint, uuid, cacert)
+        start_sweeper()
+    mirror = MIRRORS[key]
+    try:
+        await asyncio.shield(mirror.started)
+    except Exception:
+        if MIRRORS.get(key) is mirror:
+            del MIRRORS[key]
+        raise
+    if mirror.model is None:
+        # The mirror was closed while this caller was waiting for the start.
+        return await get_mirror(endpoint, uuid, cacert)
+    if not mirror.is_healthy():
+        await mirror.close()
+        return await get_mirror(endpoint, uuid, cacert)
+    mirror.last_used = time.time()
+    return mirror
+
+
+def get_version(uuid):
+    """Changes whenever the mirrored state of the model changes, or None when
+    the model is not mirrored."""
+    for mirror in list(MIRRORS.values()):
+        if mirror.key[1] == uuid:
+            return mirror.serial, mirror.version
+    return None
+
+
+async def subscribe(endpoint, uuid, cacert):
+    mirror = await get_mirror(endpoint, uuid, cacert)
+    return mirror, mirror.subscribe()
+
+
+def start_sweeper():
+    global SWEEPER  #pylint: disable=W0603
+    if SWEEPER is None or SWEEPER.done():
+        SWEEPER = asyncio.ensure_future(sweep())
+
+
+async def sweep():
+    while MIRRORS:
+        await asyncio.sleep(int(settings.MIRROR_IDLE_TIMEOUT))
+        await evict_idle()
+
+
+async def evict_idle():
+    for mirror in list(MIRRORS.values()):
+        if mirror.started.done() and mirror.is_idle(int(settings.MIRROR_IDLE_TIMEOUT)):
+            await mirror.close()
+            STATS['evictions'] += 1
+
+
+async def close_mirrors(endpoint=None, uuid=None):
+    if endpoint is None and uuid is None and SWEEPER is not None:
+        SWEEPER.cancel()
+    for mirror in list(MIRRORS.values()):
+        if (endpoint is None or mirror.key[0] == endpoint) and (uuid is None or mirror.key[1] == uuid):
+            await mirror.close()
+
+
+async def next_message(mirror, queue):
+    """Returns the next server-sent event for a subscriber, a keepalive
+    comment when nothing happened, or None when the stream has ended."""
+    try:
+        event = await asyncio.wait_for(queue.get(), KEEPALIVE)
+    except asyncio.TimeoutError:
+        if mirror.model is None or not mirror.is_healthy():
+            await mirror.close()
+            return None
+        return ': keepalive\n\n'
+    if event is None:
+        return None
+    return 'event: {}\ndata: {}\n\n'.format(event['entity'], json.dumps(event))
+
+
+def stats():
+    return {'size': len(MIRRORS),
+            'subscribers': sum(len(m.subscribers) for m in MIRRORS.values()),
+            'hits': STATS['hits'],
+            'misses': STATS['misses'],
+            'evictions': STATS['evictions']}
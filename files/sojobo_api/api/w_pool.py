@@ -0,0 +1,173 @@
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,r0902,r0913,e0401
+import asyncio
+from collections import OrderedDict
+from hashlib import sha256
+import os
+import time
+from juju.controller import Controller
+from juju.model import Model
+from sojobo_api import settings
+################################################################################
+# CONNECTION POOL
+################################################################################
+SALT = os.urandom(16)
+
+
+def hash_password(password):
+    return sha256(SALT + password.encode('utf-8')).hexdigest()
+
+
+class PoolEntry(object):
+    def __init__(self, key, connection, secret, pooled=True):
+        self.key = key
+        self.connection = connection
+        self.secret = secret
+        self.pooled = pooled
+        self.in_use = 0
+        self.last_used = time.time()
+
+    def is_healthy(self):
+        conn = self.connection.connection
+        return conn is not None and conn.is_open
+
+    def is_idle(self, timeout):
+        return self.in_use == 0 and time.time() - self.last_used > timeout
+
+
+class ConnectionPool(object):
+    """Keeps authenticated libjuju Controller and Model objects alive between
+    requests. Entries are keyed by (endpoint, model uuid, user); the password is
+    only kept as a salted hash to check that a caller may reuse an entry. Idle
+    entries are closed by a sweep that runs every idle_timeout seconds while
+    the pool has entries."""
+    def __init__(self, max_size, idle_timeout):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.entries = OrderedDict()
+        self.in_use = {}
+        self.locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.sweeper = None
+
+    async def acquire_controller(self, endpoint, username, password, cacert):
+        async def factory():
+            controller = Controller()
+            await controller.connect(endpoint, username, password, cacert)
+            return controller
+        return await self.acquire((endpoint, None, username), password, factory)
+
+    async def acquire_model(self, endpoint, uuid, username, password, cacert):
+        async def factory():
+            model = Model()
+            await model.connect(endpoint, uuid, username, password, cacert)
+            return model
+        return await self.acquire((endpoint, uuid, username), password, factory)
+
+    async def acquire(self, key, password, factory):
+        await self.evict_idle()
+        secret = hash_password(password)
+        if key not in self.locks:
+            self.locks[key] = asyncio.Lock()
+        async with self.locks[key]:
+            entry = self.entries.get(key)
+            if entry is not None and entry.secret == secret and entry.is_healthy():
+                self.hits += 1
+                self.entries.move_to_end(key)
+            else:
+                self.misses += 1
+                if entry is not None and entry.in_use == 0:
+                    await self.remove(entry)
+                    entry = None
+                connection = await factory()
+                pooled = entry is None and await self.make_room()
+                entry = PoolEntry(key, connection, secret, pooled)
+                if pooled:
+                    self.entries[key] = entry
+        entry.in_use += 1
+        self.in_use[id(entry.connection)] = entry
+        if self.sweeper is None or self.sweeper.done():
+            self.sweeper = asyncio.ensure_future(self.sweep())
+        return entry.connection
+
+    async def release(self, connection):
+        entry = self.in_use.get(id(connection))
+        if entry is None:
+            return
+        entry.in_use -= 1
+        entry.last_used = time.time()
+        if entry.in_use == 0:
+            del self.in_use[id(connection)]
+            if not entry.pooled or not entry.is_healthy():
+                await self.remove(entry)
+
+    async def make_room(self):
+        while len(self.entries) >= self.max_size:
+            idle = [e for e in self.entries.values() if e.in_use == 0]
+            if not idle:
+                return False
+            await self.remove(idle[0])
+            self.evictions += 1
+        return True
+
+    async def sweep(self):
+        while self.entries or self.in_use:
+            await asyncio.sleep(self.idle_timeout)
+            await self.evict_idle()
+
+    async def evict_idle(self):
+        for entry in [e for e in self.entries.values() if e.is_idle(self.idle_timeout)]:
+            await self.remove(entry)
+            self.evictions += 1
+
+    async def remove(self, entry):
+        if self.entries.get(entry.key) is entry:
+            del self.entries[entry.key]
+        try:
+            await entry.connection.disconnect()
+        except Exception:  #pylint: disable=W0703
+            pass
+
+    async def discard(self, endpoint=None, uuid=None, username=None):
+        """Closes the matching entries. One that is checked out is taken out of
+        the pool right away and closed when its last user releases it."""
+        for entry in list(self.entries.values()):
+            if (endpoint is None or entry.key[0] == endpoint) and (uuid is None or entry.key[1] == uuid) \
+                    and (username is None or entry.key[2] == username):
+                if entry.in_use:
+                    del self.entries[entry.key]
+                    entry.pooled = False
+                else:
+                    await self.remove(entry)
+
+    async def close_all(self):
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+        for entry in list(self.entries.values()):
+            await self.remove(entry)
+
+    def stats(self):
+        return {'size': len(self.entries),
+                'max-size': self.max_size,
+                'in-use': len(self.in_use),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+
+POOL = ConnectionPool(int(settings.JUJU_POOL_SIZE), int(settings.JUJU_POOL_IDLE_TIMEOUT))
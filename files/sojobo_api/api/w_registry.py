@@ -0,0 +1,109 @@
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,r0903
+from importlib import import_module, reload as reload_module
+import logging
+import os
+import sys
+from threading import Lock
+import time
+from sojobo_api import settings
+################################################################################
+# CONTROLLER TYPES
+################################################################################
+# The controller modules in controllers/ are imported once per process. Every
+# CHECK_INTERVAL seconds at most, the registry looks at the names and times of
+# the modules and imports them again when a plugin was added, upgraded or
+# removed, so every api process and the worker pick up plugin changes without
+# a restart. An unknown type is not looked for before that, and a module that
+# can not be loaded is logged and left out instead of breaking all others.
+# reload() imports every module right away, the worker runs it on SIGHUP.
+CHECK_INTERVAL = 10
+TYPES = {}
+STATE = {'signature': None, 'checked': 0}
+LOCK = Lock()
+logger = logging.getLogger(__name__)
+
+
+class ControllerType(object):
+    """What a controller module offers: its Token class, the series it can
+    deploy and the functions to bootstrap a controller and build credentials."""
+    def __init__(self, name, module):
+        self.name = name
+        self.module = module
+        self.token = module.Token
+        self.supported_series = list(module.get_supported_series())
+        self.create_controller = module.create_controller
+        self.generate_cred_file = getattr(module, 'generate_cred_file', None)
+
+
+def module_files():
+    directory = '{}/controllers'.format(settings.SOJOBO_API_DIR)
+    for f_path in sorted(os.listdir(directory)):
+        if 'controller_' in f_path and f_path.endswith('.py'):
+            yield f_path, os.path.getmtime(os.path.join(directory, f_path))
+
+
+def discover(refresh=False):
+    with LOCK:
+        files = list(module_files())
+        found = set()
+        for f_path, _ in files:
+            name = f_path.split('.')[0]
+            c_type = name.split('_')[1]
+            if c_type in TYPES and not refresh:
+                found.add(c_type)
+                continue
+            path = 'sojobo_api.controllers.{}'.format(name)
+            try:
+                if path in sys.modules:
+                    module = reload_module(sys.modules[path])
+                else:
+                    module = import_module(path)
+                TYPES[c_type] = ControllerType(c_type, module)
+                found.add(c_type)
+            except Exception:  #pylint: disable=W0703
+                logger.exception('Could not load the controller plugin %s', name)
+        for c_type in set(TYPES) - found:
+            del TYPES[c_type]
+        STATE['signature'] = files
+        STATE['checked'] = time.time()
+    return TYPES
+
+
+def get_types():
+    if time.time() - STATE['checked'] > CHECK_INTERVAL:
+        if list(module_files()) != STATE['signature']:
+            return discover(refresh=STATE['signature'] is not None)
+        STATE['checked'] = time.time()
+    return TYPES
+
+
+def get_type(c_type):
+    """The ControllerType of c_type, or None when no module provides it."""
+    return get_types().get(c_type)
+
+
+def require(c_type):
+    """The ControllerType of c_type, a KeyError when no module provides it,
+    like any other unknown input."""
+    controller_type = get_type(c_type)
+    if controller_type is None:
+        raise KeyError(c_type)
+    return controller_type
+
+
+def reload():
+    return discover(refresh=True)
@@ -18,6 +18,7 @@ import logging
 import os
 from flask import Flask, redirect, request, abort
 from sojobo_api import settings
+from sojobo_api.api import w_registry
 from sojobo_api.api.w_juju import create_response
 from sojobo_api.api.w_errors import invalid_data, unauthorized
 ########################################################################################################################
@@ -39,7 +40,7 @@ def index():
     try:
         if request.headers['api-key'] == settings.API_KEY:
             code, response = 200, {'version': "1.0.0",  # see http://semver.org/
-                                   'used_apis': get_apis(),
+                                   'used_apis': APIS,
                                    'controllers': get_controllers()}
         else:
             error = unauthorized()
@@ -64,13 +65,11 @@ def get_apis():
 
 
 def get_controllers():
-    c_list = []
-    for f_path in os.listdir('{}/controllers'.format(APP.config['SOJOBO_API_DIR'])):
-        if 'controller_' in f_path and '.pyc' not in f_path:
-            c_list.append(f_path.split('.')[0])
-    return c_list
+    return [c_type.module.__name__.split('.')[-1] for c_type in w_registry.get_types().values()]
 
 
-for api in get_apis():
+# The blueprints are registered once, so the list of apis does not change.
+APIS = get_apis()
+for api in APIS:
     module = import_module('sojobo_api.api.{}'.format(api))
     APP.register_blueprint(getattr(module, 'get')(), url_prefix='/{}'.format(api.split('_')[1]))
@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302, R0914
 import asyncio
+from functools import partial
 import json
 import logging
 import os
@@ -23,9 +24,11 @@ from subprocess import check_output
 import traceback
 import sys
 import yaml
+from juju import tag
 sys.path.append('/opt')
 from sojobo_api import settings  #pylint: disable=C0413
-from sojobo_api.api import w_datastore as datastore, w_juju as juju  #pylint: disable=C0413
+from sojobo_api.api import w_datastore as datastore, w_juju as juju, w_registry  #pylint: disable=C0413
+logger = logging.getLogger('add-controller')
 
 
 class JuJu_Token(object):  #pylint: disable=R0903
@@ -40,12 +43,16 @@ async def create_controller(c_type, name, region, credentials):
         logger.info('Adding controller to database')
         datastore.create_controller(name, c_type, region)
         datastore.add_user_to_controller(name, 'admin', 'superuser')
+        # Bootstrapping blocks for minutes, keep it off the loop so other jobs
+        # of the worker keep running.
+        loop = asyncio.get_event_loop()
         logger.info('Bootstrapping controller')
-        juju.get_controller_types()[c_type].create_controller(name, region, credentials)
+        await loop.run_in_executor(None, w_registry.require(c_type).create_controller,
+                                   name, region, credentials)
         pswd = settings.JUJU_ADMIN_PASSWORD
         logger.info('Setting admin password')
-        check_output(['juju', 'change-user-password', 'admin', '-c', name],
-                     input=bytes('{}\n{}\n'.format(pswd, pswd), 'utf-8'))
+        await loop.run_in_executor(None, partial(check_output, ['juju', 'change-user-password', 'admin', '-c', name],
+                                                 input=bytes('{}\n{}\n'.format(pswd, pswd), 'utf-8')))
         logger.info('Updating controller in database')
         with open(os.path.join(str(Path.home()), '.local', 'share', 'juju', 'controllers.yaml'), 'r') as data:
             con_data = yaml.load(data)
@@ -66,7 +73,7 @@ async def create_controller(c_type, name, region, credentials):
             models = await juju_con.get_models()
             for model in models.serialize()['user-models']:
                 model = model.serialize()['model'].serialize()
-                datastore.add_model_to_controller(name, model['name'])
+                datastore.add_model_to_controller(name, model['name'], tag.untag('user-', model['owner-tag']))
                 datastore.set_model_state(name, model['name'], 'ready', model['uuid'])
                 datastore.set_model_access(name, model['name'], token.username, 'admin')
     except Exception:  #pylint: disable=W0703
@@ -75,17 +82,4 @@ async def create_controller(c_type, name, region, credentials):
         for l in lines:
             logger.error(l)
         datastore.set_controller_state(name, 'error')
-
-
-if __name__ == '__main__':
-    logger = logging.getLogger('add-controller')
-    hdlr = logging.FileHandler('{}/log/add_controller.log'.format(settings.SOJOBO_API_DIR))
-    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-    hdlr.setFormatter(formatter)
-    logger.addHandler(hdlr)
-    logger.setLevel(logging.INFO)
-    loop = asyncio.get_event_loop()
-    loop.set_debug(False)
-    loop.run_until_complete(create_controller(sys.argv[1], sys.argv[2],
-                                              sys.argv[3], json.loads(sys.argv[4])))
-    loop.close()
+        raise
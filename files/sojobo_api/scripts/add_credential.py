@@ -14,44 +14,24 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302, R0914
-import asyncio
 import sys
 import traceback
 import logging
 import ast
-import json
-import redis
+sys.path.append('/opt')
+from sojobo_api.api import w_datastore as datastore  #pylint: disable=C0413
+logger = logging.getLogger('add_credentials')
 
 
-async def add_credential(username, credential, url, port):
+async def add_credential(username, credential):
     try:
         creds = ast.literal_eval(credential)
-        logger.info('Setting up connection with Redis')
-        users = redis.StrictRedis(host=url, port=port, charset="utf-8", decode_responses=True, db=11)
-        user = json.loads(users.get(username))
-        if creds not in user['credentials']:
-            user['credentials'].append(creds)
-        users.set(username, json.dumps(user))
+        logger.info('Adding credential to the datastore')
+        datastore.add_credential(username, creds)
         logger.info('Succesfully added credential for %s', username)
     except Exception as e:
         exc_type, exc_value, exc_traceback = sys.exc_info()
         lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
         for l in lines:
             logger.error(l)
-
-
-if __name__ == '__main__':
-    logging.basicConfig(level=logging.DEBUG)
-    ws_logger = logging.getLogger('websockets.protocol')
-    logger = logging.getLogger('add_credentials')
-    hdlr = logging.FileHandler('{}/log/add_credentials.log'.format(sys.argv[2]))
-    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-    hdlr.setFormatter(formatter)
-    ws_logger.addHandler(hdlr)
-    ws_logger.setLevel(logging.DEBUG)
-    logger.addHandler(hdlr)
-    logger.setLevel(logging.DEBUG)
-    loop = asyncio.get_event_loop()
-    loop.set_debug(True)
-    loop.run_until_complete(add_credential(sys.argv[1], sys.argv[3], sys.argv[4], sys.argv[5]))
-    loop.close()
+        raise
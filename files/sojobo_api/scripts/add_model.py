@@ -14,62 +14,33 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302, R0914
-import asyncio
 import sys
 import traceback
 import logging
-import json
-import redis
 from juju import tag
 from juju.controller import Controller
 from juju.client import client
-from juju.errors import JujuAPIError, JujuError
-################################################################################
-# Datastore Functions
-################################################################################
-def set_model_access(c_name, m_name, user, connection, access):
-    user_data = connection.get(user)
-    result = json.loads(user_data)
-    for con in result['controllers']:
-        if con['name'] == c_name:
-            for mod in con['models']:
-                if mod['name'] == m_name:
-                    mod['access'] = access
-                    break
-            break
-    connection.set(user, json.dumps(result))
-
-
-def set_model_state(c_name, m_name, state, connection, uuid=None):
-    con = json.loads(connection.get(c_name))
-    for mod in con['models']:
-        if mod['name'] == m_name:
-            mod['status'] = state
-            if uuid:
-                mod['uuid'] = uuid
-            break
-    connection.set(c_name, json.dumps(con))
+sys.path.append('/opt')
+from sojobo_api.api import w_datastore as datastore, w_keys  #pylint: disable=C0413
+logger = logging.getLogger('add-model')
 ################################################################################
 # Async Functions
 ################################################################################
-async def create_model(c_name, m_name, usr, pwd, url, port, cred_name):
+async def create_model(c_name, m_name, usr, pwd, cred_name):
     try:
         logger.info('%s -> Setting up Controllerconnection for %s', m_name, c_name)
-        users = redis.StrictRedis(host=url, port=port, charset="utf-8", decode_responses=True, db=11)
-        controllers = redis.StrictRedis(host=url, port=port, charset="utf-8", decode_responses=True, db=10)
+        con = datastore.get_controller(c_name)
         controller = Controller()
-        await controller.connect(json.loads(controllers.get(c_name))['endpoints'][0], usr, pwd)
-        c_type = json.loads(controllers.get(c_name))['type']
+        await controller.connect(con['endpoints'][0], usr, pwd)
+        c_type = con['type']
         logger.info('%s -> Adding credentials', m_name)
         cloud_facade = client.CloudFacade.from_connection(controller.connection)
-        for cred in json.loads(users.get(usr))['credentials']:
-            if cred['name'] == cred_name:
-                credential = cred
-                cloud_cred = client.UpdateCloudCredential(
-                    client.CloudCredential(cred['key'], cred['type']),
-                    tag.credential(c_type, usr, cred['name'])
-                )
-                await cloud_facade.UpdateCredentials([cloud_cred])
+        credential = datastore.get_credential(usr, cred_name)
+        cloud_cred = client.UpdateCloudCredential(
+            client.CloudCredential(credential['key'], credential['type']),
+            tag.credential(c_type, usr, credential['name'])
+        )
+        await cloud_facade.UpdateCredentials([cloud_cred])
         logger.info('%s -> Creating model: %s', m_name, m_name)
 
         model = await controller.add_model(
@@ -80,23 +51,17 @@ async def create_model(c_name, m_name, usr, pwd, url, port, cred_name):
         )
 
         logger.info('%s -> model deployed on juju', m_name)
-        set_model_access(c_name, m_name, usr, users, 'admin')
-        set_model_state(c_name, m_name, 'ready', controllers, model.info.uuid)
-        logger.info('%s -> Adding ssh-keys to model: %s', m_name, m_name)
-        for key in json.loads(users.get(usr))['ssh-keys']:
-            try:
-                await model.add_ssh_key(usr, key)
-            except (JujuAPIError, JujuError):
-                pass
-        for u in json.loads(controllers.get(c_name))['users']:
+        datastore.set_model_access(c_name, m_name, usr, 'admin')
+        datastore.set_model_state(c_name, m_name, 'ready', model.info.uuid)
+        for u in con['users']:
             if u['access'] == 'superuser':
                 await model.grant(u['name'], acl='admin')
-                set_model_access(c_name, m_name, u['name'], users, 'admin')
-                for key in json.loads(users.get(u['name']))['ssh-keys']:
-                    try:
-                        await model.add_ssh_key(u['name'], key)
-                    except (JujuAPIError, JujuError):
-                        pass
+                datastore.set_model_access(c_name, m_name, u['name'], 'admin')
+        logger.info('%s -> Adding ssh-keys to model: %s', m_name, m_name)
+        try:
+            await w_keys.sync_model(model.connection, usr, datastore.get_model_ssh_keys(c_name, m_name))
+        except Exception as e:  #pylint: disable=W0703
+            logger.error('%s -> Could not add the ssh-keys: %s', m_name, e)
         logger.info('%s -> succesfully deployed model', m_name)
     except Exception as e:
         exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -104,28 +69,12 @@ async def create_model(c_name, m_name, usr, pwd, url, port, cred_name):
         for l in lines:
             logger.error(l)
         if 'model' in locals():
-            set_model_state(c_name, m_name, 'ready', controllers, model.info.uuid)
+            datastore.set_model_state(c_name, m_name, 'ready', model.info.uuid)
         else:
-            set_model_state(c_name, m_name, 'error', controllers)
+            datastore.set_model_state(c_name, m_name, 'error')
+        raise
     finally:
         if 'model' in locals():
             await model.disconnect()
-        await controller.disconnect()
-
-
-if __name__ == '__main__':
-    logging.basicConfig(level=logging.DEBUG)
-    logger = logging.getLogger('add-model')
-    ws_logger = logging.getLogger('websockets.protocol')
-    hdlr = logging.FileHandler('{}/log/add_model.log'.format(sys.argv[3]))
-    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-    hdlr.setFormatter(formatter)
-    logger.addHandler(hdlr)
-    ws_logger.addHandler(hdlr)
-    ws_logger.setLevel(logging.DEBUG)
-    logger.setLevel(logging.DEBUG)
-    loop = asyncio.get_event_loop()
-    loop.set_debug(True)
-    loop.run_until_complete(create_model(sys.argv[6], sys.argv[7], sys.argv[1],
-                                         sys.argv[2], sys.argv[4], sys.argv[5], sys.argv[8]))
-    loop.close()
+        if 'controller' in locals():
+            await controller.disconnect()
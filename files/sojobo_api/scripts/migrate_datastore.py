@@ -0,0 +1,116 @@
+# !/usr/bin/env python3
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302, R0914
+import json
+import logging
+import sys
+sys.path.append('/opt')
+from sojobo_api import settings  #pylint: disable=C0413
+from sojobo_api.api import w_datastore as datastore  #pylint: disable=C0413
+################################################################################
+# Migration of the JSON document per key layout to hashes and sets
+################################################################################
+# The old layout stored every controller (db 10) and every user (db 11) as one
+# JSON string under its own name. Every string key that is still present is
+# converted and removed, so running this more than once is harmless. Strings
+# that are not such a document, like a counter, are left alone.
+def old_documents(con):
+    for key in con.keys():
+        if con.type(key) == 'string':
+            try:
+                data = json.loads(con.get(key))
+            except ValueError:
+                continue
+            if isinstance(data, dict) and 'name' in data:
+                yield key, data
+
+
+def migrate_controllers():
+    con = datastore.connect_to_controllers()
+    count = 0
+    for key, data in old_documents(con):
+        name = data['name']
+        pipe = con.pipeline()
+        pipe.delete(key)
+        pipe.sadd('controllers', name)
+        pipe.hmset(datastore.controller_key(name), {
+            'name': name,
+            'state': data['state'],
+            'type': data['type'],
+            'endpoints': json.dumps(data['endpoints']),
+            'uuid': data['uuid'],
+            'ca-cert': data['ca-cert'],
+            'region': data['region']
+        })
+        for user in data['users']:
+            pipe.hset(datastore.controller_key(name, 'users'), user['name'], user['access'])
+        for model in data['models']:
+            pipe.sadd(datastore.controller_key(name, 'models'), model['name'])
+            pipe.hmset(datastore.model_key(name, model['name']), {
+                'name': model['name'],
+                'status': model['status'],
+                'uuid': model['uuid']
+            })
+        pipe.execute()
+        count += 1
+    return count
+
+
+def migrate_users():
+    con = datastore.connect_to_users()
+    count = 0
+    for key, data in old_documents(con):
+        name = data['name']
+        pipe = con.pipeline()
+        pipe.delete(key)
+        pipe.sadd('users', name)
+        pipe.hmset(datastore.user_key(name), {'name': name, 'active': 1 if data['active'] else 0})
+        for ssh_key in data['ssh-keys']:
+            pipe.sadd(datastore.user_key(name, 'ssh-keys'), ssh_key)
+        for cred in data['credentials']:
+            pipe.hset(datastore.user_key(name, 'credentials'), cred['name'], json.dumps(cred))
+        for controller in data['controllers']:
+            pipe.hset(datastore.user_key(name, 'controllers'), controller['name'], controller['access'])
+            for model in controller.get('models', []):
+                pipe.hset(datastore.user_models_key(name, controller['name']), model['name'], model['access'])
+                pipe.hset(datastore.model_users_key(controller['name'], model['name']), name, model['access'])
+        pipe.execute()
+        count += 1
+    return count
+
+
+def build_model_index():
+    con = datastore.connect_to_users()
+    count = 0
+    for key in con.scan_iter(match='user:*:models:*'):
+        _, user, _, c_name = key.split(':', 3)
+        pipe = con.pipeline()
+        for m_name, access in con.hgetall(key).items():
+            pipe.hset(datastore.model_users_key(c_name, m_name), user, access)
+            count += 1
+        pipe.execute()
+    return count
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger('migrate_datastore')
+    hdlr = logging.FileHandler('{}/log/migrate_datastore.log'.format(settings.SOJOBO_API_DIR))
+    hdlr.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    logger.addHandler(hdlr)
+    logger.info('Migrated %s controllers', migrate_controllers())
+    logger.info('Migrated %s users', migrate_users())
+    logger.info('Indexed %s model access entries', build_model_index())
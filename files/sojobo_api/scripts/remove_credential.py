@@ -14,44 +14,22 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302, R0914
-import asyncio
 import sys
 import traceback
 import logging
-import json
-import redis
+sys.path.append('/opt')
+from sojobo_api.api import w_datastore as datastore  #pylint: disable=C0413
+logger = logging.getLogger('add_credentials')
 
 
-async def remove_credential(username, cred_name, url, port):
+async def remove_credential(username, cred_name):
     try:
-        logger.info('Setting up connection with Redis')
-        db = redis.StrictRedis(host=url, port=port, charset="utf-8", decode_responses=True, db=11)
-        usr = json.loads(db.get(username))
-        for cred in usr['credentials']:
-            if cred['name'] == cred_name:
-                usr['credentials'].remove(cred)
-                db.set(username, json.dumps(usr))
-                break
+        logger.info('Removing credential from the datastore')
+        datastore.remove_credential(username, cred_name)
         logger.info('Succesfully removed credential for %s', username)
     except Exception as e:
         exc_type, exc_value, exc_traceback = sys.exc_info()
         lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
         for l in lines:
             logger.error(l)
-
-
-if __name__ == '__main__':
-    logging.basicConfig(level=logging.DEBUG)
-    ws_logger = logging.getLogger('websockets.protocol')
-    logger = logging.getLogger('add_credentials')
-    hdlr = logging.FileHandler('{}/log/add_credentials.log'.format(sys.argv[2]))
-    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-    hdlr.setFormatter(formatter)
-    ws_logger.addHandler(hdlr)
-    ws_logger.setLevel(logging.DEBUG)
-    logger.addHandler(hdlr)
-    logger.setLevel(logging.INFO)
-    loop = asyncio.get_event_loop()
-    loop.set_debug(True)
-    loop.run_until_complete(remove_credential(sys.argv[1], sys.argv[3], sys.argv[4], sys.argv[5]))
-    loop.close()
+        raise
@@ -14,19 +14,18 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302, R0914
-import asyncio
 import sys
 import traceback
 import logging
-import json
-import redis
 from juju.model import Model
+sys.path.append('/opt')
+from sojobo_api.api import w_datastore as datastore  #pylint: disable=C0413
+logger = logging.getLogger('remove-machine')
 
 
-async def remove_machine(c_name, m_name, usr, pwd, url, port, machine):
+async def remove_machine(c_name, m_name, usr, pwd, machine):
     try:
-        controllers = redis.StrictRedis(host=url, port=port, charset="utf-8", decode_responses=True, db=10)
-        controller = json.loads(controllers.get(c_name))
+        controller = datastore.get_controller(c_name)
         model = Model()
         logger.info('Setting up Model connection for %s:%s', c_name, m_name)
         for mod in controller['models']:
@@ -42,24 +41,7 @@ async def remove_machine(c_name, m_name, usr, pwd, url, port, machine):
         lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
         for l in lines:
             logger.error(l)
+        raise
     finally:
         if 'model' in locals():
             await model.disconnect()
-
-
-if __name__ == '__main__':
-    logging.basicConfig(level=logging.DEBUG)
-    ws_logger = logging.getLogger('websockets.protocol')
-    logger = logging.getLogger('remove-machine')
-    hdlr = logging.FileHandler('{}/log/remove_machine.log'.format(sys.argv[3]))
-    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-    hdlr.setFormatter(formatter)
-    ws_logger.addHandler(hdlr)
-    ws_logger.setLevel(logging.DEBUG)
-    logger.addHandler(hdlr)
-    logger.setLevel(logging.INFO)
-    loop = asyncio.get_event_loop()
-    loop.set_debug(True)
-    loop.run_until_complete(remove_machine(sys.argv[6], sys.argv[7], sys.argv[1],
-                                         sys.argv[2], sys.argv[4], sys.argv[5], sys.argv[8]))
-    loop.close()
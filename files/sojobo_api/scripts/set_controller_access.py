@@ -15,72 +15,118 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302, R0914
 import asyncio
+from functools import partial
 import sys
 import traceback
 import logging
-import json
-import redis
-from juju.model import Model
+from juju import tag
+from juju.client import client
+from juju.errors import JujuAPIError
 from juju.controller import Controller
+sys.path.append('/opt')
+from sojobo_api.api import w_datastore as datastore, w_keys  #pylint: disable=C0413
+logger = logging.getLogger('set_controller_access')
+# Number of models whose ssh keys are synced at the same time.
+MODEL_CONCURRENCY = 10
+################################################################################
+# Async Functions
+################################################################################
+# A superuser is made admin of all models with one call over the controller
+# connection. Only the ssh keys need a connection to each model, a bare API
+# connection. Every model has its own entry in the progress of the job.
+# Granting access the user already has is not an error, so a retry of the
+# failed models can run the same steps again.
+def already_granted(error):
+    return 'already has' in error.message or 'already exists' in error.message
 
 
-async def set_controller_acc(c_name, access, user, username, password, url, port):
+async def grant_models(controller, mods, user):
+    """The error of the grant of every model, None when it was granted."""
+    facade = client.ModelManagerFacade.from_connection(controller.connection)
+    changes = [client.ModifyModelAccess('admin', 'grant', tag.model(m['uuid']), tag.user(user)) for m in mods]
+    results = await facade.ModifyModelAccess(changes)
+    return [r.error.message if r.error is not None and not already_granted(r.error) else None for r in results.results]
+
+
+async def sync_keys(con, mod, username, password):
+    connection = await w_keys.connect_model(con, mod, username, password)
+    try:
+        await w_keys.sync_model(connection, username, datastore.get_model_ssh_keys(con['name'], mod['name']))
+    finally:
+        await connection.close()
+
+
+async def run_model(con, mod, user, username, password, progress, index, slots):
+    async with slots:
+        progress.update(index, 'running')
+        try:
+            datastore.set_model_access(con['name'], mod['name'], user, 'admin')
+            await sync_keys(con, mod, username, password)
+            logger.info('Admin access granted for %s:%s', con['name'], mod['name'])
+            progress.update(index, 'done')
+        except JujuAPIError as e:
+            progress.update(index, 'failed', e.message)
+        except Exception as e:  #pylint: disable=W0703
+            logger.error('Could not grant access to %s:%s: %s', con['name'], mod['name'], e)
+            progress.update(index, 'failed', str(e) or type(e).__name__)
+
+
+async def set_models_acc(controller, con, mods, user, username, password, progress):
+    ready = [(i + 1, m) for i, m in enumerate(mods) if m['uuid']]
+    for i, m in enumerate(mods):
+        if not m['uuid']:
+            progress.update(i + 1, 'failed', 'The model is not ready yet')
+    if not ready:
+        return
+    try:
+        granted = await grant_models(controller, [m for _, m in ready], user)
+    except Exception as e:  #pylint: disable=W0703
+        granted = [getattr(e, 'message', str(e)) or type(e).__name__] * len(ready)
+    slots = asyncio.Semaphore(MODEL_CONCURRENCY)
+    tasks = []
+    for (index, mod), error in zip(ready, granted):
+        if error is not None:
+            progress.update(index, 'failed', error)
+        else:
+            tasks.append(run_model(con, mod, user, username, password, progress, index, slots))
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+async def set_controller_acc(c_name, access, user, username, password, models=None, job_id=None):
+    """Grants access to the controller and, for a superuser, admin access to
+    its models, or only to the given models on a retry."""
     try:
-        controllers = redis.StrictRedis(host=url, port=port, charset="utf-8", decode_responses=True, db=10)
-        users = redis.StrictRedis(host=url, port=port, charset="utf-8", decode_responses=True, db=11)
-        con = json.loads(controllers.get(c_name))
-        usr = json.loads(users.get(user))
+        con = datastore.get_controller(c_name)
+        mods = [] if access != 'superuser' else [m for m in con['models'] if models is None or m['name'] in models]
+        progress = w_keys.Progress(['controller'] + ['model {}'.format(m['name']) for m in mods],
+                                   None if job_id is None else partial(datastore.set_job_progress, job_id))
+        progress.update(0, 'running')
         logger.info('Connecting to controller %s', c_name)
         controller = Controller()
-        await controller.connect(con['endpoints'][0], username, password, con['ca-cert'])
-        logger.info('Connected to controller %s ', c_name)
-        await controller.grant(user, acl=access)
-        exists = False
-        for contr in usr['controllers']:
-            if contr['name'] == c_name:
-                contr['access'] = access
-                exists = True
-                break
-        if not exists:
-            usr['controllers'].append({'name': c_name, 'access': access})
+        try:
+            await controller.connect(con['endpoints'][0], username, password, con['ca-cert'])
+            logger.info('Connected to controller %s ', c_name)
+            try:
+                await controller.grant(user, acl=access)
+            except JujuAPIError as e:
+                if not already_granted(e):
+                    raise
+        except Exception as e:
+            progress.update(0, 'failed', getattr(e, 'message', str(e)) or type(e).__name__)
+            raise
+        datastore.add_user_to_controller(c_name, user, access)
         logger.info('Controller access set for  %s ', c_name)
-        if access == 'superuser':
-            model = Model()
-            models = []
-            for mod in con['models']:
-                logger.info('Setting up connection for model: %s', mod['name'])
-                await model.connect(con['endpoints'][0], mod['uuid'], username, password, con['ca-cert'])
-                await model.grant(user, acl='admin')
-                models.append({'name': mod['name'], 'access': 'admin'})
-                logger.info('Admin Access granted for for %s:%s', c_name, mod['name'])
-                for key in usr['ssh-keys']:
-                    await model.add_ssh_key(user, key)
-                model.disconnect()
-            for contro in usr['controllers']:
-                if contro['name'] == c_name:
-                    contro['models'] = models
-        users.set(user, json.dumps(usr))
-        controller.disconnect()
+        progress.update(0, 'done')
+        if mods:
+            await set_models_acc(controller, con, mods, user, username, password, progress)
+            progress.check()
     except Exception:
         exc_type, exc_value, exc_traceback = sys.exc_info()
         lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
         for l in lines:
             logger.error(l)
-
-
-if __name__ == '__main__':
-    logging.basicConfig(level=logging.DEBUG)
-    ws_logger = logging.getLogger('websockets.protocol')
-    logger = logging.getLogger('set_controller_access')
-    hdlr = logging.FileHandler('{}/log/set_controller_access.log'.format(sys.argv[3]))
-    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-    hdlr.setFormatter(formatter)
-    ws_logger.addHandler(hdlr)
-    ws_logger.setLevel(logging.DEBUG)
-    logger.addHandler(hdlr)
-    logger.setLevel(logging.INFO)
-    loop = asyncio.get_event_loop()
-    loop.set_debug(True)
-    result = loop.run_until_complete(set_controller_acc(sys.argv[8], sys.argv[7], sys.argv[6],
-                                                        sys.argv[1], sys.argv[2], sys.argv[4], sys.argv[5]))
-    loop.close()
+        raise
+    finally:
+        if 'controller' in locals():
+            await controller.disconnect()
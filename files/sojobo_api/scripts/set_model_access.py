@@ -14,73 +14,52 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # pylint: disable=c0111,c0301,c0325,c0103,r0913,r0902,e0401,C0302, R0914
-import asyncio
 import sys
 import traceback
 import logging
-import json
-import redis
-from juju.model import Model
+from juju import tag
+from juju.client import client
 from juju.controller import Controller
+sys.path.append('/opt')
+from sojobo_api.api import w_datastore as datastore, w_keys  #pylint: disable=C0413
+logger = logging.getLogger('set_model_access')
 
 
-async def set_model_acc(c_name, m_name, access, user, username, password, url, port):
+async def modify_model_access(controller, uuid, user, access):
+    """Sets the access of the user to the model over the controller connection,
+    the old access is revoked first like libjuju's Model.grant does."""
+    facade = client.ModelManagerFacade.from_connection(controller.connection)
+    await facade.ModifyModelAccess([client.ModifyModelAccess('read', 'revoke', tag.model(uuid), tag.user(user))])
+    results = await facade.ModifyModelAccess([client.ModifyModelAccess(access, 'grant', tag.model(uuid), tag.user(user))])
+    w_keys.check_results(results)
+
+
+async def set_model_acc(c_name, m_name, access, user, username, password):
     try:
-        controllers = redis.StrictRedis(host=url, port=port, charset="utf-8", decode_responses=True, db=10)
-        users = redis.StrictRedis(host=url, port=port, charset="utf-8", decode_responses=True, db=11)
-        controller = json.loads(controllers.get(c_name))
-        usr = json.loads(users.get(user))
-        for mod in controller['models']:
+        con = datastore.get_controller(c_name)
+        for mod in con['models']:
             if mod['name'] == m_name:
-                model = Model()
-                await model.connect(controller['endpoints'][0], mod['uuid'], username, password, controller['ca-cert'])
-                await model.grant(user, acl=access)
-                exists_con = False
-                for con in usr['controllers']:
-                    if con['name'] == c_name:
-                        exists_mod = False
-                        exists_con = True
-                        for mod in con['models']:
-                            if mod['name'] == m_name:
-                                mod['access'] = access
-                                exists_mod = True
-                                break
-                        if not exists_mod:
-                            con['models'].append({'name': m_name, 'access': access})
-                if not exists_con:
-                    usr['controllers'].append({'name': c_name, 'access': 'login', 'models': [{'name': m_name, 'access': access}]})
-                    contro = Controller()
-                    await contro.connect(controller['endpoints'][0], username, password, controller['ca-cert'])
-                    await contro.grant(user)
-                    await contro.disconnect()
+                controller = Controller()
+                await controller.connect(con['endpoints'][0], username, password, con['ca-cert'])
+                if datastore.get_controller_access(c_name, user) is None:
+                    datastore.add_user_to_controller(c_name, user, 'login')
+                    await controller.grant(user)
+                await modify_model_access(controller, mod['uuid'], user, access)
+                datastore.set_model_access(c_name, m_name, user, access)
                 logger.info('%s access granted on %s:%s for  %s', access, c_name, m_name, user)
-                if access == 'admin' or access == 'write':
-                    for key in usr['ssh-keys']:
-                        await model.add_ssh_key(user, key)
-                model.disconnect()
-        controllers.set(c_name, json.dumps(controller))
-        users.set(user, json.dumps(usr))
+                # The keys of a user that can no longer write are deleted.
+                connection = await w_keys.connect_model(con, mod, username, password)
+                try:
+                    await w_keys.sync_model(connection, username, datastore.get_model_ssh_keys(c_name, m_name),
+                                            removed=datastore.get_ssh_keys(user))
+                finally:
+                    await connection.close()
     except Exception:
         exc_type, exc_value, exc_traceback = sys.exc_info()
         lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
         for l in lines:
             logger.error(l)
-
-
-if __name__ == '__main__':
-    logging.basicConfig(level=logging.DEBUG)
-    ws_logger = logging.getLogger('websockets.protocol')
-    logger = logging.getLogger('set_model_access')
-    hdlr = logging.FileHandler('{}/log/set_model_access.log'.format(sys.argv[3]))
-    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-    hdlr.setFormatter(formatter)
-    ws_logger.addHandler(hdlr)
-    ws_logger.setLevel(logging.DEBUG)
-    logger.addHandler(hdlr)
-    logger.setLevel(logging.INFO)
-    loop = asyncio.get_event_loop()
-    loop.set_debug(True)
-    result = loop.run_until_complete(set_model_acc(sys.argv[8], sys.argv[9], sys.argv[7],
-                                                   sys.argv[6], sys.argv[1], sys.argv[2],
-                                                   sys.argv[4], sys.argv[5]))
-    loop.close()
+        raise
+    finally:
+        if 'controller' in locals():
+            await controller.disconnect()
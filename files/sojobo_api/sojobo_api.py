@@ -24,8 +24,8 @@ from sojobo_api.app import APP, create_response, redirect
 @APP.after_request
 def apply_caching(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Headers'] = 'Authorization,Content-Type,Location,api-key'
-    response.headers['Access-Control-Expose-Headers'] = 'Content-Type,Location'
+    response.headers['Access-Control-Allow-Headers'] = 'Authorization,Content-Type,If-None-Match,Location,api-key'
+    response.headers['Access-Control-Expose-Headers'] = 'Content-Type,ETag,Location,X-Next-Cursor,X-State-Updated'
     response.headers['Access-Control-Allow-Methods'] = 'GET,POST,PUT,DELETE,OPTIONS'
     response.headers['Accept'] = 'application/json'
     return response
@@ -0,0 +1,151 @@
+# !/usr/bin/env python3
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0325,c0103,e0401
+import asyncio
+from importlib import import_module
+import inspect
+import logging
+import signal
+import socket
+import sys
+import traceback
+sys.path.append('/opt')
+from sojobo_api import settings  #pylint: disable=C0413
+from sojobo_api.api import w_catalog, w_datastore as datastore, w_registry  #pylint: disable=C0413
+from sojobo_api.api.w_pool import POOL  #pylint: disable=C0413
+########################################################################################################################
+# WORKER
+########################################################################################################################
+# Long running jobs are queued in Redis by the API and run here, in one process
+# with one event loop, instead of in a fresh interpreter per operation. Every
+# task maps to a coroutine in scripts/, called with the arguments of the job.
+TASKS = {
+    'add_controller': ('add_controller', 'create_controller'),
+    'add_model': ('add_model', 'create_model'),
+    'remove_machine': ('remove_machine', 'remove_machine'),
+    'bundle_deployment': ('bundle_deployment', 'deploy_bundle'),
+    'add_unit': ('add_unit', 'add_unit'),
+    'add_ssh_key': ('add_ssh_key', 'add_ssh_key'),
+    'remove_ssh_key': ('remove_ssh_key', 'remove_ssh_key'),
+    'add_credential': ('add_credential', 'add_credential'),
+    'remove_credential': ('remove_credential', 'remove_credential'),
+    'set_controller_access': ('set_controller_access', 'set_controller_acc'),
+    'set_model_access': ('set_model_access', 'set_model_acc')
+}
+# Seconds a blocking pop waits for a job, must stay below the Redis socket timeout.
+POLL_TIMEOUT = 1
+# Every unit runs one worker, the jobs it starts are marked with its host so
+# the next start of the worker can fail the ones a crash left running.
+WORKER_NAME = socket.gethostname()
+logger = logging.getLogger('worker')
+
+
+def load_tasks():
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+    tasks = {}
+    for task, (module_name, function) in TASKS.items():
+        module = import_module('sojobo_api.scripts.{}'.format(module_name))
+        hdlr = logging.FileHandler('{}/log/{}.log'.format(settings.SOJOBO_API_DIR, module_name))
+        hdlr.setFormatter(formatter)
+        module.logger.addHandler(hdlr)
+        module.logger.setLevel(logging.INFO)
+        tasks[task] = getattr(module, function)
+    return tasks
+
+
+class Worker(object):
+    def __init__(self, tasks, concurrency):
+        self.tasks = tasks
+        self.slots = asyncio.Semaphore(concurrency)
+        self.running = set()
+        self.stopping = False
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        orphaned = await loop.run_in_executor(None, datastore.fail_orphaned_jobs, WORKER_NAME,
+                                              'The worker stopped while the job was running')
+        if orphaned:
+            logger.warning('Failed %s jobs left running by the previous worker: %s', len(orphaned), ', '.join(orphaned))
+        refresher = asyncio.ensure_future(self.refresh_catalog())
+        while not self.stopping:
+            await self.slots.acquire()
+            try:
+                job = await loop.run_in_executor(None, datastore.dequeue_job, POLL_TIMEOUT)
+            except Exception:  #pylint: disable=W0703
+                logger.exception('Could not fetch a job from the queue')
+                job = None
+                await asyncio.sleep(POLL_TIMEOUT)
+            if job is None:
+                self.slots.release()
+                continue
+            self.running.add(asyncio.ensure_future(self.execute(job)))
+        if self.running:
+            logger.info('Waiting for %s running jobs', len(self.running))
+            await asyncio.wait(self.running)
+        refresher.cancel()
+        await POOL.close_all()
+
+    async def refresh_catalog(self):
+        # The catalog is fetched with blocking http calls, off the event loop.
+        loop = asyncio.get_event_loop()
+        while not self.stopping:
+            try:
+                result = await loop.run_in_executor(None, w_catalog.refresh)
+                logger.info('Refreshed the bundle catalog: %s', result)
+            except Exception:  #pylint: disable=W0703
+                logger.exception('Could not refresh the bundle catalog')
+            await asyncio.sleep(int(settings.BUNDLE_REFRESH_INTERVAL))
+
+    async def execute(self, job):
+        try:
+            logger.info('Starting job %s: %s', job['id'], job['task'])
+            datastore.start_job(job['id'], WORKER_NAME)
+            task = self.tasks[job['task']]
+            if job['args'] is None:
+                raise Exception('The arguments of the job could not be decrypted')
+            # Tasks that report their progress get the id of their job.
+            if 'job_id' in inspect.signature(task).parameters:
+                await task(*job['args'], job_id=job['id'])
+            else:
+                await task(*job['args'])
+            datastore.finish_job(job['id'])
+            logger.info('Finished job %s', job['id'])
+        except Exception as e:  #pylint: disable=W0703
+            for line in traceback.format_exception(*sys.exc_info()):
+                logger.error(line)
+            datastore.finish_job(job['id'], str(e) or type(e).__name__)
+        finally:
+            self.running.discard(asyncio.Task.current_task())
+            self.slots.release()
+
+    def stop(self):
+        logger.info('Stopping worker')
+        self.stopping = True
+########################################################################################################################
+# START WORKER
+########################################################################################################################
+if __name__ == '__main__':
+    hdlr = logging.FileHandler('{}/log/worker.log'.format(settings.SOJOBO_API_DIR))
+    hdlr.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    logger.addHandler(hdlr)
+    logger.setLevel(logging.INFO)
+    worker = Worker(load_tasks(), int(settings.WORKER_CONCURRENCY))
+    main_loop = asyncio.get_event_loop()
+    main_loop.add_signal_handler(signal.SIGTERM, worker.stop)
+    main_loop.add_signal_handler(signal.SIGINT, worker.stop)
+    main_loop.add_signal_handler(signal.SIGHUP, w_registry.reload)
+    main_loop.run_until_complete(worker.run())
+    main_loop.close()
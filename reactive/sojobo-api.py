@@ -23,14 +23,15 @@ import subprocess
 from charmhelpers.core import unitdata
 from charmhelpers.core.templating import render
 from charmhelpers.core.hookenv import status_set, log, config, open_port, unit_private_ip, application_version_set, leader_get, leader_set
-from charmhelpers.core.host import service_restart, chownr, adduser
-from charms.reactive import hook, when, when_not, set_state, remove_state
+from charmhelpers.core.host import service_restart, service_stop, chownr, adduser
+from charms.reactive import hook, when, when_not, set_state, remove_state, is_state
 import charms.leadership
 
 
 API_DIR = '/opt/sojobo_api'
 USER = 'sojobo'
 GROUP = 'www-data'
+SERVER_PORT = 5000
 HOST = unit_private_ip()
 db = unitdata.kv()
 ###############################################################################
@@ -50,25 +51,27 @@ def install():
 def upgrade_charm():
     log('Updating Sojobo API')
     install_api()
+    if is_state('api.running'):
+        migrate_datastore()
+        restart_webapp()
     set_state('api.installed')
 
 
 @when('api.installed', 'nginx.passenger.available')
 @when_not('api.configured')
 def configure_webapp():
-    context = {'hostname': HOST, 'user': USER, 'rootdir': API_DIR}
-    render('http.conf', '/etc/nginx/sites-enabled/sojobo.conf', context)
+    render_webapp()
     open_port(config()['port'])
     service_restart('nginx')
     set_state('api.configured')
     status_set('blocked', 'Waiting for a connection with Redis')
 
 
-@when('config.changed', 'api.running')
-def config_changed():
-    context = {'hostname': HOST, 'user': USER, 'rootdir': API_DIR}
-    render('http.conf', '/etc/nginx/sites-enabled/sojobo.conf', context)
-    service_restart('nginx')
+@when('config.changed', 'api.running', 'redis.available')
+def config_changed(redis):
+    render_settings(redis)
+    render_webapp()
+    restart_webapp()
 
 
 @when('leadership.is_leader')
@@ -85,33 +88,34 @@ def set_secrets():
     set_state('secrets.configured')
 
 
+@when('leadership.is_leader')
+@when_not('token-secret.configured')
+def set_token_secret():
+    token_secret = leader_get().get('token-secret', sha256(os.urandom(256)).hexdigest())
+    leader_set({'token-secret': token_secret})
+    db.set('token-secret', token_secret)
+    set_state('token-secret.configured')
+
+
 @when('api.configured')
 @when_not('leadership.is_leader')
 def set_secrets_local():
     db.set('api-key', leader_get()['api-key'])
     db.set('password', leader_get()['password'])
+    token_secret = leader_get().get('token-secret')
+    if token_secret:
+        db.set('token-secret', token_secret)
+        set_state('token-secret.configured')
 
 
-@when('api.configured', 'redis.available')
+@when('api.configured', 'redis.available', 'token-secret.configured')
 @when_not('api.running')
 def connect_to_redis(redis):
-    redis_db = redis.redis_data()
     api_key = db.get('api-key')
     password = db.get('password')
-    render('settings.py', '{}/settings.py'.format(API_DIR), {
-        'API_KEY': api_key,
-        'JUJU_ADMIN_USER': 'admin',
-        'JUJU_ADMIN_PASSWORD': password,
-        'SOJOBO_API_DIR': API_DIR,
-        'LOCAL_CHARM_DIR': config()['charm-dir'],
-        'SOJOBO_IP': 'http://{}'.format(HOST),
-        'SOJOBO_USER': USER,
-        'REDIS_HOST': redis_db['host'],
-        'REDIS_PORT': redis_db['port'],
-        'REPO_NAME': config()['github-repo'],
-        'SOJOBO_API_PORT' : config()['port']
-    })
-    service_restart('nginx')
+    render_settings(redis)
+    migrate_datastore()
+    restart_webapp()
     status_set('active', 'admin-password: {} api-key: {}'.format(password, api_key))
     set_state('api.running')
 
@@ -185,9 +189,71 @@ def mergecopytree(src, dst, symlinks=False, ignore=None):
             shutil.copy2(src_item, dst_item)
 
 
+def render_settings(redis):
+    redis_db = redis.redis_data()
+    render('settings.py', '{}/settings.py'.format(API_DIR), {
+        'API_KEY': db.get('api-key'),
+        'JUJU_ADMIN_USER': 'admin',
+        'JUJU_ADMIN_PASSWORD': db.get('password'),
+        'SOJOBO_API_DIR': API_DIR,
+        'LOCAL_CHARM_DIR': config()['charm-dir'],
+        'SOJOBO_IP': 'http://{}'.format(HOST),
+        'SOJOBO_USER': USER,
+        'REDIS_HOST': redis_db['host'],
+        'REDIS_PORT': redis_db['port'],
+        'REPO_NAME': config()['github-repo'],
+        'SOJOBO_API_PORT' : config()['port'],
+        'JUJU_POOL_SIZE': config()['juju-pool-size'],
+        'JUJU_POOL_IDLE_TIMEOUT': config()['juju-pool-idle-timeout'],
+        'SERVER_PORT': SERVER_PORT,
+        'SERVER_THREADS': config()['server-threads'],
+        'REDIS_MAX_CONNECTIONS': config()['redis-max-connections'],
+        'REDIS_SOCKET_TIMEOUT': config()['redis-socket-timeout'],
+        'REDIS_MAX_RETRIES': config()['redis-max-retries'],
+        'WORKER_CONCURRENCY': config()['worker-concurrency'],
+        'JOB_TTL': config()['job-ttl'],
+        'MIRROR_IDLE_TIMEOUT': config()['model-mirror-idle-timeout'],
+        'RESPONSE_CACHE_SIZE': config()['response-cache-size'],
+        'AUTH_CACHE_TTL': config()['auth-cache-ttl'],
+        'TOKEN_SECRET': db.get('token-secret'),
+        'TOKEN_TTL': config()['token-ttl'],
+        'CONTROLLER_CONCURRENCY': config()['controller-concurrency'],
+        'CONTROLLER_TIMEOUT': config()['controller-timeout'],
+        'BUNDLE_DIR': config()['bundle-dir'],
+        'BUNDLE_REFRESH_INTERVAL': config()['bundle-refresh-interval']
+    })
+
+
+def render_webapp():
+    context = {'hostname': HOST, 'user': USER, 'rootdir': API_DIR,
+               'server_mode': config()['server-mode'], 'server_port': SERVER_PORT}
+    render('http.conf', '/etc/nginx/sites-enabled/sojobo.conf', context)
+    render('sojobo-api.service', '/etc/systemd/system/sojobo-api.service', context)
+    render('sojobo-worker.service', '/etc/systemd/system/sojobo-worker.service', context)
+    subprocess.check_call(['systemctl', 'daemon-reload'])
+    subprocess.check_call(['systemctl', 'enable', 'sojobo-worker'])
+    if config()['server-mode'] == 'threads':
+        subprocess.check_call(['systemctl', 'enable', 'sojobo-api'])
+    else:
+        subprocess.check_call(['systemctl', 'disable', 'sojobo-api'])
+
+
+def restart_webapp():
+    if config()['server-mode'] == 'threads':
+        service_restart('sojobo-api')
+    else:
+        service_stop('sojobo-api')
+    service_restart('sojobo-worker')
+    service_restart('nginx')
+
+
+def migrate_datastore():
+    subprocess.check_call(['python3.6', '{}/scripts/migrate_datastore.py'.format(API_DIR)])
+
+
 def install_api():
     for pkg in ['Jinja2', 'Flask', 'pyyaml', 'click', 'pygments', 'apscheduler',
-                'gitpython', 'redis', 'asyncio_extras', 'requests']:
+                'gitpython', 'redis', 'asyncio_extras', 'requests', 'aiohttp', 'cryptography']:
         subprocess.check_call(['python3.6', '-m', 'pip', 'install', pkg])
     subprocess.check_call(['python3.6', '-m', 'pip', 'install', 'juju==0.6.0'])
     mergecopytree('files/sojobo_api', API_DIR)
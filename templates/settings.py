@@ -9,3 +9,21 @@ REDIS_HOST = '{{REDIS_HOST}}'
 REDIS_PORT = '{{REDIS_PORT}}'
 REPO_NAME = '{{REPO_NAME}}'
 SOJOBO_API_PORT = '{{SOJOBO_API_PORT}}'
+JUJU_POOL_SIZE = {{JUJU_POOL_SIZE}}
+JUJU_POOL_IDLE_TIMEOUT = {{JUJU_POOL_IDLE_TIMEOUT}}
+SERVER_PORT = '{{SERVER_PORT}}'
+SERVER_THREADS = {{SERVER_THREADS}}
+REDIS_MAX_CONNECTIONS = {{REDIS_MAX_CONNECTIONS}}
+REDIS_SOCKET_TIMEOUT = {{REDIS_SOCKET_TIMEOUT}}
+REDIS_MAX_RETRIES = {{REDIS_MAX_RETRIES}}
+WORKER_CONCURRENCY = {{WORKER_CONCURRENCY}}
+JOB_TTL = {{JOB_TTL}}
+MIRROR_IDLE_TIMEOUT = {{MIRROR_IDLE_TIMEOUT}}
+RESPONSE_CACHE_SIZE = {{RESPONSE_CACHE_SIZE}}
+AUTH_CACHE_TTL = {{AUTH_CACHE_TTL}}
+TOKEN_SECRET = '{{TOKEN_SECRET}}'
+TOKEN_TTL = {{TOKEN_TTL}}
+CONTROLLER_CONCURRENCY = {{CONTROLLER_CONCURRENCY}}
+CONTROLLER_TIMEOUT = {{CONTROLLER_TIMEOUT}}
+BUNDLE_DIR = '{{BUNDLE_DIR}}'
+BUNDLE_REFRESH_INTERVAL = {{BUNDLE_REFRESH_INTERVAL}}
@@ -0,0 +1,106 @@
+# Copyright (C) 2017  Qrama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=c0111,c0301,c0413,e0401
+import asyncio
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+# settings.py is rendered by the charm, the batch only needs these values.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'files'))
+SETTINGS = types.ModuleType('sojobo_api.settings')
+SETTINGS.__dict__.update({'JUJU_ADMIN_USER': 'admin', 'JUJU_ADMIN_PASSWORD': 'admin', 'JUJU_POOL_SIZE': 10,
+                          'JUJU_POOL_IDLE_TIMEOUT': 60, 'SOJOBO_API_DIR': '/tmp'})
+sys.modules['sojobo_api.settings'] = SETTINGS
+import sojobo_api
+sojobo_api.settings = SETTINGS
+from juju.errors import JujuError
+from sojobo_api.api import w_batch, w_juju
+
+
+class Connection(object):
+    """model.connect(token) of a Model_Connection, yielding juju."""
+    def __init__(self, juju=None):
+        self.juju = juju
+
+    def __call__(self, token):
+        return self
+
+    async def __aenter__(self):
+        return self.juju
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class Juju(object):
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = []
+
+    async def deploy(self, charm, **kwargs):
+        self.calls.append(kwargs['num_units'])
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+async def returns(value):
+    return value
+
+
+class DeployAppTest(unittest.TestCase):
+    def test_error_is_raised(self):
+        juju = Juju([JujuError('cannot add application "mysql": charm not found')])
+        model = mock.Mock(connect=Connection(juju))
+        with self.assertRaises(JujuError):
+            run(w_juju.deploy_app(None, model, 'cs:mysql', name='mysql'))
+        self.assertEqual(juju.calls, [1])
+
+    def test_subordinate_is_deployed_without_units(self):
+        juju = Juju([JujuError('subordinate application must be deployed without units')])
+        model = mock.Mock(connect=Connection(juju))
+        run(w_juju.deploy_app(None, model, 'cs:telegraf', name='telegraf'))
+        self.assertEqual(juju.calls, [1, 0])
+
+
+class BatchTest(unittest.TestCase):
+    def test_failed_deploy_skips_dependent_operations(self):
+        app = mock.Mock()
+        app.set_config.return_value = returns(None)
+        entities = {'mysql': None, 'wordpress': app}
+        model = mock.Mock(connect=Connection())
+        operations = w_batch.parse_operations([
+            {'action': 'deploy', 'application': 'mysql'},
+            {'action': 'expose', 'application': 'mysql'},
+            {'action': 'config', 'application': 'wordpress', 'config': {'debug': 'true'}},
+            {'action': 'relate', 'app1': 'mysql', 'app2': 'wordpress'}
+        ])
+        with mock.patch.object(w_juju, 'get_application_entity', side_effect=lambda t, m, n: returns(entities[n])), \
+                mock.patch.object(w_juju, 'deploy_app', side_effect=JujuError('charm not found')), \
+                mock.patch.object(w_juju, 'add_relation') as add_relation:
+            results = run(w_batch.run_batch(None, model, operations))
+        self.assertEqual([r['state'] for r in results], ['failed', 'skipped', 'done', 'skipped'])
+        self.assertEqual(results[0]['error'], 'charm not found')
+        add_relation.assert_not_called()
+        app.expose.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()